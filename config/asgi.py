@@ -15,6 +15,8 @@ from channels.routing import ProtocolTypeRouter
 
 from django.core.asgi import get_asgi_application
 
+from televi1.utils.lifespan import lifespan
+
 # This allows easy placement of apps within the interior
 # my_awesome_project directory.
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
@@ -29,5 +31,6 @@ django_asgi_app = get_asgi_application()
 application = ProtocolTypeRouter(
     {
         "http": django_asgi_app,
+        "lifespan": lifespan,
     }
 )
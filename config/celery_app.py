@@ -1,6 +1,7 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
@@ -15,3 +16,17 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
+
+
+@worker_init.connect
+def _start_metrics_server(**kwargs):
+    from televi1.utils.metrics import start_metrics_server
+
+    start_metrics_server()
+
+
+@worker_process_shutdown.connect
+def _mark_process_dead(pid, **kwargs):
+    from televi1.utils.metrics import mark_process_dead
+
+    mark_process_dead(pid)
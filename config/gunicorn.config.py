@@ -1 +1,7 @@
 worker_class = "uvicorn.workers.UvicornWorker"
+
+
+def child_exit(server, worker):
+    from televi1.utils.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
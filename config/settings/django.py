@@ -79,14 +79,43 @@ except django.core.exceptions.ImproperlyConfigured:
         }
     }
     DATABASES["default"]["CONN_MAX_AGE"] = env.int("CONN_MAX_AGE", default=0)
+# the connections of a process are pooled and shared among its threads (asgi, the orm executor)
+if env.bool("DATABASE_POOL", default=False):
+    DATABASES["default"]["ENGINE"] = "televi1.utils.postgresql_pool"
+    DATABASES["default"]["OPTIONS"] = {
+        **DATABASES["default"].get("OPTIONS", {}),
+        "pool": {
+            "max_size": env.int("DATABASE_POOL_MAX_SIZE", default=20),
+            "timeout": env.float("DATABASE_POOL_TIMEOUT", default=10),
+        },
+    }
+    # a closed connection goes back to the pool, keeping it open per thread would defeat it
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+# read only replicas of default, the read only telegram handlers read from them (televi1.utils.replicas)
+DATABASE_REPLICAS = []
+for i, replica_url in enumerate(env.list("DATABASE_REPLICA_URLS", default=[])):
+    replica = env.db_url_config(replica_url)
+    replica.update(
+        ENGINE=DATABASES["default"]["ENGINE"],
+        CONN_MAX_AGE=DATABASES["default"].get("CONN_MAX_AGE", 0),
+        TEST={"MIRROR": "default"},
+    )
+    if "pool" in DATABASES["default"].get("OPTIONS", {}):
+        replica["OPTIONS"] = {**replica.get("OPTIONS", {}), "pool": DATABASES["default"]["OPTIONS"]["pool"]}
+    DATABASES[f"replica_{i}"] = replica
+    DATABASE_REPLICAS.append(f"replica_{i}")
+DATABASE_ROUTERS = ["televi1.utils.replicas.ReplicaRouter"]
+# reads of a user stay on the primary this many seconds after it writes, should be above the replication lag
+DATABASE_REPLICA_PIN_SECONDS = env.float("DATABASE_REPLICA_PIN_SECONDS", default=10)
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # CACHES
 # ------------------------------------------------------------------------------
+REDIS_URL = env("REDIS_URL")
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": env("REDIS_URL"),
+        "LOCATION": REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
             # Mimicing memcache behavior.
@@ -263,6 +292,7 @@ LOGGING = {
         "verbose": {
             "format": "%(levelname)s %(asctime)s %(module)s %(process)d %(thread)d %(message)s",
         },
+        "message": {"format": "%(message)s"},
     },
     "handlers": {
         "console": {
@@ -279,6 +309,17 @@ LOGGING = {
             "filters": ["ignore_autoreload"],
             "formatter": "verbose",
         },
+        "traces": {
+            "level": "INFO",
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": os.path.join(logs_dir, "traces.log"),
+            "backupCount": env.int("MAX_TRACE_FILE_COUNT", default=3),
+            "maxBytes": 50 * 1024 * 1024,
+            "formatter": "message",
+            "delay": True,
+        },
     },
     "root": {"level": "INFO", "handlers": ["console", "file"]},
+    # the spans of TRACING_EXPORTER=file, see televi1.utils.tracing
+    "loggers": {"televi1.traces": {"level": "INFO", "handlers": ["traces"], "propagate": False}},
 }
@@ -1,6 +1,8 @@
+from pathlib import Path
+
 from environ import environ
 
-from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, BareFilesPathWrapper, SimpleFilesPathWrapper, TelegramAPIServer
 
 from ._setup import env
 
@@ -19,9 +21,88 @@ if TELEGRAM_PROXY:
     TELEGRAM_PROXY = environ.urlunparse(TELEGRAM_PROXY)
 
 TELEGRAM_MIDDLEWARE = [
+    "televi1.telegram_bot.t_middleware.TracingMiddleware",
+    "televi1.telegram_bot.t_middleware.MetricsMiddleware",
+    "televi1.telegram_bot.t_middleware.ProfilingMiddleware",
+    "televi1.telegram_bot.t_middleware.UpdateDeadlineMiddleware",
     "televi1.telegram_bot.t_middleware.AuthenticationMiddleware",
     "televi1.telegram_bot.t_middleware.CommonMiddleware",
 ]
+# these run around the handler itself, after the filters, so they see the flags of the handler
+TELEGRAM_HANDLER_MIDDLEWARE = [
+    "televi1.telegram_bot.t_middleware.HandlerMetricsMiddleware",
+    "televi1.telegram_bot.t_middleware.ProfilingHandlerMiddleware",
+    "televi1.telegram_bot.t_middleware.TracingHandlerMiddleware",
+    "televi1.telegram_bot.t_middleware.ReplicaReadsMiddleware",
+]
 TELEGRAM_WEBHOOK_FLYING_DOMAINS = env.list("TELEGRAM_WEBHOOK_FLYING_DOMAINS")
 TELEGRAM_PREFER_REPLY_TO_WEBHOOK = env.bool("TELEGRAM_PREFER_REPLY_TO_WEBHOOK")
-TELEGRAM_SESSION = AiohttpSession(proxy=TELEGRAM_PROXY)
+# a self-hosted telegram-bot-api server instead of api.telegram.org, e.g. http://telegram-bot-api:8081
+TELEGRAM_API_SERVER_URL = env.str("TELEGRAM_API_SERVER_URL", default=None)
+TELEGRAM_API_SERVER = PRODUCTION
+if TELEGRAM_API_SERVER_URL:
+    # in local mode the files are read from the disk of the server, mounted at TELEGRAM_API_LOCAL_FILES_PATH here
+    TELEGRAM_API_SERVER = TelegramAPIServer.from_base(
+        TELEGRAM_API_SERVER_URL,
+        is_local=env.bool("TELEGRAM_API_SERVER_LOCAL", default=True),
+        wrap_local_file=(
+            SimpleFilesPathWrapper(
+                server_path=Path(env.str("TELEGRAM_API_SERVER_FILES_PATH", default="/var/lib/telegram-bot-api")),
+                local_path=Path(env.str("TELEGRAM_API_LOCAL_FILES_PATH")),
+            )
+            if env.str("TELEGRAM_API_LOCAL_FILES_PATH", default=None)
+            else BareFilesPathWrapper()
+        ),
+    )
+# where the api server sends the updates, the webhook domains of the bots are used if it's not set.
+# a self-hosted server can reach the webhooks over the local network, e.g. http://django:5000
+TELEGRAM_API_WEBHOOK_BASE_URL = env.str("TELEGRAM_API_WEBHOOK_BASE_URL", default=None)
+# the session of the bots is made from these on first use, see telegram_bot.session.get_session
+# the calls of a bot fail at once for BREAKER_COOLDOWN seconds after BREAKER_FAILURES of them failed
+# in BREAKER_WINDOW seconds, so a broken bot or proxy does not hold the workers until the timeouts
+TELEGRAM_BREAKER_FAILURES = env.int("TELEGRAM_BREAKER_FAILURES", default=5)
+TELEGRAM_BREAKER_WINDOW = env.float("TELEGRAM_BREAKER_WINDOW", default=30)
+TELEGRAM_BREAKER_COOLDOWN = env.float("TELEGRAM_BREAKER_COOLDOWN", default=30)
+# the limits of telegram, about 30 messages per second per bot, one per second per chat and 20 per minute
+# per group, shared by all of the processes. the bursts let the messages of a bundle go out at once, the
+# ones of a bigger bundle wait for the rate (a second each in a private chat) and what's left when
+# TELEGRAM_UPDATE_DEADLINE is up goes to the redelivery
+TELEGRAM_RATE_LIMIT = env.bool("TELEGRAM_RATE_LIMIT", default=True)
+TELEGRAM_BOT_RATE = env.float("TELEGRAM_BOT_RATE", default=30)
+TELEGRAM_BOT_BURST = env.int("TELEGRAM_BOT_BURST", default=30)
+TELEGRAM_CHAT_RATE = env.float("TELEGRAM_CHAT_RATE", default=1)
+TELEGRAM_CHAT_BURST = env.int("TELEGRAM_CHAT_BURST", default=20)
+TELEGRAM_GROUP_RATE = env.float("TELEGRAM_GROUP_RATE", default=20 / 60)
+TELEGRAM_GROUP_BURST = env.int("TELEGRAM_GROUP_BURST", default=10)
+# connections to the bot api per event loop, all of the bots share them
+TELEGRAM_HTTP_POOL_SIZE = env.int("TELEGRAM_HTTP_POOL_SIZE", default=100)
+TELEGRAM_HTTP_POOL_SIZE_PER_HOST = env.int("TELEGRAM_HTTP_POOL_SIZE_PER_HOST", default=0)
+TELEGRAM_HTTP_KEEPALIVE = env.float("TELEGRAM_HTTP_KEEPALIVE", default=30)
+TELEGRAM_HTTP_DNS_CACHE_TTL = env.int("TELEGRAM_HTTP_DNS_CACHE_TTL", default=300)
+# seconds the telegram api calls of an update may take altogether
+TELEGRAM_UPDATE_DEADLINE = env.float("TELEGRAM_UPDATE_DEADLINE", default=20)
+# seconds the webhook waits for the update, then it answers and the update goes on in the background,
+# the method it returns is called instead of being the answer of the webhook
+TELEGRAM_WEBHOOK_TIMEOUT = env.float("TELEGRAM_WEBHOOK_TIMEOUT", default=5)
+# fraction of the updates that are profiled, see the update profiles in the admin. it's off by default
+TELEGRAM_PROFILE_SAMPLE_RATE = env.float("TELEGRAM_PROFILE_SAMPLE_RATE", default=0)
+# seconds over which the profile of an update is kept, every update is profiled (without the allocations) if set
+TELEGRAM_PROFILE_SLOW_SECONDS = env.float("TELEGRAM_PROFILE_SLOW_SECONDS", default=None)
+TELEGRAM_PROFILE_RETENTION_DAYS = env.int("TELEGRAM_PROFILE_RETENTION_DAYS", default=7)
+# messages per second a single bot sends out of band (broadcasts, notifications), telegram allows about 30
+TELEGRAM_BROADCAST_RATE = env.float("TELEGRAM_BROADCAST_RATE", default=25)
+TELEGRAM_BROADCAST_CHUNK_SIZE = env.int("TELEGRAM_BROADCAST_CHUNK_SIZE", default=200)
+# times an out of band message is sent again after a flood wait, a timeout or an error of telegram
+TELEGRAM_SEND_MAX_RETRIES = env.int("TELEGRAM_SEND_MAX_RETRIES", default=3)
+# times the failed messages of an uploader link are sent again before giving up, see telegram_bot.redelivery
+TELEGRAM_REDELIVERY_MAX_ATTEMPTS = env.int("TELEGRAM_REDELIVERY_MAX_ATTEMPTS", default=6)
+# threads running the orm calls of the telegram updates, each one keeps its own database connection
+TELEGRAM_ORM_THREADS = env.int("TELEGRAM_ORM_THREADS", default=10)
+# seconds a connection of those threads is reused before it's reopened, unless DATABASE_POOL is on
+TELEGRAM_ORM_CONN_MAX_AGE = env.int("TELEGRAM_ORM_CONN_MAX_AGE", default=300)
+
+# tracing of the updates, see televi1.utils.tracing. "file" or "otlp", it's off by default
+TRACING_EXPORTER = env.str("TRACING_EXPORTER", default=None)
+# fraction of the updates that are traced
+TRACING_SAMPLE_RATE = env.float("TRACING_SAMPLE_RATE", default=1)
+TRACING_OTLP_ENDPOINT = env.str("TRACING_OTLP_ENDPOINT", default="http://localhost:4318/v1/traces")
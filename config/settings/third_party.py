@@ -17,11 +17,40 @@ CELERY_RESULT_SERIALIZER = "json"
 CELERY_TASK_TIME_LIMIT = 5 * 60
 CELERY_TASK_SOFT_TIME_LIMIT = 60
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    "flush-link-stats": {
+        "task": "televi1.telegram_bot.tasks.flush_link_stats",
+        "schedule": timedelta(seconds=env.int("TELEGRAM_STATS_FLUSH_INTERVAL", default=60)),
+    },
+    "redeliver-messages": {
+        "task": "televi1.telegram_bot.tasks.redeliver_messages",
+        "schedule": timedelta(seconds=5),
+    },
+    "resume-stale-broadcasts": {
+        "task": "televi1.telegram_bot.tasks.resume_stale_broadcasts",
+        "schedule": timedelta(minutes=2),
+    },
+    "reconcile-webhooks": {
+        "task": "televi1.telegram_bot.tasks.reconcile_webhooks",
+        "schedule": timedelta(hours=1),
+    },
+    "purge-update-profiles": {
+        "task": "televi1.telegram_bot.tasks.purge_update_profiles",
+        "schedule": timedelta(days=1),
+    },
+}
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#worker-send-task-events
 CELERY_WORKER_SEND_TASK_EVENTS = True
 CELERY_TASK_SEND_SENT_EVENT = True
 CELERY_TASK_EAGER_PROPAGATES = True
 
+# prometheus-client
+# ------------------------------------------------------------------------------
+# the scrapes of /metrics send it as a bearer token, /metrics is a 404 if it's not set
+METRICS_TOKEN = env.str("METRICS_TOKEN", default=None)
+# the port celery and the polling processes serve their metrics on, they don't if it's not set
+METRICS_PORT = env.int("METRICS_PORT", default=None)
+
 # django-axes
 # ------------------------------------------------------------------------------
 AXES_CLIENT_IP_CALLABLE = "televi1.utils.ip.get_client_ip"
@@ -10,12 +10,15 @@ import televi1.telegram_bot.urls
 from televi1.graphql.schema import schema
 from televi1.graphql.views import GraphQLView
 from televi1.utils.decorators import csrf_exempt
+from televi1.utils.metrics import metrics_view
 
 urlpatterns = [
     # Django Admin, use {% url 'admin:index' %}
     path(settings.ADMIN_URL, admin.site.urls),
     # Telegram webhook handler
     path("", include(televi1.telegram_bot.urls)),
+    # Prometheus metrics
+    path("metrics", metrics_view),
     # Graphql url
     path("graphql/", csrf_exempt(GraphQLView.as_view(graphiql=settings.GRAPHIQL, schema=schema))),
     # REST API base url
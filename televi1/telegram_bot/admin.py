@@ -4,13 +4,21 @@ from asgiref.sync import async_to_sync
 
 import aiogram
 from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
 
-from . import models
+from . import models, reconcile, tasks
 
 
 @admin.register(models.TelegramBot)
 class TelegramBotAdmin(admin.ModelAdmin):
-    actions = ("set_webhook_action", "delete_webhook_action", "get_webhook_info_action")
+    actions = ("set_webhook_action", "delete_webhook_action", "get_webhook_info_action", "reconcile_webhook_action")
+    list_display = ["id", "tusername", "is_master", "is_revoked", "is_powered_off", "webhook_status"]
+    list_filter = ["is_master", "is_revoked", "webhook_status"]
 
     @async_to_sync
     async def set_webhook_action(what, self, request, queryset):
@@ -61,7 +69,110 @@ class TelegramBotAdmin(admin.ModelAdmin):
         tasks = [get_webhook_info(bot) async for bot in queryset]
         await asyncio.gather(*tasks)
 
+    @async_to_sync
+    async def reconcile_webhook_action(what, self, request, queryset):
+        counts = await reconcile.reconcile_all(queryset, concurrency=10)
+        self.message_user(request, ", ".join(f"{k}: {v}" for k, v in counts.items()))
+
 
 @admin.register(models.TelegramFile)
 class TelegramFileAdmin(admin.ModelAdmin):
     list_display = ["id", "file_id", "file_unique_id"]
+
+
+@admin.register(models.UploaderLinkStats)
+class UploaderLinkStatsAdmin(admin.ModelAdmin):
+    list_display = ["link", "opens", "unique_users", "deliveries", "updated_at"]
+    list_select_related = ["link"]
+    raw_id_fields = ["link"]
+
+
+@admin.register(models.TelegramUploaderStats)
+class TelegramUploaderStatsAdmin(admin.ModelAdmin):
+    list_display = ["uploader", "opens", "unique_users", "deliveries", "updated_at"]
+    list_select_related = ["uploader"]
+    raw_id_fields = ["uploader"]
+
+
+@admin.register(models.Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    actions = ("start_action",)
+    list_display = ["id", "tbot", "status", "sent_count", "failed_count", "blocked_count", "created_at", "finished_at"]
+    list_filter = ["status"]
+    raw_id_fields = ["tbot", "created_by", "message"]
+    readonly_fields = ["last_tuser_id", "sent_count", "failed_count", "blocked_count", "lease_until", "finished_at"]
+
+    def start_action(self, request, queryset):
+        for broadcast in queryset.filter(
+            status__in=(models.Broadcast.Status.PENDING, models.Broadcast.Status.RUNNING)
+        ):
+            tasks.run_broadcast.delay(broadcast_id=broadcast.id)
+            self.message_user(request, f"{str(broadcast)} enqueued", level=messages.SUCCESS)
+
+
+@admin.register(models.OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    actions = ("retry_action",)
+    list_display = ["id", "task", "created_at", "relayed_at", "attempts", "delivered_at", "failed_at"]
+    list_filter = [("failed_at", admin.EmptyFieldListFilter), "task"]
+    readonly_fields = ["task", "kwargs", "relayed_at", "attempts", "claimed_at", "delivered_at", "failed_at"]
+
+    def retry_action(self, request, queryset):
+        retried = queryset.filter(failed_at__isnull=False).update(
+            failed_at=None, attempts=0, relayed_at=None, updated_at=timezone.now()
+        )
+        self.message_user(request, f"{retried} messages are relayed again", level=messages.SUCCESS)
+
+
+@admin.register(models.UpdateProfile)
+class UpdateProfileAdmin(admin.ModelAdmin):
+    list_display = ["id", "created_at", "update_type", "handler", "duration", "samples", "reason", "tbot"]
+    list_filter = ["reason", "update_type", "handler"]
+    search_fields = ["handler", "update_id"]
+    raw_id_fields = ["tbot"]
+    readonly_fields = [
+        "tbot",
+        "update_id",
+        "update_type",
+        "handler",
+        "reason",
+        "duration",
+        "samples",
+        "downloads",
+        "cpu_profile",
+        "allocations",
+    ]
+    # the files of the profiles, cpu is in the folded format of flamegraph.pl and speedscope
+    downloads_files = {"cpu": ("cpu_profile", "folded"), "allocations": ("allocations", "txt")}
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:object_id>/download/<str:kind>/",
+                self.admin_site.admin_view(self.download_view),
+                name="telegram_bot_updateprofile_download",
+            ),
+            *super().get_urls(),
+        ]
+
+    def download_view(self, request, object_id: int, kind: str):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        if kind not in self.downloads_files:
+            raise Http404
+        obj = get_object_or_404(models.UpdateProfile, id=object_id)
+        field_name, extension = self.downloads_files[kind]
+        response = HttpResponse(getattr(obj, field_name), content_type="text/plain; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="update-profile-{obj.id}-{kind}.{extension}"'
+        return response
+
+    @admin.display(description="downloads")
+    def downloads(self, obj: models.UpdateProfile):
+        return format_html(
+            '<a href="{}">cpu</a> / <a href="{}">allocations</a>',
+            reverse("admin:telegram_bot_updateprofile_download", args=(obj.id, "cpu")),
+            reverse("admin:telegram_bot_updateprofile_download", args=(obj.id, "allocations")),
+        )
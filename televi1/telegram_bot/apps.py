@@ -1,5 +1,6 @@
 from django.apps import AppConfig
 from django.conf import settings
+from django.db.backends.signals import connection_created
 from django.utils.module_loading import import_string
 
 
@@ -7,8 +8,29 @@ class UsersConfig(AppConfig):
     name = "televi1.telegram_bot"
 
     def ready(self):
-        from . import dispatchers
+        from televi1.utils import orm
+        from televi1.utils.celery import worker_loop
+        from televi1.utils.lifespan import lifespan
+        from televi1.utils.metrics import install_query_counter
+        from televi1.utils.tracing import install_query_tracer
+
+        from . import dispatchers, metrics
+        from .session import get_session
 
         for middleware_path in settings.TELEGRAM_MIDDLEWARE:
             Middleware = import_string(middleware_path)
             dispatchers.dp.update.middleware(Middleware())
+        for middleware_path in settings.TELEGRAM_HANDLER_MIDDLEWARE:
+            middleware = import_string(middleware_path)()
+            for event_name, observer in dispatchers.dp.observers.items():
+                if event_name not in ("update", "error"):
+                    observer.middleware(middleware)
+
+        for callbacks in (lifespan, worker_loop):
+            callbacks.on_startup.append(lambda: get_session().start())
+            callbacks.on_shutdown.append(lambda: get_session().close())
+
+        connection_created.connect(install_query_counter)
+        if metrics.ORM_QUEUE_WAIT_SECONDS.observe not in orm.wait_observers:
+            orm.wait_observers.append(metrics.ORM_QUEUE_WAIT_SECONDS.observe)
+        connection_created.connect(install_query_tracer)
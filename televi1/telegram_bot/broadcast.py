@@ -0,0 +1,87 @@
+"""
+sending one message to all the users of a bot
+
+recipients are streamed with keyset pagination over TelegramIdentity.id and the progress is
+checkpointed after every chunk, so a crashed or timed out worker resumes from the last chunk.
+every checkpoint renews the lease of the worker and a worker that lost its lease stops
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+import aiogram
+import aiogram.exceptions
+from django.conf import settings
+
+from . import models
+from .identity import identity_cache
+from .sender import Pacer, SendResult, send_with_retry
+
+logger = logging.getLogger(__name__)
+
+
+async def get_payload(broadcast: models.Broadcast) -> tuple[str, dict]:
+    if broadcast.message_id:
+        message = await models.TelegramMessage.objects.select_related_all_entities().aget(id=broadcast.message_id)
+        return await message.to_aio_params()
+    return aiogram.Bot.send_message.__name__, {"text": broadcast.text}
+
+
+async def run(broadcast_id: int, time_budget: float) -> bool:
+    """
+    sends the broadcast for at most about `time_budget` seconds
+    returns True if there is more left to send
+    """
+    lease = timedelta(seconds=time_budget + settings.TELEGRAM_BROADCAST_CHUNK_SIZE / settings.TELEGRAM_BROADCAST_RATE)
+    broadcast = await models.Broadcast.objects.claim(broadcast_id, lease=lease)
+    if broadcast is None:
+        return False
+    aiobot = broadcast.tbot.get_aiobot()
+    method_name, params = await get_payload(broadcast)
+    pacer = Pacer(settings.TELEGRAM_BROADCAST_RATE)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + time_budget
+    cursor = broadcast.last_tuser_id
+
+    while loop.time() < deadline:
+        recipients = [
+            i
+            async for i in models.TelegramIdentity.objects.filter(
+                tbot_id=broadcast.tbot_id, has_blocked_bot=False, id__gt=cursor
+            )
+            .order_by("id")
+            .values_list("id", "user_tid")[: settings.TELEGRAM_BROADCAST_CHUNK_SIZE]
+        ]
+        if not recipients:
+            await broadcast.finish()
+            return False
+
+        # a recipient that raised is counted as failed, the progress is saved before anything goes up
+        results = await asyncio.gather(
+            *(send_with_retry(aiobot, pacer, method_name, user_tid, params) for _, user_tid in recipients),
+            return_exceptions=True,
+        )
+        errors = [i for i in results if isinstance(i, BaseException)]
+        blocked = [recipient for recipient, r in zip(recipients, results) if r == SendResult.BLOCKED]
+        blocked_ids = [tuser_id for tuser_id, _ in blocked]
+        if blocked_ids:
+            await models.TelegramIdentity.objects.filter(id__in=blocked_ids).aupdate(has_blocked_bot=True)
+            await identity_cache.forget([(broadcast.tbot_id, user_tid) for _, user_tid in blocked])
+        cursor = recipients[-1][0]
+        checkpointed = await broadcast.checkpoint(
+            lease,
+            last_tuser_id=cursor,
+            sent=results.count(SendResult.SENT),
+            failed=results.count(SendResult.FAILED) + len(errors),
+            blocked=len(blocked_ids),
+        )
+        if any(isinstance(i, aiogram.exceptions.TelegramUnauthorizedError) for i in errors):
+            logger.warning(f"the token of bot {broadcast.tbot_id} was revoked, broadcast {broadcast.id} failed")
+            await broadcast.fail()
+            return False
+        if errors:
+            raise errors[0]
+        if not checkpointed:
+            return False
+
+    return await broadcast.release()
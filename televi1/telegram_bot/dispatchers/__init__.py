@@ -3,12 +3,19 @@ import os
 from redis.asyncio import Redis
 
 from aiogram import Dispatcher
-from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+from aiogram.fsm.storage.redis import DefaultKeyBuilder
 
+from ..fsm import BatchedRedisStorage
+from ..t_middleware import RedisBatchMiddleware
 from .base import router as base_router
 
-fsm_storage = RedisStorage(Redis.from_url(os.getenv("REDIS_URL")), key_builder=DefaultKeyBuilder(with_bot_id=True))
+fsm_storage = BatchedRedisStorage(
+    Redis.from_url(os.getenv("REDIS_URL")), key_builder=DefaultKeyBuilder(with_bot_id=True)
+)
 
-dp = Dispatcher(storage=fsm_storage)
+# the fsm middleware is registered by hand, the redis batch has to be opened before it reads the state
+dp = Dispatcher(storage=fsm_storage, disable_fsm=True)
+dp.update.outer_middleware(RedisBatchMiddleware(dp.fsm))
+dp.update.outer_middleware(dp.fsm)
 # dp = Dispatcher()
 dp.include_router(base_router)
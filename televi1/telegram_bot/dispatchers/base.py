@@ -14,14 +14,14 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, KeyboardButtonRequestChat, Message
 from aiogram.utils.deep_linking import create_deep_link
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+from django.db import DEFAULT_DB_ALIAS
 from django.http import QueryDict
 from django.template.loader import render_to_string
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy as __
 
-from ...users.models import User
-from .. import models
-from ..models import TelegramUser
+from .. import models, redelivery, stats
+from ..models import TelegramIdentity
 
 router = Router(name=__name__)
 
@@ -61,15 +61,13 @@ class MasterBotFilter(Filter):
 
 class OwnerBotFilter(Filter):
     async def __call__(
-        self, update: Union[Message, CallbackQuery], user: TelegramUser, bot_obj: models.TelegramBot, **kwargs
+        self, update: Union[Message, CallbackQuery], user: TelegramIdentity, bot_obj: models.TelegramBot, **kwargs
     ) -> bool:
         assert update.from_user.id == user.user_tid
-        added_by = await sync_to_async(bot_obj.added_by.get_real_instance)()
-        if isinstance(added_by, TelegramUser):
-            return added_by.user_tid == update.from_user.id
-        if not bot_obj.is_master:
-            logging.info(f"owner of {str(bot_obj)} is not of type TelegramUser")
-        return False
+        owner_tid = await bot_obj.get_owner_tid()
+        if owner_tid is None and not bot_obj.is_master:
+            logging.info(f"owner of {str(bot_obj)} has no telegram identity")
+        return owner_tid == update.from_user.id
 
 
 class StartCommandQueryFilter(CommandStart):
@@ -114,11 +112,13 @@ class SimpleButtonCallbackData(CallbackData, prefix="simplebutton"):
 
 @router.message(*MASTER_PATH_FILTERS, CommandStart())
 @router.message(*MASTER_PATH_FILTERS, aiogram.F.text == CANCEL_R)
+# the most queries the handler may run, whatever the size of its data, see tests/test_query_budgets.py
+@aiogram.flags.query_budget(1)
 async def master_command_start_handler(
-    message: Message, user: User, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
+    message: Message, user: TelegramIdentity, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
     await state.clear()
-    have_any_bots = await models.TelegramBot.objects.filter(added_by=user).aexists()
+    have_any_bots = await models.TelegramBot.objects.filter(added_by_id=user.user_id).aexists()
     ikbuilder = InlineKeyboardBuilder()
     ikbuilder.button(
         text=str(REGISTER_NEW_BOT_R),
@@ -135,6 +135,7 @@ async def master_command_start_handler(
 
 @router.message(*SUB_OWNER_PATH_FILTERS, CommandStart(magic=aiogram.F.args == None))
 @router.message(*SUB_OWNER_PATH_FILTERS, aiogram.F.text == CANCEL_R)
+@aiogram.flags.query_budget(0)
 async def sub_command_start_handler(
     message: Message, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot, *args, **kwargs
 ) -> Optional[aiogram.methods.TelegramMethod]:
@@ -173,16 +174,20 @@ class BotCallbackData(CallbackData, prefix="content"):
 
 
 @router.callback_query(
-    *SUB_OWNER_PATH_FILTERS, SimpleButtonCallbackData.filter(aiogram.F.button_name == SimpleButtonName.CONTENT_LIST)
+    *SUB_OWNER_PATH_FILTERS,
+    SimpleButtonCallbackData.filter(aiogram.F.button_name == SimpleButtonName.CONTENT_LIST),
+    flags={"replica_reads": True},
 )
+@aiogram.flags.query_budget(1)
 async def content_list_handler(
-    query: CallbackQuery, user: TelegramUser, aiobot: Bot, bot_obj: models.TelegramBot
+    query: CallbackQuery, user: TelegramIdentity, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
-    contents_qs = models.TelegramUploader.objects.filter(created_by=user, tbot_id=user.tbot_id)
+    contents_qs = models.TelegramUploader.objects.filter(created_by_id=user.user_id, tbot_id=user.tbot_id)
+    contents = [i async for i in contents_qs]
     ikbuilder = InlineKeyboardBuilder()
-    async for i in contents_qs:
+    for i in contents:
         ikbuilder.button(text=i.name, callback_data=ContentCallbackData(pk=i.pk, action=ContentAction.GET))
-    if not await contents_qs.aexists():
+    if not contents:
         text = _("شما هنوز مطلبی اضافه نکرده اید.")
         ikbuilder.button(
             text=str(NEW_CONTENT_R), callback_data=SimpleButtonCallbackData(button_name=SimpleButtonName.NEW_CONTENT)
@@ -192,41 +197,51 @@ async def content_list_handler(
     return query.message.edit_text(text, reply_markup=ikbuilder.as_markup())
 
 
-@router.callback_query(*SUB_OWNER_PATH_FILTERS, ContentCallbackData.filter(aiogram.F.action == ContentAction.GET))
+@router.callback_query(
+    *SUB_OWNER_PATH_FILTERS,
+    ContentCallbackData.filter(aiogram.F.action == ContentAction.GET),
+    flags={"replica_reads": True},
+)
+@aiogram.flags.query_budget(2)
 async def content_detail_handler(
     query: CallbackQuery,
     callback_data: ContentCallbackData,
-    user: TelegramUser,
+    user: TelegramIdentity,
     aiobot: Bot,
     bot_obj: models.TelegramBot,
 ) -> Optional[aiogram.methods.TelegramMethod]:
     try:
-        telegram_uploader_obj = await models.TelegramUploader.objects.filter(
-            created_by=user, tbot_id=user.tbot_id
-        ).aget(pk=callback_data.pk)
+        telegram_uploader_obj = (
+            await models.TelegramUploader.objects.filter(created_by_id=user.user_id, tbot_id=user.tbot_id)
+            .select_related("stats")
+            .aget(pk=callback_data.pk)
+        )
     except models.TelegramUploader.DoesNotExist:
         return query.answer(_("پیدا نشد"))
+    uploader_stats = getattr(telegram_uploader_obj, "stats", None)
+    links = [i async for i in telegram_uploader_obj.uploaderlinks.select_related("stats").order_by("created_at")]
 
     rkbuilder = InlineKeyboardBuilder()
     rkbuilder.button(
         text=_("کرفتن لینک"),
         callback_data=ContentCallbackData(pk=telegram_uploader_obj.pk, action=ContentAction.GET_LINK),
     )
-    text = render_to_string("telegram_bot/content_detail.thtml")
+    text = render_to_string("telegram_bot/content_detail.thtml", {"uploader_stats": uploader_stats, "links": links})
     return query.message.edit_text(text, reply_markup=rkbuilder.as_markup())
 
 
 @router.callback_query(*SUB_OWNER_PATH_FILTERS, ContentCallbackData.filter(aiogram.F.action == ContentAction.GET_LINK))
+@aiogram.flags.query_budget(2)
 async def content_get_link_handler(
     query: CallbackQuery,
     callback_data: ContentCallbackData,
-    user: TelegramUser,
+    user: TelegramIdentity,
     aiobot: Bot,
     bot_obj: models.TelegramBot,
 ) -> Optional[aiogram.methods.TelegramMethod]:
     try:
         telegram_uploader_obj = await models.TelegramUploader.objects.filter(
-            created_by=user, tbot_id=user.tbot_id
+            created_by_id=user.user_id, tbot_id=user.tbot_id
         ).aget(pk=callback_data.pk)
     except models.TelegramUploader.DoesNotExist:
         return query.answer(_("پیدا نشد"))
@@ -241,8 +256,11 @@ async def content_get_link_handler(
 
 
 @router.message(
-    ~MasterBotFilter(), StartCommandQueryFilter(query_magic=query_magic_dispatcher(QueryPathName.UPLOADER_LINK))
+    ~MasterBotFilter(),
+    StartCommandQueryFilter(query_magic=query_magic_dispatcher(QueryPathName.UPLOADER_LINK)),
+    flags={"replica_reads": True},
 )
+@aiogram.flags.query_budget(4)
 async def uploader_link_handler(
     message: Message,
     state: FSMContext,
@@ -254,24 +272,46 @@ async def uploader_link_handler(
     **kwargs,
 ) -> Optional[aiogram.methods.TelegramMethod]:
     queryid = command_query.get("k")
+    ulink_qs = models.UploaderLink.objects.filter(queryid=queryid).select_related("uploader")
     try:
-        ulink: models.UploaderLink = (
-            await models.UploaderLink.objects.filter(queryid=queryid).select_related("uploader").aget()
-        )
+        ulink: models.UploaderLink = await ulink_qs.aget()
     except models.UploaderLink.DoesNotExist:
-        logging.error(f"{str(queryid)} not found")
-        return
+        # the link may be too new for the replica, it's shared right after it's made
+        ulink = await ulink_qs.using(DEFAULT_DB_ALIAS).afirst()
+        if ulink is None:
+            logging.error(f"{str(queryid)} not found")
+            return
     if ulink.uploader.tbot_id != bot_obj.id:
         logging.error(f"{str(queryid)} is not for {str(bot_obj)}")
         return
     messages_qs = ulink.uploader.messages.all().select_related_all_entities()
     msq_tasks = []
-    async for i in messages_qs:
-        i: models.TelegramMessage
-        send_method, aio_params = await i.to_aio_params()
-        method = getattr(aiobot, send_method)
-        msq_tasks.append(asyncio.create_task(method(chat_id=message.chat.id, **aio_params)))
-    await asyncio.gather(*msq_tasks)
+    delivered = False
+    try:
+        messages = [i async for i in messages_qs]
+        for i in messages:
+            i: models.TelegramMessage
+            send_method, aio_params = await i.to_aio_params()
+            method = getattr(aiobot, send_method)
+            msq_tasks.append(asyncio.create_task(method(chat_id=message.chat.id, **aio_params)))
+        results = await asyncio.gather(*msq_tasks, return_exceptions=True)
+        errors = [i for i in results if isinstance(i, BaseException)]
+        delivered = not errors
+        job_id = redelivery.get_job_id(bot_obj.id, message.chat.id, ulink.id)
+        if delivered:
+            # the messages are all here, a redelivery left from an earlier try would repeat them
+            await redelivery.cancel(job_id)
+            return
+        # only the failed messages are sent again, later and in their order
+        missing = [i.id for i, result in zip(messages, results) if redelivery.is_retryable(result)]
+        if missing:
+            job = redelivery.RedeliveryJob(bot_id=bot_obj.id, chat_id=message.chat.id, message_ids=missing, attempt=0)
+            await redelivery.schedule(job_id, job)
+        unexpected = [i for i in errors if not isinstance(i, aiogram.exceptions.TelegramAPIError)]
+        if unexpected:
+            raise unexpected[0]
+    finally:
+        await stats.record_link_visit(ulink, user_tid=message.from_user.id, delivered=delivered)
 
 
 class NewBotSG(StatesGroup):
@@ -281,8 +321,9 @@ class NewBotSG(StatesGroup):
 @router.callback_query(
     *MASTER_PATH_FILTERS, SimpleButtonCallbackData.filter(aiogram.F.button_name == SimpleButtonName.REGISTER_NEW_BOT)
 )
+@aiogram.flags.query_budget(0)
 async def new_bot_handler(
-    query: CallbackQuery, user: User, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
+    query: CallbackQuery, user: TelegramIdentity, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
     await state.set_state(NewBotSG.token)
     rkbuilder = ReplyKeyboardBuilder()
@@ -292,13 +333,14 @@ async def new_bot_handler(
 
 
 @router.message(*MASTER_PATH_FILTERS, NewBotSG.token)
+@aiogram.flags.query_budget(9)
 async def new_bot_token_handler(
-    message: Message, user: User, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
+    message: Message, user: TelegramIdentity, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
     token = message.text
     rkbuilder = ReplyKeyboardBuilder()
     new_bot_obj, result = await models.TelegramBot.do_register(
-        token=token, added_from_bot_obj=bot_obj, added_by_user_obj=user
+        token=token, added_from_bot_obj=bot_obj, added_by_user_obj=await user.aget_user()
     )
     if result == models.TelegramBot.RegisterResult.TOKEN_NOT_A_TOKEN:
         text = _("لطفا توکن را به درستی ارسال کنید.")
@@ -321,18 +363,21 @@ async def new_bot_token_handler(
 
 
 @router.callback_query(
-    *MASTER_PATH_FILTERS, SimpleButtonCallbackData.filter(aiogram.F.button_name == SimpleButtonName.BOT_LIST)
+    *MASTER_PATH_FILTERS,
+    SimpleButtonCallbackData.filter(aiogram.F.button_name == SimpleButtonName.BOT_LIST),
+    flags={"replica_reads": True},
 )
+@aiogram.flags.query_budget(1)
 async def bot_list_handler(
-    query: CallbackQuery, user: User, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
+    query: CallbackQuery, user: TelegramIdentity, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
-    tbots_qs = models.TelegramBot.objects.filter(added_by=user)
-    if not tbots_qs.aexists():
+    tbots = [i async for i in models.TelegramBot.objects.filter(added_by_id=user.user_id)]
+    if not tbots:
         text = _("شما رباتی اضافه نکرده اید")
         return query.message.edit_text(text=text)
 
     ikbuilder = InlineKeyboardBuilder()
-    async for i in tbots_qs:
+    for i in tbots:
         btn_text = i.title
         ikbuilder.button(text=btn_text, callback_data=BotCallbackData(pk=i.id, action=BotAction.GET))
     text = render_to_string("telegram_bot/bots_list.thtml")
@@ -341,11 +386,19 @@ async def bot_list_handler(
 
 @router.callback_query(*MASTER_PATH_FILTERS, BotCallbackData.filter(aiogram.F.action == BotAction.POWER_OFF))
 @router.callback_query(*MASTER_PATH_FILTERS, BotCallbackData.filter(aiogram.F.action == BotAction.POWER_ON))
-@router.callback_query(*MASTER_PATH_FILTERS, BotCallbackData.filter(aiogram.F.action == BotAction.GET))
+# only the view reads from the replicas, change_power saves the object it's given
+@router.callback_query(
+    *MASTER_PATH_FILTERS, BotCallbackData.filter(aiogram.F.action == BotAction.GET), flags={"replica_reads": True}
+)
+@aiogram.flags.query_budget(2)
 async def bot_detail_handler(
-    query: CallbackQuery, callback_data: BotCallbackData, user: User, aiobot: Bot, bot_obj: models.TelegramBot
+    query: CallbackQuery,
+    callback_data: BotCallbackData,
+    user: TelegramIdentity,
+    aiobot: Bot,
+    bot_obj: models.TelegramBot,
 ) -> Optional[aiogram.methods.TelegramMethod]:
-    bot = await models.TelegramBot.objects.aget(pk=callback_data.pk, added_by=user)
+    bot = await models.TelegramBot.objects.aget(pk=callback_data.pk, added_by_id=user.user_id)
     message_text = ""
     if callback_data.action in (BotAction.POWER_ON, BotAction.POWER_OFF):
         dest_status = callback_data.action == BotAction.POWER_ON
@@ -384,6 +437,7 @@ class NewContentSG(StatesGroup):
 @router.callback_query(
     *SUB_OWNER_PATH_FILTERS, SimpleButtonCallbackData.filter(aiogram.F.button_name == SimpleButtonName.NEW_CONTENT)
 )
+@aiogram.flags.query_budget(0)
 async def new_content_handler(
     query: CallbackQuery, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
@@ -395,17 +449,19 @@ async def new_content_handler(
 
 
 @router.message(*SUB_OWNER_PATH_FILTERS, NewContentSG.messages, aiogram.F.text == RESET_R)
+@aiogram.flags.query_budget(0)
 async def reset_content_message_handler(
     message: Message, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
     await state.update_data(messages=None)
     rkbuilder = ReplyKeyboardBuilder()
     rkbuilder.button(text=str(CANCEL_R))
-    text = render_to_string("telegram_bot/new_content.md")
+    text = render_to_string("telegram_bot/new_content.thtml")
     return message.answer(text, reply_markup=rkbuilder.as_markup())
 
 
 @router.message(*SUB_OWNER_PATH_FILTERS, NewContentSG.messages, aiogram.F.text == END_R)
+@aiogram.flags.query_budget(0)
 async def end_message_content_handler(
     message: Message, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
@@ -431,13 +487,15 @@ async def end_message_content_handler(
 
 
 @router.message(*SUB_OWNER_PATH_FILTERS, NewContentSG.messages)
+# the sizes of a photo are saved one by one, telegram sends up to four of them
+@aiogram.flags.query_budget(16)
 async def new_content_message_handler(
-    message: Message, user: User, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
+    message: Message, user: TelegramIdentity, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
     data = await state.get_data()
     tmessage_ids_up_to_now = data.get("messages") or []
     telegram_message_obj = await models.TelegramMessage.objects.new_from_aio_for_uploader(
-        tmessage=message, sent_by=user, bot=bot_obj
+        tmessage=message, sent_by=await user.aget_user(), bot=bot_obj
     )
     tmessage_ids_up_to_now.append(telegram_message_obj.id)
     await state.update_data(messages=tmessage_ids_up_to_now)
@@ -451,6 +509,7 @@ async def new_content_message_handler(
 
 
 @router.message(*SUB_OWNER_PATH_FILTERS, NewContentSG.must_joins, aiogram.F.text == RESET_R)
+@aiogram.flags.query_budget(0)
 async def reset_content_must_join_handler(
     message: Message, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
@@ -458,13 +517,14 @@ async def reset_content_must_join_handler(
     rkbuilder = ReplyKeyboardBuilder()
     rkbuilder.button(text=str(CANCEL_R))
     rkbuilder.button(text=str(END_R))
-    text = render_to_string("telegram_bot/declare_must_joins.md")
+    text = render_to_string("telegram_bot/declare_must_joins.thtml")
     return message.answer(text, reply_markup=rkbuilder.as_markup())
 
 
 @router.message(*SUB_OWNER_PATH_FILTERS, NewContentSG.must_joins, aiogram.F.text == END_R)
+@aiogram.flags.query_budget(0)
 async def end_content_must_join_handler(
-    message: Message, user: User, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
+    message: Message, user: TelegramIdentity, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
     await state.set_state(NewContentSG.name)
     text = _("یک نام وارد کنید:")
@@ -474,6 +534,7 @@ async def end_content_must_join_handler(
 @router.message(
     *SUB_OWNER_PATH_FILTERS, NewContentSG.must_joins, aiogram.F.content_type == aiogram.enums.ContentType.CHAT_SHARED
 )
+@aiogram.flags.query_budget(0)
 async def new_content_must_joins_handler(
     message: Message, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
@@ -503,16 +564,22 @@ async def new_content_must_joins_handler(
 
 
 @router.message(*SUB_OWNER_PATH_FILTERS, NewContentSG.name)
+@aiogram.flags.query_budget(6)
 async def new_content_name_handler(
-    message: Message, user: User, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
+    message: Message, user: TelegramIdentity, state: FSMContext, aiobot: Bot, bot_obj: models.TelegramBot
 ) -> Optional[aiogram.methods.TelegramMethod]:
     await state.update_data(name=message.text)
     data = await state.get_data()
     tmessage_ids_up_to_now = data.get("messages") or []
     must_joins_up_to_now: list[MustJoin] = data.get("must_joins") or []
     name = data["name"]
+    created_by = await user.aget_user()
     uploader_obj = await sync_to_async(models.TelegramUploader.objects.from_wizard)(
-        name=name, tmessage_ids=tmessage_ids_up_to_now, must_joins=must_joins_up_to_now, created_by=user
+        name=name,
+        tmessage_ids=tmessage_ids_up_to_now,
+        must_joins=must_joins_up_to_now,
+        created_by=created_by,
+        tbot_id=user.tbot_id,
     )
     await state.clear()
 
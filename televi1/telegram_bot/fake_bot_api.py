@@ -0,0 +1,101 @@
+"""
+a fake telegram-bot-api server for the tests and the load test, it serves on a loop of its own in a thread so
+that the bots of any loop can call it, like a self-hosted server in local mode
+"""
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    """
+    answers getMe, getMyName, setWebhook, deleteWebhook, getWebhookInfo, getFile, the send and edit methods
+    and the answer ones, every call is recorded in `calls` as (token, method, params)
+    """
+
+    def __init__(self, files_path: Path, server_files_path: Path = Path("/var/lib/telegram-bot-api")):
+        # the directory of the server, mounted at files_path
+        self.files_path = files_path
+        self.server_files_path = server_files_path
+        self.calls: list[tuple[str, str, dict]] = []
+        self.webhooks: dict[str, str] = {}
+        self.url: str | None = None
+        self._loop = asyncio.new_event_loop()
+        self._runner: web.AppRunner | None = None
+        self._message_id = 0
+
+    def start(self) -> str:
+        threading.Thread(target=self._loop.run_forever, name="fake-bot-api", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self.url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        token, method = request.match_info["token"], request.match_info["method"]
+        params = dict(await request.post())
+        self.calls.append((token, method, params))
+        handler = getattr(self, f"_{method.lower()}", None)
+        if handler is None and method.lower().startswith(("send", "edit")):
+            handler = self._send
+        if handler is None and method.lower().startswith("answer"):
+            handler = self._answer
+        if handler is None:
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+        return web.json_response({"ok": True, "result": handler(token, params)})
+
+    def _getme(self, token: str, params: dict):
+        bot_id = int(token.split(":")[0])
+        return {"id": bot_id, "is_bot": True, "first_name": "fake", "username": f"fake_{bot_id}_bot"}
+
+    def _getmyname(self, token: str, params: dict):
+        return {"name": "fake"}
+
+    def _setwebhook(self, token: str, params: dict):
+        self.webhooks[token] = params["url"]
+        return True
+
+    def _deletewebhook(self, token: str, params: dict):
+        self.webhooks.pop(token, None)
+        return True
+
+    def _getwebhookinfo(self, token: str, params: dict):
+        return {"url": self.webhooks.get(token, ""), "has_custom_certificate": False, "pending_update_count": 0}
+
+    def _getfile(self, token: str, params: dict):
+        return {
+            "file_id": params["file_id"],
+            "file_unique_id": params["file_id"],
+            "file_size": (self.files_path / params["file_id"]).stat().st_size,
+            # an absolute path on the disk of the server in local mode
+            "file_path": str(self.server_files_path / params["file_id"]),
+        }
+
+    def _answer(self, token: str, params: dict):
+        return True
+
+    def _send(self, token: str, params: dict):
+        self._message_id += 1
+        chat_id = json.loads(params.get("chat_id", "0"))
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "text": params.get("text"),
+        }
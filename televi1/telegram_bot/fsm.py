@@ -0,0 +1,54 @@
+"""
+fsm storage that reads and writes through the redis batch of the update when there's one
+"""
+from typing import Any, Optional, cast
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+
+from televi1.utils import tracing
+from televi1.utils.redis import get_redis_batch
+
+
+class BatchedRedisStorage(RedisStorage):
+    def _redis(self):
+        return get_redis_batch() or self.redis
+
+    def get_keys(self, key: StorageKey) -> list[str]:
+        """the redis keys of the state and data of the key, to be prefetched"""
+        return [self.key_builder.build(key, "state"), self.key_builder.build(key, "data")]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        with tracing.span("fsm.set_state"):
+            redis_key = self.key_builder.build(key, "state")
+            if state is None:
+                await self._redis().delete(redis_key)
+            else:
+                await self._redis().set(
+                    redis_key, cast(str, state.state if isinstance(state, State) else state), ex=self.state_ttl
+                )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        with tracing.span("fsm.get_state"):
+            value = await self._redis().get(self.key_builder.build(key, "state"))
+            if isinstance(value, bytes):
+                return value.decode("utf-8")
+            return cast(Optional[str], value)
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        with tracing.span("fsm.set_data"):
+            redis_key = self.key_builder.build(key, "data")
+            if not data:
+                await self._redis().delete(redis_key)
+                return
+            await self._redis().set(redis_key, self.json_dumps(data), ex=self.data_ttl)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        with tracing.span("fsm.get_data"):
+            value = await self._redis().get(self.key_builder.build(key, "data"))
+            if value is None:
+                return {}
+            if isinstance(value, bytes):
+                value = value.decode("utf-8")
+            return cast(dict[str, Any], self.json_loads(value))
@@ -0,0 +1,109 @@
+"""
+(bot id, user_tid) -> TelegramIdentity cache used by AuthenticationMiddleware
+
+two levels, a small per worker LRU in front of redis. users that do not exist (updates from
+groups and channels) are cached too so they don't hit the database on every update.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from televi1.utils.redis import get_batched_redis
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "televi1:identity"
+KNOWN_TTL = 24 * 60 * 60
+UNKNOWN_TTL = 60
+LOCAL_TTL = 30
+LOCAL_MAX_SIZE = 10_000
+
+# marks a user that is known to not exist
+UNKNOWN = object()
+
+_FIELDS = ("id", "user_tid", "tbot_id", "has_blocked_bot", "user_id")
+
+
+class IdentityCache:
+    def __init__(self, local_ttl: float = LOCAL_TTL, local_max_size: int = LOCAL_MAX_SIZE):
+        self.local_ttl = local_ttl
+        self.local_max_size = local_max_size
+        self._local: OrderedDict[tuple[int, int], tuple[float, dict | None]] = OrderedDict()
+
+    @staticmethod
+    def redis_key(bot_id: int, user_tid: int) -> str:
+        return f"{KEY_PREFIX}:{bot_id}:{user_tid}"
+
+    def _get_local(self, key: tuple[int, int]):
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return value
+
+    def _set_local(self, key: tuple[int, int], value: dict | None):
+        self._local[key] = (time.monotonic() + self.local_ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_max_size:
+            self._local.popitem(last=False)
+
+    async def get(self, bot_obj: models.TelegramBot, user_tid: int):
+        """
+        returns the TelegramIdentity, UNKNOWN if it's known to not exist or None on a miss
+        """
+        key = (bot_obj.id, user_tid)
+        value = self._get_local(key)
+        if value is None:
+            try:
+                raw = await get_batched_redis().get(self.redis_key(*key))
+            except Exception:
+                logger.exception("reading the identity cache failed")
+                return None
+            if raw is None:
+                return None
+            value = json.loads(raw)
+            self._set_local(key, value)
+        if not value:
+            return UNKNOWN
+        return self._build(bot_obj, value)
+
+    async def set(self, bot_obj: models.TelegramBot, user_tid: int, identity_obj: models.TelegramIdentity | None):
+        value = {i: getattr(identity_obj, i) for i in _FIELDS} if identity_obj is not None else {}
+        self._set_local((bot_obj.id, user_tid), value)
+        try:
+            await get_batched_redis().set(
+                self.redis_key(bot_obj.id, user_tid), json.dumps(value), ex=KNOWN_TTL if value else UNKNOWN_TTL
+            )
+        except Exception:
+            logger.exception("writing the identity cache failed")
+
+    async def forget(self, pairs: list[tuple[int, int]]):
+        """drops the given (bot id, user_tid) pairs, call it after changing the users"""
+        for key in pairs:
+            self._local.pop(key, None)
+        if not pairs:
+            return
+        try:
+            await get_batched_redis().delete(*(self.redis_key(*i) for i in pairs))
+        except Exception:
+            logger.exception("invalidating the identity cache failed")
+
+    @staticmethod
+    def _build(bot_obj: models.TelegramBot, value: dict) -> models.TelegramIdentity:
+        # from_db wants them in the order of concrete_fields, the rest are deferred
+        fields = [i for i in models.TelegramIdentity._meta.concrete_fields if i.attname in value]
+        identity_obj = models.TelegramIdentity.from_db(
+            "default", [i.attname for i in fields], [value[i.attname] for i in fields]
+        )
+        identity_obj.tbot = bot_obj
+        return identity_obj
+
+
+identity_cache = IdentityCache()
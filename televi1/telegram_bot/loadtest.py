@@ -0,0 +1,374 @@
+"""
+load test of the webhook path, see the telegram_benchmark_load command
+
+the asgi app of config/asgi.py is started (lifespan included) and fed synthetic webhook updates in process,
+against the configured database and redis, while the bots talk to a FakeBotAPI. the data it makes is
+deleted at the end.
+"""
+import asyncio
+import itertools
+import json
+import random
+import statistics
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db.models import Max
+
+from televi1.users.models import User
+from televi1.utils.metrics import count_queries
+
+from . import models
+from .dispatchers.base import (
+    CANCEL_R,
+    ContentAction,
+    ContentCallbackData,
+    QueryPathName,
+    SimpleButtonCallbackData,
+    SimpleButtonName,
+    get_dispatch_query,
+)
+
+# the metrics of a scenario, and if a bigger value is worse
+METRICS = {
+    "updates_per_second": False,
+    "p50_ms": True,
+    "p99_ms": True,
+    "queries_per_update": True,
+    "calls_per_update": True,
+}
+
+
+class AsgiClient:
+    """drives an asgi app in process, the lifespan protocol and http requests"""
+
+    def __init__(self, app, host: str):
+        self.app = app
+        self.host = host
+        self._lifespan_in: asyncio.Queue = asyncio.Queue()
+        self._lifespan_out: asyncio.Queue = asyncio.Queue()
+        self._lifespan_task: asyncio.Task | None = None
+
+    async def startup(self):
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}}
+        self._lifespan_task = asyncio.create_task(self.app(scope, self._lifespan_in.get, self._lifespan_out.put))
+        await self._lifespan_in.put({"type": "lifespan.startup"})
+        message = await self._lifespan_out.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"the app failed to start: {message.get('message')}")
+
+    async def shutdown(self):
+        await self._lifespan_in.put({"type": "lifespan.shutdown"})
+        await self._lifespan_out.get()
+        await self._lifespan_task
+
+    async def post(self, path: str, body: bytes, headers: dict[str, str]) -> tuple[int, bytes]:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", self.host.encode()), (b"content-type", b"application/json")]
+            + [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+            "client": ("127.0.0.1", 0),
+            "server": (self.host, 80),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        done = asyncio.Event()
+        status, chunks = 0, []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    done.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            done.set()
+        return status, b"".join(chunks)
+
+
+@dataclass
+class LoadData:
+    prefix: str
+    master: models.TelegramBot
+    subs: list[models.TelegramBot]
+    # telegram id of the owner of each sub bot
+    owner_tids: dict[int, int]
+    uploaders: dict[int, models.TelegramUploader]
+    links: dict[int, models.UploaderLink]
+    # the telegram ids of the messages are unique, the updates go on from here
+    next_message_tid: int
+
+
+def create_data(sub_bots: int, bundle_size: int) -> LoadData:
+    """a master bot and sub bots, each with an owner and an uploader link of bundle_size text messages"""
+    prefix = f"loadtest-{time.time_ns()}"
+    tid_base = random.randint(10**9, 2 * 10**9)
+    message_tid = (models.TelegramMessage.objects.aggregate(Max("tid"))["tid__max"] or 0) + 1
+
+    def new_bot(i: int, owner: User, is_master: bool) -> models.TelegramBot:
+        return models.TelegramBot.objects.create(
+            tid=tid_base + i,
+            tusername=f"loadtest_{tid_base + i}_bot",
+            title=prefix,
+            api_token=f"{tid_base + i}:loadtest",
+            secret_token=models.TelegramBot.generate_secret_token(),
+            url_specifier=f"{prefix}-{i}",
+            domain_name="localhost",
+            is_master=is_master,
+            added_by=owner,
+        )
+
+    master = new_bot(0, User.objects.create(username=f"{prefix}-master"), is_master=True)
+    subs, owner_tids, uploaders, links = [], {}, {}, {}
+    for i in range(1, sub_bots + 1):
+        owner = User.objects.create(username=f"{prefix}-owner-{i}")
+        tbot = new_bot(i, owner, is_master=False)
+        owner_tids[tbot.id] = tid_base + i
+        models.TelegramIdentity.objects.create(tbot=tbot, user_tid=owner_tids[tbot.id], user=owner)
+        uploader = models.TelegramUploader.objects.create(
+            name=f"{prefix}-{i}", tbot=tbot, created_by=owner, must_join_chat_ids=[]
+        )
+        for order in range(bundle_size):
+            message = models.TelegramMessage.objects.create(
+                tid=message_tid, bot=tbot, sent_by=owner, content_type="text", text=f"message {order}"
+            )
+            message_tid += 1
+            uploader.messages.add(message, through_defaults={"order": order})
+        subs.append(tbot)
+        uploaders[tbot.id] = uploader
+        links[tbot.id] = models.UploaderLink.objects.create(uploader=uploader, queryid=f"lt{tid_base + i}")
+    return LoadData(
+        prefix=prefix,
+        master=master,
+        subs=subs,
+        owner_tids=owner_tids,
+        uploaders=uploaders,
+        links=links,
+        next_message_tid=message_tid,
+    )
+
+
+def delete_data(data: LoadData):
+    # the identities, uploaders and messages go with their bots
+    models.TelegramBot.objects.filter(url_specifier__startswith=f"{data.prefix}-").delete()
+    User.objects.filter(username__startswith=f"{data.prefix}-").delete()
+
+
+class Updates:
+    """makes the webhook updates, users are numbered from a base that no owner has"""
+
+    def __init__(self, first_message_id: int = 1):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(first_message_id)
+        self.user_tids = itertools.count(3 * 10**9)
+
+    def _user(self, user_tid: int) -> dict:
+        return {"id": user_tid, "is_bot": False, "first_name": "load"}
+
+    def message(self, user_tid: int, text: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_tid, "type": "private"},
+                "from": self._user(user_tid),
+                "text": text,
+            },
+        }
+
+    def callback(self, user_tid: int, callback_data: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": self._user(user_tid),
+                "chat_instance": str(user_tid),
+                "data": callback_data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_tid, "type": "private"},
+                    "text": "menu",
+                },
+            },
+        }
+
+
+# the updates of one chat in the order they are sent, the sessions run side by side
+Session = list[tuple[models.TelegramBot, dict]]
+
+
+def start_master(data: LoadData, updates: Updates, count: int) -> list[Session]:
+    """/start of new users on the master bot"""
+    return [[(data.master, updates.message(next(updates.user_tids), "/start"))] for _ in range(count)]
+
+
+def start_sub(data: LoadData, updates: Updates, count: int) -> list[Session]:
+    """/start of the owners on their sub bots"""
+    per_bot = max(count // len(data.subs), 1)
+    return [[(i, updates.message(data.owner_tids[i.id], "/start")) for _ in range(per_bot)] for i in data.subs]
+
+
+def wizard(data: LoadData, updates: Updates, count: int) -> list[Session]:
+    """the owners open the new content wizard and flood it with messages, then cancel"""
+    per_bot = max(count // len(data.subs), 3)
+    new_content = SimpleButtonCallbackData(button_name=SimpleButtonName.NEW_CONTENT).pack()
+    sessions = []
+    for i in data.subs:
+        owner_tid = data.owner_tids[i.id]
+        session = [(i, updates.callback(owner_tid, new_content))]
+        session += [(i, updates.message(owner_tid, f"content {n}")) for n in range(per_bot - 2)]
+        session.append((i, updates.message(owner_tid, str(CANCEL_R))))
+        sessions.append(session)
+    return sessions
+
+
+def link_open(data: LoadData, updates: Updates, count: int) -> list[Session]:
+    """new users open the uploader links, each sends its bundle of messages"""
+    sessions = []
+    for n in range(count):
+        tbot = data.subs[n % len(data.subs)]
+        link = get_dispatch_query(tbot.tusername, QueryPathName.UPLOADER_LINK, key=data.links[tbot.id].queryid)
+        payload = link.split("start=", 1)[1]
+        sessions.append([(tbot, updates.message(next(updates.user_tids), f"/start {payload}"))])
+    return sessions
+
+
+def callback_nav(data: LoadData, updates: Updates, count: int) -> list[Session]:
+    """the owners go through the content list, a content and its link"""
+    rounds = max(count // (3 * len(data.subs)), 1)
+    content_list = SimpleButtonCallbackData(button_name=SimpleButtonName.CONTENT_LIST).pack()
+    sessions = []
+    for i in data.subs:
+        owner_tid, uploader_id = data.owner_tids[i.id], data.uploaders[i.id].id
+        steps = [
+            content_list,
+            ContentCallbackData(pk=uploader_id, action=ContentAction.GET).pack(),
+            ContentCallbackData(pk=uploader_id, action=ContentAction.GET_LINK).pack(),
+        ]
+        sessions.append([(i, updates.callback(owner_tid, step)) for _ in range(rounds) for step in steps])
+    return sessions
+
+
+SCENARIOS: dict[str, Callable[[LoadData, Updates, int], list[Session]]] = {
+    "start_master": start_master,
+    "start_sub": start_sub,
+    "wizard": wizard,
+    "link_open": link_open,
+    "callback_nav": callback_nav,
+}
+
+
+@dataclass
+class Result:
+    updates: int = 0
+    seconds: float = 0
+    latencies: list[float] = field(default_factory=list)
+    queries: int = 0
+    # the bot api calls and the methods answered to the webhooks
+    calls: int = 0
+    errors: int = 0
+
+    def summary(self) -> dict[str, float]:
+        latencies = sorted(self.latencies) or [0.0]
+        return {
+            "updates_per_second": self.updates / self.seconds if self.seconds else 0.0,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p99_ms": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000,
+            "queries_per_update": self.queries / self.updates if self.updates else 0.0,
+            "calls_per_update": self.calls / self.updates if self.updates else 0.0,
+            "errors": self.errors,
+        }
+
+
+async def run_scenario(
+    client: AsgiClient, sessions: list[Session], concurrency: int, count_calls: Callable[[], int]
+) -> Result:
+    result = Result()
+    semaphore = asyncio.Semaphore(concurrency)
+    calls_before = count_calls()
+
+    async def post(tbot: models.TelegramBot, update: dict):
+        path = f"/{settings.TELEGRAM_WEBHOOK_URL_PREFIX}/{tbot.url_specifier}/"
+        headers = {"x-telegram-bot-api-secret-token": tbot.secret_token}
+        started_at = time.perf_counter()
+        with count_queries() as queries:
+            status, body = await client.post(path, json.dumps(update).encode(), headers)
+        result.latencies.append(time.perf_counter() - started_at)
+        result.queries += queries[0]
+        result.updates += 1
+        if status != 200:
+            result.errors += 1
+        elif "method" in json.loads(body or b"{}"):
+            result.calls += 1
+
+    async def run_session(session: Session):
+        # a chat's updates come one after the other, like telegram sends them
+        async with semaphore:
+            for tbot, update in session:
+                await post(tbot, update)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(run_session(i) for i in sessions))
+    result.seconds = time.perf_counter() - started_at
+    result.calls += count_calls() - calls_before
+    return result
+
+
+async def run(
+    app,
+    data: LoadData,
+    scenarios: list[str],
+    count: int,
+    concurrency: int,
+    count_calls: Callable[[], int],
+) -> dict[str, dict[str, float]]:
+    host = next((i.lstrip(".") for i in settings.ALLOWED_HOSTS if i != "*"), "localhost")
+    client = AsgiClient(app, host)
+    await client.startup()
+    updates, summaries = Updates(first_message_id=data.next_message_tid), {}
+    try:
+        for name in scenarios:
+            sessions = SCENARIOS[name](data, updates, count)
+            result = await run_scenario(client, sessions, concurrency, count_calls)
+            summaries[name] = result.summary()
+    finally:
+        await client.shutdown()
+    return summaries
+
+
+def compare(
+    summaries: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]], tolerance: float
+) -> list[str]:
+    """the metrics that got worse than the baseline by more than tolerance (a fraction)"""
+    regressions = []
+    for name, summary in summaries.items():
+        for metric, bigger_is_worse in METRICS.items():
+            before, now = baseline.get(name, {}).get(metric), summary[metric]
+            if not before:
+                continue
+            change = (now - before) / before
+            if (change if bigger_is_worse else -change) > tolerance:
+                regressions.append(f"{name} {metric}: {before:.2f} -> {now:.2f} ({change:+.0%})")
+    return regressions
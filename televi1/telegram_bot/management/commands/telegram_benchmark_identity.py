@@ -0,0 +1,93 @@
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+
+import aiogram
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from televi1.users.models import User
+
+from ...identity import IdentityCache
+from ...models import TelegramBot, TelegramIdentity
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures creating and looking up telegram identities against the configured database, "
+        "everything is done in a transaction that is rolled back"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("-n", "--count", type=int, default=1000, help="number of identities to create")
+
+    def handle(self, *args, count: int, **options):
+        try:
+            with transaction.atomic():
+                async_to_sync(self.run)(count)
+                raise Rollback
+        except Rollback:
+            pass
+
+    async def run(self, count: int):
+        owner = await User.objects.acreate(username=f"benchmark-{time.time_ns()}")
+        tbot = await TelegramBot.objects.acreate(
+            tid=-1,
+            tusername="benchmark_bot",
+            title="benchmark",
+            api_token="-1:benchmark",
+            secret_token=TelegramBot.generate_secret_token(),
+            url_specifier=f"benchmark-{time.time_ns()}",
+            domain_name="localhost",
+            is_master=False,
+            added_by=owner,
+        )
+        tusers = [aiogram.types.User(id=i, is_bot=False, first_name="x") for i in range(1, count + 1)]
+        cache = IdentityCache(local_max_size=count)
+
+        async def create(tuser):
+            await TelegramIdentity.objects.auto_new_from_user_tevent(tbot=tbot, tuser=tuser)
+
+        async def lookup(tuser):
+            await TelegramIdentity.objects.filter(user_tid=tuser.id, tbot_id=tbot.id).afirst()
+
+        async def cached_lookup(tuser):
+            await cache.get(tbot, tuser.id)
+
+        identities = {}
+
+        async def create_django_user(tuser):
+            identity_obj = identities.get(tuser.id)
+            if identity_obj is None:
+                identity_obj = identities[tuser.id] = await TelegramIdentity.objects.aget(
+                    user_tid=tuser.id, tbot_id=tbot.id
+                )
+            await identity_obj.aget_user()
+
+        await self.measure("create", create, tusers)
+        await self.measure("create (existing)", create, tusers)
+        await self.measure("lookup", lookup, tusers)
+        # only the local level, redis is not part of the measurement
+        async for i in TelegramIdentity.objects.filter(tbot=tbot):
+            cache._set_local((tbot.id, i.user_tid), {"id": i.id, "user_tid": i.user_tid, "tbot_id": tbot.id})
+        await self.measure("lookup (local cache)", cached_lookup, tusers)
+        # only the few that own bots or contents pay for this one
+        await self.measure("lazy django user", create_django_user, tusers[: max(count // 10, 1)])
+
+    async def measure(self, name: str, func, tusers: list[aiogram.types.User]):
+        durations = []
+        for tuser in tusers:
+            started_at = time.perf_counter()
+            await func(tuser)
+            durations.append((time.perf_counter() - started_at) * 1000)
+        durations.sort()
+        p99 = durations[min(int(len(durations) * 0.99), len(durations) - 1)]
+        self.stdout.write(
+            f"{name:<24} n={len(durations):<6} total={sum(durations):9.1f}ms "
+            f"p50={statistics.median(durations):.3f}ms p99={p99:.3f}ms"
+        )
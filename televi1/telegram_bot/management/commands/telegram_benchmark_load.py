@@ -0,0 +1,89 @@
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+
+from aiogram.client.telegram import TelegramAPIServer
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from ... import loadtest
+from ...fake_bot_api import FakeBotAPI
+from ...session import get_session
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests the webhook path: the asgi app is fed synthetic updates against the configured database "
+        "and redis while the bots talk to a fake bot api server, the results are compared with the baseline file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenarios", nargs="+", choices=list(loadtest.SCENARIOS), default=list(loadtest.SCENARIOS)
+        )
+        parser.add_argument("--updates", type=int, default=500, help="updates per scenario")
+        parser.add_argument("--concurrency", type=int, default=50, help="chats sending updates at the same time")
+        parser.add_argument("--sub-bots", type=int, default=10)
+        parser.add_argument("--bundle-size", type=int, default=5, help="messages an uploader link sends")
+        parser.add_argument("--baseline", type=Path, default=settings.BASE_DIR / "benchmarks" / "telegram_load.json")
+        parser.add_argument("--save-baseline", action="store_true", help="write the results as the baseline")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.1, help="fraction a metric may get worse than the baseline"
+        )
+        parser.add_argument(
+            "--rate-limit", action="store_true", help="keep the rate limits of the bot api calls, off by default"
+        )
+
+    def handle(self, *args, scenarios, updates, concurrency, sub_bots, bundle_size, **options):
+        from config.asgi import application
+
+        session = get_session()
+        if not options["rate_limit"]:
+            session.rate_limiter = None
+        bot_api = FakeBotAPI(files_path=Path(tempfile.mkdtemp()))
+        session.api = TelegramAPIServer.from_base(bot_api.start())
+        data = loadtest.create_data(sub_bots=sub_bots, bundle_size=bundle_size)
+        try:
+            summaries = asyncio.run(
+                loadtest.run(
+                    application, data, scenarios, updates, concurrency, count_calls=lambda: len(bot_api.calls)
+                )
+            )
+        finally:
+            loadtest.delete_data(data)
+            bot_api.stop()
+
+        self.stdout.write(
+            f"{'scenario':<14} {'updates/s':>10} {'p50':>9} {'p99':>9} {'queries':>8} {'calls':>6} {'errors':>6}"
+        )
+        for name, i in summaries.items():
+            self.stdout.write(
+                f"{name:<14} {i['updates_per_second']:>10.1f} {i['p50_ms']:>7.1f}ms {i['p99_ms']:>7.1f}ms "
+                f"{i['queries_per_update']:>8.1f} {i['calls_per_update']:>6.1f} {i['errors']:>6}"
+            )
+
+        baseline_path: Path = options["baseline"]
+        options_used = {
+            "updates": updates,
+            "concurrency": concurrency,
+            "sub_bots": sub_bots,
+            "bundle_size": bundle_size,
+        }
+        if options["save_baseline"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps({"options": options_used, "results": summaries}, indent=2) + "\n")
+            self.stdout.write(f"baseline saved to {baseline_path}")
+            return
+        if not baseline_path.exists():
+            self.stdout.write(f"no baseline at {baseline_path}, save one with --save-baseline")
+            return
+        baseline = json.loads(baseline_path.read_text())
+        if baseline["options"] != options_used:
+            self.stdout.write(self.style.WARNING(f"the baseline was run with {baseline['options']}"))
+        regressions = loadtest.compare(summaries, baseline["results"], options["tolerance"])
+        if any(i["errors"] for i in summaries.values()):
+            regressions.append("some updates failed")
+        if regressions:
+            raise CommandError("regressed from the baseline:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("no regressions from the baseline"))
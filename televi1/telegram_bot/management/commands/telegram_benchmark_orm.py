@@ -0,0 +1,67 @@
+import asyncio
+import time
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+
+from django.core.management import BaseCommand
+from django.db import connection
+
+from televi1.utils.orm import ORMExecutor
+
+from ...models import TelegramBot
+
+
+def simulated_query(latency: float):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_sleep(%s)", [latency])
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the updates per second the orm calls of the telegram path allow as the number of "
+        "concurrent updates rises, on the single thread sensitive thread and on the orm executor"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+        parser.add_argument("--updates", type=int, default=200, help="updates per measurement")
+        parser.add_argument("--queries", type=int, default=4, help="orm calls per update")
+        parser.add_argument(
+            "--query-latency", type=float, default=0.002, help="seconds each simulated query waits on the database"
+        )
+        parser.add_argument("--threads", type=int, default=10, help="threads of the orm executor")
+
+    def handle(self, *args, concurrency, updates, queries, query_latency, threads, **options):
+        async def update():
+            await TelegramBot.objects.filter(id=-1).afirst()
+            for _ in range(queries - 1):
+                await sync_to_async(simulated_query)(query_latency)
+
+        async def measure(level: int, executor: ORMExecutor | None) -> float:
+            semaphore = asyncio.Semaphore(level)
+
+            async def limited():
+                async with semaphore:
+                    await update()
+
+            async with executor.context() if executor else nullcontext():
+                started_at = time.perf_counter()
+                await asyncio.gather(*(limited() for _ in range(updates)))
+                return updates / (time.perf_counter() - started_at)
+
+        self.stdout.write(
+            f"{'concurrency':>11} {'single thread':>14} {'executor':>10} {'wait p50':>9} {'wait p99':>9}"
+        )
+        for level in concurrency:
+            # a new executor per level so that the wait stats are of this level only
+            executor = ORMExecutor(max_workers=threads, conn_max_age=60)
+            # asyncio.run and not async_to_sync, the latter runs the thread sensitive calls on this thread
+            single_rate = asyncio.run(measure(level, None))
+            executor_rate = asyncio.run(measure(level, executor))
+            wait = executor.wait_stats.snapshot()
+            executor.shutdown()
+            self.stdout.write(
+                f"{level:>11} {single_rate:>12.1f}/s {executor_rate:>8.1f}/s "
+                f"{wait['p50'] * 1000:>7.2f}ms {wait['p99'] * 1000:>7.2f}ms"
+            )
@@ -1,19 +1,20 @@
 import asyncio
 
-from aiogram import Bot
-from aiogram.client.session.aiohttp import AiohttpSession
-from aiogram.enums import ParseMode
 from django.conf import settings
 from django.core.management import BaseCommand
 
+from televi1.telegram_bot.models import TelegramBot
+
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
-        session = AiohttpSession(proxy=settings.TELEGRAM_PROXY)
-        bot = Bot(settings.TELEGRAM_BOT_TOKEN, parse_mode=ParseMode.HTML, session=session)
+        bot = TelegramBot.new_aiobot(settings.TELEGRAM_BOT_TOKEN)
 
         async def main() -> None:
-            info = await bot.get_webhook_info()
+            try:
+                info = await bot.get_webhook_info()
+            finally:
+                await bot.session.close()
             res = f"current url is {info.url}, "
             self.stdout.write(res)
 
@@ -0,0 +1,52 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from ...models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+PURGE_EVERY = 60 * 60
+
+
+class Command(BaseCommand):
+    help = "Sends the committed outbox messages to celery in batches, more than one relay can run side by side"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--interval", type=float, default=0.5, help="seconds to wait when there's nothing to send")
+        parser.add_argument(
+            "--redeliver-after",
+            type=int,
+            default=15 * 60,
+            help="seconds after which a relayed but not delivered message is sent again",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="times a message is relayed before it's marked as failed and left for the admin",
+        )
+        parser.add_argument("--retention", type=int, default=7, help="days the delivered messages are kept")
+
+    def handle(self, *args, batch_size, interval, redeliver_after, max_attempts, retention, **options):
+        purged_at = 0
+        while True:
+            try:
+                relayed = OutboxMessage.objects.relay(
+                    batch_size, redeliver_after=timedelta(seconds=redeliver_after), max_attempts=max_attempts
+                )
+                if time.monotonic() - purged_at > PURGE_EVERY:
+                    OutboxMessage.objects.purge(older_than=timedelta(days=retention))
+                    purged_at = time.monotonic()
+            except Exception:
+                # the broker or the database is down, the batch is rolled back and sent later
+                logger.exception("relaying the outbox failed")
+                close_old_connections()
+                relayed = 0
+                time.sleep(interval * 10)
+            if relayed < batch_size:
+                time.sleep(interval)
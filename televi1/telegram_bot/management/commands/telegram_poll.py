@@ -1,39 +1,44 @@
 import asyncio
-from collections.abc import Awaitable
-from typing import Any, Callable
+import multiprocessing
 
-import aiogram
 from django.core.management import BaseCommand
+from django.db import connections
 
-from ... import dispatchers, models
+from televi1.utils.metrics import mark_process_dead, start_metrics_server
+
+from ... import dispatchers, polling
 
 
 class Command(BaseCommand):
-    help = "Starts telegram bot polling"
-
-    def handle(self, *args, **options):
-        HELPER_MONKEY_ATTR = "bot_obj_monkey"
-        first_10_telegram_bots = list(models.TelegramBot.objects.all()[:10])
-
-        class PollingNormalizerMiddleware(aiogram.BaseMiddleware):
-            async def __call__(
-                self,
-                handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
-                event: aiogram.types.TelegramObject,
-                data: dict[str, Any],
-            ) -> Any:
-                bot: aiogram.Bot = data["bot"]
-                bot_obj = getattr(bot, HELPER_MONKEY_ATTR)
-                data.update({"aiobot": bot, "bot_obj": bot_obj})
-                return await handler(event, data)
-
-        async def main() -> None:
-            aiobots = []
-            for i in first_10_telegram_bots:
-                aiobot = i.get_aiobot()
-                setattr(aiobot, HELPER_MONKEY_ATTR, i)
-                aiobots.append(aiobot)
-            dispatchers.dp.update.middleware._middlewares.insert(0, PollingNormalizerMiddleware())
-            await dispatchers.dp.start_polling(*aiobots)
-
-        asyncio.run(main())
+    help = "Starts telegram bot polling, the bots are sharded among all the running polling processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1, help="number of polling processes to run")
+        parser.add_argument("--polling-timeout", type=int, default=10)
+        parser.add_argument(
+            "--delete-webhook", action="store_true", help="delete the webhook of the bots before polling them"
+        )
+
+    def handle(self, *args, processes: int, polling_timeout: int, delete_webhook: bool, **options):
+        shard_kwargs = {"polling_timeout": polling_timeout, "delete_webhook": delete_webhook}
+        start_metrics_server()
+        if processes == 1:
+            run(shard_kwargs)
+            return
+
+        # the children must not share the connections of the parent
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        children = [context.Process(target=run, args=(shard_kwargs,), daemon=True) for _ in range(processes)]
+        for i in children:
+            i.start()
+        for i in children:
+            i.join()
+            mark_process_dead(i.pid)
+
+
+def run(shard_kwargs: dict):
+    try:
+        asyncio.run(polling.run_shard(dispatchers.dp, **shard_kwargs))
+    except KeyboardInterrupt:
+        pass
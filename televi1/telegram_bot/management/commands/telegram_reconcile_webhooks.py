@@ -0,0 +1,20 @@
+import asyncio
+
+from django.core.management import BaseCommand
+
+from ... import models, reconcile
+
+
+class Command(BaseCommand):
+    help = "Syncs the webhook of the bots whose webhook on telegram differs from ours"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--bot-id", type=int, action="append", dest="bot_ids")
+
+    def handle(self, *args, concurrency: int, bot_ids: list[int], **options):
+        bots_qs = models.TelegramBot.objects.filter(is_revoked=False)
+        if bot_ids:
+            bots_qs = bots_qs.filter(id__in=bot_ids)
+        counts = asyncio.run(reconcile.reconcile_all(bots_qs, concurrency=concurrency))
+        self.stdout.write(", ".join(f"{k}: {v}" for k, v in counts.items()))
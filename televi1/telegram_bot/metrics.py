@@ -0,0 +1,56 @@
+"""
+metrics of the update pipeline, see televi1.utils.metrics for how they are served
+
+the updates are labeled by the kind of their bot (master or sub) and their type (message, callback_query, ...)
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+WEBHOOK_SECONDS = Histogram(
+    "telegram_webhook_seconds", "time to answer a webhook request of an update", ["bot_kind", "update_type"]
+)
+UPDATE_SECONDS = Histogram("telegram_update_seconds", "time to handle an update", ["bot_kind", "update_type"])
+UPDATES_IN_FLIGHT = Gauge(
+    "telegram_updates_in_flight", "updates being handled", ["bot_kind"], multiprocess_mode="livesum"
+)
+UPDATE_QUERIES = Histogram(
+    "telegram_update_db_queries",
+    "database queries run for an update",
+    ["bot_kind", "update_type"],
+    buckets=QUERY_BUCKETS,
+)
+HANDLER_SECONDS = Histogram(
+    "telegram_handler_seconds", "time spent in a handler", ["handler", "bot_kind", "update_type"]
+)
+HANDLER_ERRORS = Counter(
+    "telegram_handler_errors", "handlers that raised", ["handler", "bot_kind", "update_type", "error"]
+)
+API_SECONDS = Histogram("telegram_api_seconds", "time of a bot api call", ["method"])
+FSM_REDIS_SECONDS = Histogram(
+    "telegram_fsm_redis_seconds", "time of the batched redis round trips of an update", ["operation"]
+)
+# see televi1.utils.orm, the time the orm calls of the updates wait for a free thread of the pool
+ORM_QUEUE_WAIT_SECONDS = Histogram(
+    "telegram_orm_queue_wait_seconds",
+    "time an orm call waited for a thread of the orm executor",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+# see GuardedAiohttpSession.stats, sampled as the api calls start
+HTTP_POOL_CONNECTIONS = Gauge(
+    "telegram_http_pool_connections",
+    "connections of the pools of the bot api by state (limit, in_use, idle, waiting)",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+
+
+def get_bot_kind(bot_obj) -> str:
+    if bot_obj is None:
+        return "unknown"
+    return "master" if bot_obj.is_master else "sub"
+
+
+def observe_http_pool(stats: dict[str, int]):
+    for state, value in stats.items():
+        HTTP_POOL_CONNECTIONS.labels(state).set(value)
@@ -4,6 +4,7 @@ from django.conf import settings
 from django.db import migrations, models
 import django.db.models.deletion
 import televi1.telegram_bot.models
+import televi1.users.models
 
 
 class Migration(migrations.Migration):
@@ -78,7 +79,7 @@ class Migration(migrations.Migration):
             ],
             bases=('users.user', models.Model),
             managers=[
-                ('objects', televi1.telegram_bot.models.TelegramUserManager()),
+                ('objects', televi1.users.models.UserManager()),
             ],
         ),
         migrations.AddField(
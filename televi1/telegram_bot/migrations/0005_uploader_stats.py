@@ -0,0 +1,69 @@
+# Generated by Django 4.2.13 on 2026-10-19 02:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telegram_bot", "0004_remove_uploadercondition_polymorphic_ctype_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploaderLinkStats",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("opens", models.BigIntegerField(db_comment="times the link was opened", default=0)),
+                (
+                    "deliveries",
+                    models.BigIntegerField(db_comment="times the whole content was delivered successfully", default=0),
+                ),
+                (
+                    "unique_users",
+                    models.BigIntegerField(db_comment="approximate, counted with redis HyperLogLog", default=0),
+                ),
+                (
+                    "link",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stats",
+                        to="telegram_bot.uploaderlink",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="TelegramUploaderStats",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("opens", models.BigIntegerField(db_comment="times the link was opened", default=0)),
+                (
+                    "deliveries",
+                    models.BigIntegerField(db_comment="times the whole content was delivered successfully", default=0),
+                ),
+                (
+                    "unique_users",
+                    models.BigIntegerField(db_comment="approximate, counted with redis HyperLogLog", default=0),
+                ),
+                (
+                    "uploader",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stats",
+                        to="telegram_bot.telegramuploader",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.13 on 2026-10-19 02:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telegram_bot", "0006_broadcast"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="telegrambot",
+            name="webhook_checked_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="telegrambot",
+            name="webhook_error",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="telegrambot",
+            name="webhook_status",
+            field=models.CharField(
+                blank=True,
+                choices=[("ok", "Ok"), ("resynced", "Resynced"), ("failed", "Failed")],
+                max_length=15,
+                null=True,
+            ),
+        ),
+    ]
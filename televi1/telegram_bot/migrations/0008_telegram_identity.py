@@ -0,0 +1,103 @@
+# Generated by Django 4.2.13 on 2026-10-19 02:37
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_telegram_users(apps, schema_editor):
+    """
+    every TelegramUser becomes an identity with the same id linked to the user row it already had,
+    so the ids kept by broadcasts and queued messages still point to the same person
+    """
+    TelegramUser = apps.get_model("telegram_bot", "TelegramUser")
+    TelegramIdentity = apps.get_model("telegram_bot", "TelegramIdentity")
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    connection = schema_editor.connection
+    quote_name = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote_name(TelegramIdentity._meta.db_table)} "
+            f"(id, created_at, updated_at, user_tid, tbot_id, has_blocked_bot, user_id) "
+            f"SELECT u.id, u.created_at, u.updated_at, t.user_tid, t.tbot_id, t.has_blocked_bot, u.id "
+            f"FROM {quote_name(TelegramUser._meta.db_table)} t "
+            f"JOIN {quote_name(User._meta.db_table)} u ON u.id = t.user_ptr_id"
+        )
+        for sql in connection.ops.sequence_reset_sql(no_style(), [TelegramIdentity]):
+            cursor.execute(sql)
+
+    # they are plain users from now on, polymorphic queries must not look for TelegramUser rows
+    user_ctype = ContentType.objects.get_for_model(User)
+    User._base_manager.filter(pk__in=TelegramUser._base_manager.values("user_ptr_id")).update(
+        polymorphic_ctype=user_ctype
+    )
+
+
+def restore_telegram_users(apps, schema_editor):
+    """the identities without a django user have no place in the old table and are dropped"""
+    TelegramUser = apps.get_model("telegram_bot", "TelegramUser")
+    TelegramIdentity = apps.get_model("telegram_bot", "TelegramIdentity")
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    quote_name = schema_editor.connection.ops.quote_name
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote_name(TelegramUser._meta.db_table)} (user_ptr_id, user_tid, tbot_id, has_blocked_bot) "
+            f"SELECT user_id, user_tid, tbot_id, has_blocked_bot "
+            f"FROM {quote_name(TelegramIdentity._meta.db_table)} WHERE user_id IS NOT NULL"
+        )
+    tuser_ctype = ContentType.objects.get_for_model(TelegramUser)
+    User._base_manager.filter(pk__in=TelegramUser._base_manager.values("user_ptr_id")).update(
+        polymorphic_ctype=tuser_ctype
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("telegram_bot", "0007_telegrambot_webhook_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TelegramIdentity",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("user_tid", models.BigIntegerField(db_comment="user id in telegram")),
+                ("has_blocked_bot", models.BooleanField(db_comment="broadcasts skip these users", default=False)),
+                (
+                    "tbot",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="identities",
+                        to="telegram_bot.telegrambot",
+                    ),
+                ),
+                (
+                    "user",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="telegram_identity",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="telegramidentity",
+            constraint=models.UniqueConstraint(fields=("user_tid", "tbot"), name="unique_tidentity_tbot"),
+        ),
+        migrations.RunPython(copy_telegram_users, restore_telegram_users),
+        migrations.DeleteModel(
+            name="TelegramUser",
+        ),
+    ]
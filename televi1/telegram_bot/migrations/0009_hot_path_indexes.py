@@ -0,0 +1,58 @@
+# Generated by Django 4.2.13 on 2026-10-19 02:40
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without locking the tables for writes
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("telegram_bot", "0008_telegram_identity"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="telegrambot",
+            index=models.Index(fields=["added_by", "tid"], name="tbot_addedby_tid_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="telegrambot",
+            index=models.Index(condition=models.Q(("is_revoked", False)), fields=["tid"], name="tbot_active_tid_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="telegramidentity",
+            index=models.Index(
+                condition=models.Q(("has_blocked_bot", False)), fields=["tbot", "id"], name="tidentity_reachable_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="telegramuploader",
+            index=models.Index(fields=["created_by", "tbot"], name="tuploader_createdby_tbot_idx"),
+        ),
+        # covered by the leading columns of the composite indexes above
+        migrations.AlterField(
+            model_name="telegrambot",
+            name="added_by",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="telegrambots_addedby",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="telegramuploader",
+            name="created_by",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="telegramuploaders_createdby",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
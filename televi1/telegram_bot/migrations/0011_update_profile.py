@@ -0,0 +1,45 @@
+# Generated by Django 4.2.13 on 2026-10-19 03:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telegram_bot", "0010_outbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UpdateProfile",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("update_id", models.BigIntegerField()),
+                ("update_type", models.CharField(max_length=63)),
+                ("handler", models.CharField(blank=True, max_length=255)),
+                ("reason", models.CharField(choices=[("sampled", "Sampled"), ("slow", "Slow")], max_length=15)),
+                ("duration", models.FloatField(help_text="seconds")),
+                ("samples", models.IntegerField(default=0)),
+                (
+                    "cpu_profile",
+                    models.TextField(blank=True, help_text="folded stacks, for flamegraph.pl or speedscope"),
+                ),
+                ("allocations", models.TextField(blank=True, help_text="the top allocations while the update ran")),
+                (
+                    "tbot",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="update_profiles",
+                        to="telegram_bot.telegrambot",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
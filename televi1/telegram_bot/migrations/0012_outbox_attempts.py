@@ -0,0 +1,41 @@
+# Generated by Django 4.2.13 on 2026-10-19 04:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telegram_bot", "0011_update_profile"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="outboxmessage",
+            name="outbox_undelivered_idx",
+        ),
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(db_comment="times it was relayed", default=0),
+        ),
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, db_comment="when a delivery started running it", null=True),
+        ),
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="failed_at",
+            field=models.DateTimeField(
+                blank=True, db_comment="it ran out of attempts, it's not relayed again", null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="outboxmessage",
+            index=models.Index(
+                condition=models.Q(("delivered_at__isnull", True), ("failed_at__isnull", True)),
+                fields=["id"],
+                name="outbox_undelivered_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.13 on 2026-10-19 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telegram_bot", "0012_outbox_attempts"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="telegramuploaderstats",
+            name="opens",
+            field=models.BigIntegerField(db_comment="times its content was opened", default=0),
+        ),
+        migrations.AlterField(
+            model_name="uploaderlinkstats",
+            name="opens",
+            field=models.BigIntegerField(db_comment="times its content was opened", default=0),
+        ),
+    ]
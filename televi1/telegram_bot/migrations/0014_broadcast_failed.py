@@ -0,0 +1,27 @@
+# Generated by Django 4.2.13 on 2026-10-19 04:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("telegram_bot", "0013_stats_opens_comment"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="broadcast",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("running", "Running"),
+                    ("done", "Done"),
+                    ("canceled", "Canceled"),
+                    ("failed", "Failed"),
+                ],
+                default="pending",
+                max_length=15,
+            ),
+        ),
+    ]
@@ -1,3 +1,7 @@
 from .base import *  # noqa: F403, F401
+from .broadcast import *  # noqa: F403, F401
+from .outbox import *  # noqa: F403, F401
+from .profiling import *  # noqa: F403, F401
+from .stats import *  # noqa: F403, F401
 from .telegram_mappings import *  # noqa: F403, F401
 from .uploader import *  # noqa: F403, F401
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import json
+import logging
 import random
 import string
 from enum import Enum
@@ -11,26 +13,30 @@ import aiogram
 import aiogram.exceptions
 import aiogram.utils.token
 from aiogram.client.default import DefaultBotProperties
-from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
 from django.conf import settings
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import connection, models, transaction
+from django.db.models import Index, Q, UniqueConstraint
 from django.utils import timezone
+from django.utils.crypto import get_random_string
 from django.utils.translation import gettext as _
 
-from televi1.users.models import User, UserManager
+from televi1.users.models import User
 from televi1.utils.models import TimeStampedModel
+from televi1.utils.redis import get_async_redis
 
 from .. import tasks
+from ..session import get_session
+from .outbox import OutboxMessage
+
+logger = logging.getLogger(__name__)
 
 
 class TelegramBotManager(models.Manager):
     async def register(
         self, token: str, tid: int, tbot_name: str, tusername: str, added_from: TelegramBot, added_by: User
     ):
-        session = AiohttpSession(proxy=settings.TELEGRAM_PROXY)
-        aiobot = aiogram.Bot(token, session=session)
+        aiobot = self.model.new_aiobot(token)
         obj: TelegramBot = self.model()
         obj.tid = tid
         obj.title = tbot_name
@@ -48,6 +54,41 @@ class TelegramBotManager(models.Manager):
         await obj.asave()
         return obj
 
+    async def revoke_all(
+        self, bots_qs: models.QuerySet[TelegramBot], notify_the_owners: bool = False
+    ) -> list[tuple[int, int]]:
+        """
+        revokes the bots of the queryset in a single UPDATE ... RETURNING,
+        the notifications of the owners are written to the outbox in the same transaction
+        returns: list[tuple[bot_id, added_by_id]] of the revoked bots
+        """
+        where_sql, where_params = bots_qs.filter(is_revoked=False).values("id").query.sql_with_params()
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        sql = (
+            f"UPDATE {table} SET is_revoked = %s, updated_at = %s "
+            f"WHERE id IN ({where_sql}) RETURNING id, added_by_id"
+        )
+
+        @transaction.atomic
+        def _execute():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, (True, timezone.now(), *where_params))
+                revoked = cursor.fetchall()
+            if notify_the_owners and revoked:
+                OutboxMessage.objects.enqueue(
+                    tasks.send_messages,
+                    items=[self.model.get_revoke_notification(added_by_id) for _, added_by_id in revoked],
+                )
+            return revoked
+
+        return [tuple(i) for i in await sync_to_async(_execute)()]
+
+
+class WebhookStatus(models.TextChoices):
+    OK = "ok"
+    RESYNCED = "resynced"
+    FAILED = "failed"
+
 
 class TelegramBot(TimeStampedModel, models.Model):
     tid = models.BigIntegerField()
@@ -58,19 +99,41 @@ class TelegramBot(TimeStampedModel, models.Model):
     url_specifier = models.CharField(max_length=255, unique=True, db_index=True)
     domain_name = models.CharField(max_length=255)
     is_master = models.BooleanField()
-    added_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="telegrambots_addedby")
+    # indexed as the leading column of tbot_addedby_tid_idx
+    added_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="telegrambots_addedby", db_index=False)
     added_from = models.ForeignKey(
         "self", on_delete=models.CASCADE, related_name="telegrambots_addedfrom", null=True, blank=True
     )
     webhook_synced_at = models.DateTimeField(null=True, blank=True)
+    webhook_checked_at = models.DateTimeField(null=True, blank=True)
+    webhook_status = models.CharField(max_length=15, choices=WebhookStatus.choices, null=True, blank=True)
+    webhook_error = models.TextField(null=True, blank=True)
     is_revoked = models.BooleanField(default=False)
     is_powered_off = models.BooleanField(default=False)
 
     objects = TelegramBotManager()
 
+    class Meta:
+        indexes = [
+            Index(fields=("added_by", "tid"), name="tbot_addedby_tid_idx"),
+            # same bots of a token that are still active, looked up on every registration
+            Index(fields=("tid",), condition=Q(is_revoked=False), name="tbot_active_tid_idx"),
+        ]
+
+    # bot ids are published here whenever a bot is added or its state changes
+    CHANGES_CHANNEL = "televi1:telegram_bot:changes"
+
+    @classmethod
+    async def publish_changes(cls, bot_ids: list[int]):
+        try:
+            await get_async_redis().publish(cls.CHANGES_CHANNEL, json.dumps({"bot_ids": bot_ids}))
+        except Exception:
+            logger.exception(f"publishing changes of {bot_ids} failed")
+
     @property
     def webhook_url(self):
-        return f"{self.domain_name}/{settings.TELEGRAM_WEBHOOK_URL_PREFIX}/{self.url_specifier}/"
+        base_url = settings.TELEGRAM_API_WEBHOOK_BASE_URL or self.domain_name
+        return f"{base_url}/{settings.TELEGRAM_WEBHOOK_URL_PREFIX}/{self.url_specifier}/"
 
     @property
     def is_active(self):
@@ -85,8 +148,15 @@ class TelegramBot(TimeStampedModel, models.Model):
             return self.ChangePowerResult.ALREADY_THERE
         self.is_powered_off = not status
         await self.asave()
+        await self.publish_changes([self.id])
         return self.ChangePowerResult.DONE
 
+    async def get_owner_tid(self) -> int | None:
+        """telegram id of the owner, through the identity it registered the bot with"""
+        return (
+            await TelegramIdentity.objects.filter(user_id=self.added_by_id).values_list("user_tid", flat=True).afirst()
+        )
+
     def get_aiobot(self) -> aiogram.Bot:
         return self.new_aiobot(self.api_token)
 
@@ -129,14 +199,25 @@ class TelegramBot(TimeStampedModel, models.Model):
             added_by=added_by_user_obj,
         )
         await new_bot_obj.sync_webhook()
+        await cls.publish_changes([new_bot_obj.id])
         return new_bot_obj, cls.RegisterResult.DONE
 
+    @staticmethod
+    def get_allowed_updates() -> list[str]:
+        """the update types that the router actually handles, telegram drops the others"""
+        from ..dispatchers import dp
+
+        return sorted(dp.resolve_used_update_types())
+
     async def sync_webhook(self):
         webhook_url = self.webhook_url
         aiobot = self.get_aiobot()
-        success = await aiobot.set_webhook(webhook_url, secret_token=self.secret_token)
+        success = await aiobot.set_webhook(
+            webhook_url, secret_token=self.secret_token, allowed_updates=self.get_allowed_updates()
+        )
         self.webhook_synced_at = timezone.now()
-        await self.asave()
+        # only the sync, the instance may be stale (the bot got revoked or powered off meanwhile)
+        await self.asave(update_fields=["webhook_synced_at", "updated_at"])
         assert success
 
     @classmethod
@@ -147,22 +228,27 @@ class TelegramBot(TimeStampedModel, models.Model):
         """
 
         same_active_bots_qs = cls.objects.filter(tid=tid, is_revoked=False).exclude(added_by=added_by_user_obj)
-        if await same_active_bots_qs.aexists():
-            if await same_active_bots_qs.filter(api_token=api_token).aexists():
-                return True, 0
-            count = await same_active_bots_qs.acount()
-            if count > 50:
-                raise Exception("cannot revoke more than 50 bots")
-            async for i in same_active_bots_qs:
-                await i.revoke(notify_the_owner=True)
-            return False, count
-        return False, 0
+        if await same_active_bots_qs.filter(api_token=api_token).aexists():
+            return True, 0
+        revoked = await cls.objects.revoke_all(same_active_bots_qs, notify_the_owners=True)
+        if revoked:
+            await cls.publish_changes([bot_id for bot_id, _ in revoked])
+        return False, len(revoked)
 
     async def revoke(self, notify_the_owner: bool):
         self.is_revoked = True
-        await self.asave()
+        await sync_to_async(self._save_revoked)(notify_the_owner)
+        await self.publish_changes([self.id])
+
+    @transaction.atomic
+    def _save_revoked(self, notify_the_owner: bool):
+        self.save()
         if notify_the_owner:
-            tasks.send_message.delay(tuser_id=self.added_by_id, message=str(_("ربات شما معلق شد")))
+            OutboxMessage.objects.enqueue(tasks.send_messages, items=[self.get_revoke_notification(self.added_by_id)])
+
+    @staticmethod
+    def get_revoke_notification(added_by_id: int) -> dict:
+        return {"user_id": added_by_id, "params": {"text": str(_("ربات شما معلق شد"))}}
 
     @staticmethod
     def generate_secret_token():
@@ -194,23 +280,85 @@ class TelegramBot(TimeStampedModel, models.Model):
 
     @staticmethod
     def new_aiobot(token: str) -> aiogram.Bot:
-        session = settings.TELEGRAM_SESSION
-        return aiogram.Bot(token, default=DefaultBotProperties(parse_mode=ParseMode.HTML), session=session)
+        return aiogram.Bot(token, default=DefaultBotProperties(parse_mode=ParseMode.HTML), session=get_session())
+
 
+class TelegramIdentityManager(models.Manager):
+    async def auto_new_from_user_tevent(self, tbot: TelegramBot, tuser: aiogram.types.User) -> TelegramIdentity:
+        """
+        race free get or create, concurrent first updates of a user end up with the same row
+        """
+        identity_obj = await sync_to_async(self._insert_if_not_exists)(tbot=tbot, user_tid=tuser.id)
+        if identity_obj is None:
+            identity_obj = await self.select_related("tbot").aget(user_tid=tuser.id, tbot=tbot)
+        return identity_obj
 
-class TelegramUserManager(UserManager):
-    async def auto_new_from_user_tevent(self, tbot: TelegramBot, tuser: aiogram.types.User):
-        username = await self.make_username(base=tuser.username)
-        tuser_obj = await sync_to_async(self.create_user)(username=username, user_tid=tuser.id, tbot=tbot)
-        return tuser_obj
+    def _insert_if_not_exists(self, tbot: TelegramBot, user_tid: int) -> TelegramIdentity | None:
+        """
+        a single INSERT ... ON CONFLICT DO NOTHING, returns None if it already exists
+        """
+        obj: TelegramIdentity = self.model(user_tid=user_tid, tbot=tbot)
+        fields = [i for i in self.model._meta.concrete_fields if not i.primary_key]
+        columns = [connection.ops.quote_name(i.column) for i in fields]
+        values = [i.get_db_prep_save(i.pre_save(obj, add=True), connection) for i in fields]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(values))}) "
+            f"ON CONFLICT (user_tid, tbot_id) DO NOTHING RETURNING id"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, values)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        obj.pk = row[0]
+        obj._state.adding = False
+        obj._state.db = connection.alias
+        return obj
 
+    @transaction.atomic
+    def attach_new_user(self, identity_id: int) -> int:
+        """
+        creates the django user of the identity unless a concurrent call already did
+        returns: the user id
+        """
+        obj = self.select_for_update().get(pk=identity_id)
+        if obj.user_id is None:
+            username = f"tg-{obj.tbot_id}-{obj.user_tid}"
+            if User.objects.filter(username=username).exists():
+                username = f"{username}-{get_random_string(6)}"
+            obj.user = User.objects.create_user(username=username)
+            obj.save(update_fields=["user", "updated_at"])
+        return obj.user_id
+
+
+class TelegramIdentity(TimeStampedModel, models.Model):
+    """
+    a telegram user as seen by one bot. most of them are end users of the sub bots that never
+    use the web side, so the django user is only created once it's needed (owning bots or contents)
+    """
 
-class TelegramUser(User, models.Model):
-    # user = models.OneToOneField(User, related_name="telegramuserprofile", on_delete=models.CASCADE)
     user_tid = models.BigIntegerField(db_comment="user id in telegram")
-    tbot = models.ForeignKey(TelegramBot, related_name="telegramuserprofiles", on_delete=models.CASCADE)
+    tbot = models.ForeignKey(TelegramBot, related_name="identities", on_delete=models.CASCADE)
+    has_blocked_bot = models.BooleanField(default=False, db_comment="broadcasts skip these users")
+    user = models.OneToOneField(
+        User, related_name="telegram_identity", null=True, blank=True, on_delete=models.SET_NULL
+    )
 
-    objects = TelegramUserManager()
+    objects = TelegramIdentityManager()
 
     class Meta:
-        constraints = [UniqueConstraint(fields=("user_tid", "tbot"), name="unique_tuser_tbot")]
+        constraints = [UniqueConstraint(fields=("user_tid", "tbot"), name="unique_tidentity_tbot")]
+        indexes = [
+            # keyset pagination of the broadcasts
+            Index(fields=("tbot", "id"), condition=Q(has_blocked_bot=False), name="tidentity_reachable_idx"),
+        ]
+
+    async def aget_user(self) -> User:
+        """the django user of this identity, created on first use"""
+        if self.user_id is None:
+            from ..identity import identity_cache
+
+            self.user_id = await sync_to_async(TelegramIdentity.objects.attach_new_user)(self.id)
+            await identity_cache.forget([(self.tbot_id, self.user_tid)])
+        return await User.objects.aget(pk=self.user_id)
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from datetime import timedelta
+
+from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
+
+from televi1.users.models import User
+from televi1.utils.models import TimeStampedModel
+
+
+class BroadcastManager(models.Manager):
+    async def new(self, tbot, created_by: User, text: str = None, message=None) -> Broadcast:
+        assert text or message, "either text or message is required"
+        obj = self.model()
+        obj.tbot = tbot
+        obj.created_by = created_by
+        obj.text = text
+        obj.message = message
+        await obj.asave()
+        return obj
+
+    async def claim(self, broadcast_id: int, lease: timedelta) -> Broadcast | None:
+        """
+        takes the lease of the broadcast so that only one worker sends it at a time, returns the broadcast
+        holding the lease or None if another worker holds a live lease or it's already finished
+        """
+        now = timezone.now()
+        claimed = (
+            await self.filter(id=broadcast_id, status__in=(Broadcast.Status.PENDING, Broadcast.Status.RUNNING))
+            .filter(Q(lease_until__isnull=True) | Q(lease_until__lt=now))
+            .aupdate(status=Broadcast.Status.RUNNING, lease_until=now + lease, updated_at=now)
+        )
+        if not claimed:
+            return None
+        return await self.select_related("tbot").aget(id=broadcast_id)
+
+    def stale(self):
+        """
+        running broadcasts whose worker died without releasing them,
+        or released them and then failed to enqueue the next run
+        """
+        return self.filter(
+            Q(lease_until__isnull=True) | Q(lease_until__lt=timezone.now()), status=Broadcast.Status.RUNNING
+        )
+
+
+class Broadcast(TimeStampedModel, models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        DONE = "done"
+        CANCELED = "canceled"
+        FAILED = "failed"
+
+    tbot = models.ForeignKey("TelegramBot", on_delete=models.CASCADE, related_name="broadcasts")
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="broadcasts_createdby")
+    text = models.TextField(null=True, blank=True)
+    message = models.ForeignKey(
+        "TelegramMessage", on_delete=models.CASCADE, related_name="broadcasts", null=True, blank=True
+    )
+    status = models.CharField(max_length=15, choices=Status.choices, default=Status.PENDING)
+    last_tuser_id = models.BigIntegerField(default=0, db_comment="keyset cursor, users up to this id are done")
+    sent_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    blocked_count = models.IntegerField(default=0)
+    lease_until = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = BroadcastManager()
+
+    def _leased(self):
+        """the broadcast as long as it's running under the lease this instance holds"""
+        return type(self).objects.filter(id=self.id, status=self.Status.RUNNING, lease_until=self.lease_until)
+
+    async def checkpoint(self, lease: timedelta, last_tuser_id: int, sent: int, failed: int, blocked: int) -> bool:
+        """
+        saves the progress of a chunk and renews the lease, returns False if the lease was lost
+        (it expired and another worker took it, or the broadcast was canceled)
+        """
+        now = timezone.now()
+        updated = await self._leased().aupdate(
+            last_tuser_id=last_tuser_id,
+            sent_count=F("sent_count") + sent,
+            failed_count=F("failed_count") + failed,
+            blocked_count=F("blocked_count") + blocked,
+            lease_until=now + lease,
+            updated_at=now,
+        )
+        if updated:
+            self.last_tuser_id, self.lease_until = last_tuser_id, now + lease
+        return bool(updated)
+
+    async def finish(self) -> bool:
+        now = timezone.now()
+        updated = await self._leased().aupdate(
+            status=self.Status.DONE, finished_at=now, lease_until=None, updated_at=now
+        )
+        if updated:
+            self.status, self.finished_at, self.lease_until = self.Status.DONE, now, None
+        return bool(updated)
+
+    async def fail(self) -> bool:
+        """stops it for good, it can't be sent (the token of the bot was revoked)"""
+        now = timezone.now()
+        updated = await self._leased().aupdate(
+            status=self.Status.FAILED, finished_at=now, lease_until=None, updated_at=now
+        )
+        if updated:
+            self.status, self.finished_at, self.lease_until = self.Status.FAILED, now, None
+        return bool(updated)
+
+    async def release(self) -> bool:
+        updated = await self._leased().aupdate(lease_until=None, updated_at=timezone.now())
+        if updated:
+            self.lease_until = None
+        return bool(updated)
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+from datetime import timedelta
+
+from celery import Task
+
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from televi1.utils.models import TimeStampedModel
+
+from .. import tasks
+
+# a delivery that's running this long is taken as dead (its worker crashed), a duplicate may run it again
+DELIVERY_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+class OutboxMessageManager(models.Manager):
+    def enqueue(self, task: Task, **kwargs) -> OutboxMessage:
+        """
+        records a call of the task, call it in the transaction of the change the task is a side effect of,
+        the relay sends it to celery once that's committed and never if it's rolled back
+        """
+        return self.create(task=task.name, kwargs=kwargs)
+
+    def pending(self, redeliver_after: timedelta):
+        """
+        the messages not sent to celery yet, and the ones sent long ago but not delivered,
+        in case the broker lost them or their task failed. the failed ones are left out
+        """
+        return self.filter(delivered_at__isnull=True, failed_at__isnull=True).filter(
+            Q(relayed_at__isnull=True) | Q(relayed_at__lt=timezone.now() - redeliver_after)
+        )
+
+    def failed(self):
+        return self.filter(failed_at__isnull=False)
+
+    def relay(self, batch_size: int, redeliver_after: timedelta, max_attempts: int) -> int:
+        """
+        sends a batch of the pending messages to celery, returns the number of them. a message relayed
+        `max_attempts` times is marked as failed instead. the batch stays locked until it's marked as
+        relayed, so the relays can run side by side
+        """
+        with transaction.atomic():
+            messages = list(
+                self.pending(redeliver_after).select_for_update(skip_locked=True).order_by("id")[:batch_size]
+            )
+            if not messages:
+                return 0
+            exhausted_ids = [i.id for i in messages if i.attempts >= max_attempts]
+            with tasks.app.producer_or_acquire() as producer:
+                for i in messages:
+                    if i.id not in exhausted_ids:
+                        tasks.deliver_outbox_message.apply_async(kwargs={"message_id": i.id}, producer=producer)
+            now = timezone.now()
+            self.filter(id__in=exhausted_ids).update(failed_at=now, updated_at=now)
+            self.filter(id__in=[i.id for i in messages if i.id not in exhausted_ids]).update(
+                relayed_at=now, attempts=F("attempts") + 1, updated_at=now
+            )
+        return len(messages)
+
+    def deliver(self, message_id: int):
+        """
+        runs the task of the message unless it's delivered already or a duplicate sent by the relay is
+        running it. the message is claimed, the task runs outside of any transaction and then it's marked
+        as delivered, so no connection idles in a transaction while the task talks to telegram
+        """
+        now = timezone.now()
+        claimed = (
+            self.filter(id=message_id, delivered_at__isnull=True, failed_at__isnull=True)
+            .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - DELIVERY_CLAIM_TIMEOUT))
+            .update(claimed_at=now, updated_at=now)
+        )
+        if not claimed:
+            return None
+        message = self.get(id=message_id)
+        try:
+            result = tasks.app.tasks[message.task](**message.kwargs)
+        except BaseException:
+            # the next relay sends it again
+            self.filter(id=message_id, claimed_at=now).update(claimed_at=None, updated_at=timezone.now())
+            raise
+        delivered_at = timezone.now()
+        self.filter(id=message_id, claimed_at=now).update(delivered_at=delivered_at, updated_at=delivered_at)
+        return result
+
+    def purge(self, older_than: timedelta) -> int:
+        return self.filter(delivered_at__lt=timezone.now() - older_than).delete()[0]
+
+
+class OutboxMessage(TimeStampedModel, models.Model):
+    """a celery task call that's sent once the transaction it's written in commits"""
+
+    task = models.CharField(max_length=255)
+    kwargs = models.JSONField(default=dict)
+    relayed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0, db_comment="times it was relayed")
+    claimed_at = models.DateTimeField(null=True, blank=True, db_comment="when a delivery started running it")
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    failed_at = models.DateTimeField(
+        null=True, blank=True, db_comment="it ran out of attempts, it's not relayed again"
+    )
+
+    objects = OutboxMessageManager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=("id",),
+                condition=Q(delivered_at__isnull=True, failed_at__isnull=True),
+                name="outbox_undelivered_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.id}"
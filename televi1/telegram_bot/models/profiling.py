@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from datetime import timedelta
+
+from django.db import models
+from django.utils import timezone
+
+from televi1.utils.models import TimeStampedModel
+
+
+class UpdateProfileManager(models.Manager):
+    def purge(self, older_than: timedelta) -> int:
+        return self.filter(created_at__lt=timezone.now() - older_than).delete()[0]
+
+
+class UpdateProfile(TimeStampedModel, models.Model):
+    """a statistical profile of an update, see ProfilingMiddleware"""
+
+    class Reason(models.TextChoices):
+        SAMPLED = "sampled"
+        SLOW = "slow"
+
+    tbot = models.ForeignKey(
+        "TelegramBot", on_delete=models.SET_NULL, related_name="update_profiles", null=True, blank=True
+    )
+    update_id = models.BigIntegerField()
+    update_type = models.CharField(max_length=63)
+    handler = models.CharField(max_length=255, blank=True)
+    reason = models.CharField(max_length=15, choices=Reason.choices)
+    duration = models.FloatField(help_text="seconds")
+    samples = models.IntegerField(default=0)
+    cpu_profile = models.TextField(blank=True, help_text="folded stacks, for flamegraph.pl or speedscope")
+    allocations = models.TextField(blank=True, help_text="the top allocations while the update ran")
+
+    objects = UpdateProfileManager()
+
+    def __str__(self):
+        return f"{self.update_type} {self.handler or '-'} {self.duration:.3f}s"
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+
+from django.db import connection, models
+from django.utils import timezone
+
+from televi1.utils.models import TimeStampedModel
+
+
+class StatsManager(models.Manager):
+    def add_counters(self, rows: Iterable[tuple[int, int, int, int]]):
+        """
+        batched upsert of the flushed counters
+        rows: (owner_id, opens_delta, deliveries_delta, unique_users)
+        opens and deliveries are deltas and get added, unique_users is absolute and the bigger one is kept
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        owner_column = connection.ops.quote_name(self.model._meta.get_field(self.model.OWNER_FIELD_NAME).column)
+        now = timezone.now()
+        values_sql = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(rows))
+        params = []
+        for owner_id, opens, deliveries, unique_users in rows:
+            params.extend([owner_id, opens, deliveries, unique_users, now, now])
+        sql = (
+            f"INSERT INTO {table} ({owner_column}, opens, deliveries, unique_users, created_at, updated_at) "
+            f"VALUES {values_sql} "
+            f"ON CONFLICT ({owner_column}) DO UPDATE SET "
+            f"opens = {table}.opens + excluded.opens, "
+            f"deliveries = {table}.deliveries + excluded.deliveries, "
+            f"unique_users = GREATEST({table}.unique_users, excluded.unique_users), "
+            f"updated_at = excluded.updated_at"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+class BaseStats(TimeStampedModel, models.Model):
+    opens = models.BigIntegerField(default=0, db_comment="times its content was opened")
+    deliveries = models.BigIntegerField(default=0, db_comment="times the whole content was delivered successfully")
+    unique_users = models.BigIntegerField(default=0, db_comment="approximate, counted with redis HyperLogLog")
+
+    objects = StatsManager()
+
+    class Meta:
+        abstract = True
+
+
+class UploaderLinkStats(BaseStats):
+    link = models.OneToOneField("UploaderLink", on_delete=models.CASCADE, related_name="stats")
+
+    OWNER_FIELD_NAME = "link"
+
+
+class TelegramUploaderStats(BaseStats):
+    uploader = models.OneToOneField("TelegramUploader", on_delete=models.CASCADE, related_name="stats")
+
+    OWNER_FIELD_NAME = "uploader"
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+from pathlib import Path
+from typing import BinaryIO
+
 from asgiref.sync import async_to_sync, sync_to_async
 from polymorphic.models import PolymorphicModel
 
@@ -58,9 +61,10 @@ class TelegramMessageEntity(TimeStampedModel, models.Model):
         ]
 
     @classmethod
-    async def from_aio(
+    def from_aio(
         cls, tmessage_entity: aiogram.types.MessageEntity, telegram_message: TelegramMessage, is_caption: bool
     ):
+        """not saved, the entities of a message are created in bulk"""
         obj = cls()
         if is_caption:
             obj.telegram_message_caption = telegram_message
@@ -69,7 +73,6 @@ class TelegramMessageEntity(TimeStampedModel, models.Model):
         obj.type = tmessage_entity.type
         obj.offset = tmessage_entity.offset
         obj.length = tmessage_entity.length
-        await obj.asave()
         return obj
 
     def to_aio(self):
@@ -78,7 +81,8 @@ class TelegramMessageEntity(TimeStampedModel, models.Model):
 
 class TelegramMessageQuerySet(models.QuerySet):
     def select_related_all_entities(self):
-        return self.select_related("video", "document")
+        """everything to_aio_params reads, so sending a bundle takes the same queries whatever its size"""
+        return self.select_related("video", "document").prefetch_related("photo", "caption_entities")
 
 
 class TelegramMessageManager(models.Manager):
@@ -146,16 +150,18 @@ class TelegramMessage(TimeStampedModel, models.Model):
             obj.voice = async_to_sync(TelegramVoice.from_aio)(tvoice=tmessage.voice, bot=bot)
         obj.save()
         if tmessage.photo:
-            for tphoto in tmessage.photo:
-                obj.photo.add(async_to_sync(TelegramPhotoSize.from_aio)(tphoto_size=tphoto, bot=bot))
-        if tmessage.entities is not None:
-            for i in tmessage.entities:
-                async_to_sync(TelegramMessageEntity.from_aio)(
-                    tmessage_entity=i, telegram_message=obj, is_caption=False
-                )
-        if tmessage.caption_entities is not None:
-            for i in tmessage.caption_entities:
-                async_to_sync(TelegramMessageEntity.from_aio)(tmessage_entity=i, telegram_message=obj, is_caption=True)
+            obj.photo.add(
+                *[async_to_sync(TelegramPhotoSize.from_aio)(tphoto_size=tphoto, bot=bot) for tphoto in tmessage.photo]
+            )
+        entities = [
+            TelegramMessageEntity.from_aio(tmessage_entity=i, telegram_message=obj, is_caption=False)
+            for i in tmessage.entities or []
+        ]
+        entities += [
+            TelegramMessageEntity.from_aio(tmessage_entity=i, telegram_message=obj, is_caption=True)
+            for i in tmessage.caption_entities or []
+        ]
+        TelegramMessageEntity.objects.bulk_create(entities)
 
         return obj
 
@@ -164,7 +170,8 @@ class TelegramMessage(TimeStampedModel, models.Model):
             method_name = aiogram.Bot.send_media_group.__name__
         elif self.content_type == self.ContentType.PHOTO:
             method_name = aiogram.Bot.send_photo.__name__
-            biggest = await self.photo.order_by("-file_size").afirst()
+            # the prefetched sizes of select_related_all_entities, no query then
+            biggest = max([i async for i in self.photo.all()], key=lambda i: i.file_size or 0)
             kw = {
                 "photo": biggest.file_id,
                 "caption": self.caption,
@@ -201,6 +208,14 @@ class TelegramFile(TimeStampedModel, PolymorphicModel, models.Model):
     class Meta:
         constraints = [UniqueConstraint(fields=("file_id", "file_unique_id"), name="unique_file")]
 
+    async def download(self, destination: BinaryIO | Path | str | None = None) -> BinaryIO | None:
+        """
+        downloads the file into destination, a BytesIO by default. with a self-hosted api server in local mode
+        it's read from the disk instead, without the 20MB limit of the public api
+        """
+        bot_obj = await TelegramBot.objects.aget(id=self.bot_id)
+        return await bot_obj.get_aiobot().download(self.file_id, destination=destination)
+
 
 class TelegramAudio(TelegramFile):
     duration = models.IntegerField()
@@ -6,6 +6,7 @@ from typing import TYPE_CHECKING
 
 from django.contrib.postgres.fields import ArrayField
 from django.db import models, transaction
+from django.db.models import Index
 
 if TYPE_CHECKING:
     from televi1.telegram_bot.dispatchers.base import MustJoin
@@ -13,7 +14,7 @@ if TYPE_CHECKING:
 from televi1.users.models import User
 from televi1.utils.models import TimeStampedModel
 
-from . import TelegramMessage, TelegramUser
+from . import TelegramMessage
 
 
 class TelegramUploaderMessage(TimeStampedModel, models.Model):
@@ -24,23 +25,22 @@ class TelegramUploaderMessage(TimeStampedModel, models.Model):
 
 class TelegramUploaderManager(models.Manager):
     @transaction.atomic
-    def from_wizard(self, name: str, tmessage_ids: list[int], must_joins: list[MustJoin], created_by: TelegramUser):
-        tmessage_qs = TelegramMessage.objects.filter(id__in=tmessage_ids)
+    def from_wizard(
+        self, name: str, tmessage_ids: list[int], must_joins: list[MustJoin], created_by: User, tbot_id: int
+    ):
+        tmessages = TelegramMessage.objects.in_bulk(tmessage_ids)
         obj = self.model()
         obj.name = name
 
         obj.must_join_chat_ids = [i["chat_id"] for i in must_joins]
         obj.created_by = created_by
-        obj.tbot_id = created_by.tbot_id
+        obj.tbot_id = tbot_id
         obj.save()
 
-        for i, tmessage_id in enumerate(tmessage_ids):
-            tmessage_obj = [i for i in tmessage_qs if i.id == tmessage_id][0]
-            tum_obj = TelegramUploaderMessage()
-            tum_obj.message = tmessage_obj
-            tum_obj.uploader = obj
-            tum_obj.order = i
-            tum_obj.save()
+        TelegramUploaderMessage.objects.bulk_create(
+            TelegramUploaderMessage(message=tmessages[tmessage_id], uploader=obj, order=i)
+            for i, tmessage_id in enumerate(tmessage_ids)
+        )
         return obj
 
 
@@ -54,10 +54,16 @@ class TelegramUploader(TimeStampedModel, models.Model):
         related_name="telegramuploaders",
     )
     must_join_chat_ids = ArrayField(base_field=models.BigIntegerField(), size=10)
-    created_by = models.ForeignKey(User, related_name="telegramuploaders_createdby", on_delete=models.CASCADE)
+    # indexed as the leading column of tuploader_createdby_tbot_idx
+    created_by = models.ForeignKey(
+        User, related_name="telegramuploaders_createdby", on_delete=models.CASCADE, db_index=False
+    )
 
     objects = TelegramUploaderManager()
 
+    class Meta:
+        indexes = [Index(fields=("created_by", "tbot"), name="tuploader_createdby_tbot_idx")]
+
 
 class UploaderLinkManager(models.Manager):
     async def new(self, uploader: TelegramUploader):
@@ -0,0 +1,240 @@
+"""
+polling runtime for development and fallback deployments
+
+every polling process is a shard, the bots are assigned to the live shards by consistent hashing
+and a per bot lock in redis makes sure a bot is polled by exactly one shard while the shards
+join, leave or rebalance. bot changes are received over TelegramBot.CHANGES_CHANNEL and the shards
+announce when they join or leave over SHARDS_CHANNEL, every bot is loaded again only when the shards change
+and once every FULL_RESYNC_INTERVAL in case a notification was missed.
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+from contextlib import suppress
+
+from aiogram import Dispatcher
+
+from televi1.utils.orm import get_orm_executor
+from televi1.utils.redis import get_async_redis
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "televi1:polling"
+HEARTBEAT_INTERVAL = 5
+# a shard or a bot lock is considered dead after missing this many seconds of heartbeats
+LEASE_TTL = 3 * HEARTBEAT_INTERVAL
+FULL_RESYNC_INTERVAL = 300
+SHARDS_CHANNEL = f"{KEY_PREFIX}:shards"
+# seconds before listening to the changes again after the connection broke, doubled up to the max
+RECONNECT_BACKOFF = 1
+MAX_RECONNECT_BACKOFF = 60
+
+# sets the value's expiry only if it's still ours
+_RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+# deletes the key only if it's still ours
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes: list[str], replicas: int = 64):
+        self._ring = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self._hashes = [i[0] for i in self._ring]
+
+    def get_node(self, key: str) -> str | None:
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+def default_shard_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class PollingShard:
+    def __init__(self, dp: Dispatcher, name: str = None, polling_timeout: int = 10, delete_webhook: bool = False):
+        self.dp = dp
+        self.name = name or default_shard_name()
+        self.polling_timeout = polling_timeout
+        self.delete_webhook = delete_webhook
+        self._pollers: dict[int, asyncio.Task] = {}
+        self._rebalance_lock = asyncio.Lock()
+        # the ring of the last full rebalance
+        self._shards: list[str] = []
+        self._resynced_at = 0.0
+        # bots of this shard that are not polled yet, their lock was still held or their poller crashed
+        self._waiting: set[int] = set()
+
+    def _shard_key(self, name: str) -> str:
+        return f"{KEY_PREFIX}:shard:{name}"
+
+    def _bot_lock_key(self, bot_id: int) -> str:
+        return f"{KEY_PREFIX}:bot:{bot_id}"
+
+    async def live_shards(self) -> list[str]:
+        prefix = self._shard_key("")
+        return sorted([i.decode().removeprefix(prefix) async for i in get_async_redis().scan_iter(match=prefix + "*")])
+
+    async def run(self):
+        # the pollers and the update tasks they start inherit the context
+        async with get_orm_executor().context():
+            await self._run()
+
+    async def _run(self):
+        redis = get_async_redis()
+        await redis.set(self._shard_key(self.name), 1, ex=LEASE_TTL)
+        await redis.publish(SHARDS_CHANNEL, self.name)
+        logger.info(f"polling shard {self.name} started")
+        await self.dp.emit_startup(dispatcher=self.dp, **self.dp.workflow_data)
+        try:
+            await asyncio.gather(self._heartbeat_loop(), self._changes_loop())
+        finally:
+            for bot_id in list(self._pollers):
+                await self.stop_bot(bot_id)
+            await redis.delete(self._shard_key(self.name))
+            await redis.publish(SHARDS_CHANNEL, self.name)
+            await self.dp.emit_shutdown(dispatcher=self.dp, **self.dp.workflow_data)
+            logger.info(f"polling shard {self.name} stopped")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self.heartbeat()
+            except Exception:
+                logger.exception(f"heartbeat of polling shard {self.name} failed")
+
+    async def heartbeat(self):
+        redis = get_async_redis()
+        renew = redis.register_script(_RENEW_SCRIPT)
+        await redis.set(self._shard_key(self.name), 1, ex=LEASE_TTL)
+        for bot_id in list(self._pollers):
+            renewed = await renew(keys=[self._bot_lock_key(bot_id)], args=[self.name, LEASE_TTL * 1000])
+            if not renewed:
+                logger.warning(f"lost the lock of bot {bot_id}")
+                await self.stop_bot(bot_id, release=False)
+        # a dead shard can't announce that it left, its key expires
+        if await self.live_shards() != self._shards or time.monotonic() - self._resynced_at >= FULL_RESYNC_INTERVAL:
+            await self.rebalance()
+        elif self._waiting:
+            await self.rebalance(changed_bot_ids=list(self._waiting))
+
+    async def _changes_loop(self):
+        backoff = RECONNECT_BACKOFF
+        while True:
+            pubsub = get_async_redis().pubsub()
+            try:
+                await pubsub.subscribe(models.TelegramBot.CHANGES_CHANNEL, SHARDS_CHANNEL)
+                backoff = RECONNECT_BACKOFF
+                # the changes made before it was listening, or while it was away
+                await self.rebalance()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    if message["channel"].decode() == SHARDS_CHANNEL:
+                        # its own announcement is skipped, it just rebalanced
+                        if message["data"].decode() != self.name:
+                            await self.rebalance()
+                    else:
+                        await self.rebalance(changed_bot_ids=json.loads(message["data"])["bot_ids"])
+            except Exception:
+                logger.exception(f"listening to the changes failed, listening again in {backoff} seconds")
+            finally:
+                with suppress(Exception):
+                    await pubsub.aclose()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_RECONNECT_BACKOFF)
+
+    async def rebalance(self, changed_bot_ids: list[int] = None):
+        """starts and stops the pollers of the changed bots, or of all of them if changed_bot_ids is None"""
+        async with self._rebalance_lock:
+            if changed_bot_ids is None:
+                self._shards = await self.live_shards()
+                self._resynced_at = time.monotonic()
+                self._waiting.clear()
+            ring = HashRing(self._shards or [self.name])
+            # powered off bots are kept so that CommonMiddleware can still answer their owners
+            active_bots_qs = models.TelegramBot.objects.filter(is_revoked=False)
+            if changed_bot_ids is not None:
+                self._waiting.difference_update(changed_bot_ids)
+                active_bots_qs = active_bots_qs.filter(id__in=changed_bot_ids)
+                # restarted to poll with the fresh state of the bot
+                for bot_id in changed_bot_ids:
+                    if bot_id in self._pollers:
+                        await self.stop_bot(bot_id)
+            mine = {i.id: i async for i in active_bots_qs if ring.get_node(str(i.id)) == self.name}
+            if changed_bot_ids is None:
+                for bot_id in set(self._pollers) - set(mine):
+                    await self.stop_bot(bot_id)
+            for bot_id, bot_obj in mine.items():
+                if bot_id not in self._pollers:
+                    await self.start_bot(bot_obj)
+
+    async def start_bot(self, bot_obj: models.TelegramBot):
+        acquired = await get_async_redis().set(self._bot_lock_key(bot_obj.id), self.name, nx=True, ex=LEASE_TTL)
+        if not acquired:
+            # still held by the previous owner, the next heartbeat tries again
+            self._waiting.add(bot_obj.id)
+            return
+        aiobot = bot_obj.get_aiobot()
+        if self.delete_webhook:
+            await aiobot.delete_webhook()
+        # start_polling can't be used, it holds a lock of the dispatcher for as long as it polls so the bots of
+        # the shard could not be started and stopped one by one. _polling is private, aiogram is pinned to its
+        # minor version in the Pipfile and tests/test_polling.py checks its signature
+        self._pollers[bot_obj.id] = asyncio.create_task(
+            self.dp._polling(
+                bot=aiobot,
+                polling_timeout=self.polling_timeout,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                dispatcher=self.dp,
+                aiobot=aiobot,
+                bot_obj=bot_obj,
+                **self.dp.workflow_data,
+            ),
+            name=f"polling-{bot_obj.id}",
+        )
+        # a crashed poller is forgotten so that the next heartbeat starts it again
+        self._pollers[bot_obj.id].add_done_callback(lambda task: self._forget_poller(bot_obj.id, task))
+
+    def _forget_poller(self, bot_id: int, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"polling of bot {bot_id} crashed", exc_info=task.exception())
+        if self._pollers.get(bot_id) is task:
+            del self._pollers[bot_id]
+            self._waiting.add(bot_id)
+
+    async def stop_bot(self, bot_id: int, release: bool = True):
+        task = self._pollers.pop(bot_id, None)
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        if release:
+            redis = get_async_redis()
+            await redis.register_script(_RELEASE_SCRIPT)(keys=[self._bot_lock_key(bot_id)], args=[self.name])
+
+
+async def run_shard(dp: Dispatcher, **kwargs):
+    await PollingShard(dp, **kwargs).run()
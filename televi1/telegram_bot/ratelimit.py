@@ -0,0 +1,193 @@
+"""
+outbound rate limits of the bots, shared by every process that calls the bot api
+
+every bot and every chat of a bot has a token bucket in redis, a call takes a token from the bucket of its
+bot and of its chat in one atomic script. a process takes a few tokens at a time and spends the rest locally
+for a short while, so a busy worker goes to redis once every few calls. a flood wait (retry_after) received
+by any process pauses the bucket it's for in all of them.
+"""
+import asyncio
+import logging
+import time
+import weakref
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+
+from televi1.utils.redis import get_async_redis
+
+from .session import DeadlineExceededError, get_remaining
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "televi1:ratelimit"
+# seconds the tokens a process took stay usable, the unused ones are lost afterwards
+LEASE_TTL = 1
+MAX_LOCAL_BUCKETS = 10000
+
+# KEYS are the buckets followed by their cooldown keys, ARGV are rate (tokens per second), burst and the wanted
+# tokens of each bucket. takes at least one token from every bucket and at most the wanted ones, all or nothing.
+# returns {0, taken tokens of each bucket} or {milliseconds to wait}
+_ACQUIRE_SCRIPT = """
+local n = #KEYS / 2
+local wait = 0
+for i = 1, n do
+    wait = math.max(wait, redis.call("pttl", KEYS[n + i]))
+end
+if wait > 0 then
+    return {wait}
+end
+
+local clock = redis.call("time")
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+local tokens = {}
+for i = 1, n do
+    local rate, burst = tonumber(ARGV[3 * i - 2]) / 1000, tonumber(ARGV[3 * i - 1])
+    local state = redis.call("hmget", KEYS[i], "tokens", "at")
+    local available = tonumber(state[1]) or burst
+    local at = tonumber(state[2]) or now
+    tokens[i] = math.min(burst, available + math.max(0, now - at) * rate)
+    if tokens[i] < 1 then
+        wait = math.max(wait, math.ceil((1 - tokens[i]) / rate))
+    end
+end
+if wait > 0 then
+    return {wait}
+end
+
+local result = {0}
+for i = 1, n do
+    local rate, burst = tonumber(ARGV[3 * i - 2]) / 1000, tonumber(ARGV[3 * i - 1])
+    local taken = math.min(tonumber(ARGV[3 * i]), math.floor(tokens[i]))
+    redis.call("hset", KEYS[i], "tokens", tostring(tokens[i] - taken), "at", now)
+    redis.call("pexpire", KEYS[i], math.ceil(burst / rate) + 1000)
+    result[i + 1] = taken
+end
+return result
+"""
+
+
+@dataclass(frozen=True)
+class Bucket:
+    rate: float
+    burst: int
+
+
+class RateLimiter:
+    """
+    token buckets of a bot (`bot`) and of its private chats (`chat`) and groups (`group`, negative chat ids),
+    at most `lease` tokens of a bucket are taken at a time
+    """
+
+    def __init__(self, bot: Bucket, chat: Bucket, group: Bucket, lease: int = 5):
+        self.bot = bot
+        self.chat = chat
+        self.group = group
+        self.lease = lease
+        # key: (tokens, expires at)
+        self._local: dict[str, tuple[int, float]] = {}
+        # key: paused until
+        self._cooldowns: dict[str, float] = {}
+        # loop: key: lock, one refill of a bucket at a time. asyncio locks are bound to the loop they're used in
+        self._locks: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[str, asyncio.Lock]
+        ] = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def get_key(bot_id: int, chat_id: int | str | None = None) -> str:
+        if chat_id is None:
+            return f"{KEY_PREFIX}:{bot_id}"
+        return f"{KEY_PREFIX}:{bot_id}:{chat_id}"
+
+    def get_buckets(self, bot_id: int, chat_id: int | str | None) -> dict[str, Bucket]:
+        buckets = {self.get_key(bot_id): self.bot}
+        if chat_id is not None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            buckets[self.get_key(bot_id, chat_id)] = self.group if is_group else self.chat
+        return buckets
+
+    def _has_local(self, key: str, now: float) -> bool:
+        tokens, expires_at = self._local.get(key, (0, 0))
+        return tokens > 0 and expires_at >= now
+
+    def _get_cooldown(self, keys: list[str], now: float) -> float:
+        return max([self._cooldowns.get(i, 0) - now for i in keys] + [0])
+
+    async def acquire(self, bot_id: int, chat_id: int | str | None = None):
+        """waits for a token of the bot and of the chat, fails open if redis is down"""
+        buckets = self.get_buckets(bot_id, chat_id)
+        while True:
+            now = time.monotonic()
+            wait = self._get_cooldown(list(buckets), now)
+            if not wait:
+                missing = {k: v for k, v in buckets.items() if not self._has_local(k, now)}
+                if not missing:
+                    for key in buckets:
+                        tokens, expires_at = self._local[key]
+                        self._local[key] = (tokens - 1, expires_at)
+                    return
+                try:
+                    wait = await self._refill(missing)
+                except Exception:
+                    logger.exception("acquiring telegram rate limit tokens failed, not limiting")
+                    return
+                if not wait:
+                    # the tokens may be spent by the other callers by now, so it's checked again
+                    continue
+            remaining = get_remaining()
+            if remaining is not None and remaining < wait:
+                raise DeadlineExceededError(method=None, message=f"rate limited for {wait:.2f} seconds")
+            await asyncio.sleep(wait)
+
+    def _get_locks(self, keys: list[str]) -> list[asyncio.Lock]:
+        locks = self._locks.setdefault(asyncio.get_running_loop(), {})
+        if len(locks) > MAX_LOCAL_BUCKETS:
+            for key in [k for k, v in locks.items() if not v.locked()]:
+                del locks[key]
+        # always taken in the same order, so two callers can't wait for each other
+        return [locks.setdefault(i, asyncio.Lock()) for i in sorted(keys)]
+
+    async def _refill(self, buckets: dict[str, Bucket]) -> float:
+        """
+        one caller at a time refills a bucket, the concurrent ones wait for it and use its tokens,
+        returns the seconds to wait if there are none
+        """
+        async with AsyncExitStack() as stack:
+            for lock in self._get_locks(list(buckets)):
+                await stack.enter_async_context(lock)
+            now = time.monotonic()
+            missing = {k: v for k, v in buckets.items() if not self._has_local(k, now)}
+            if not missing:
+                return 0
+            return await self._acquire_remote(missing, now)
+
+    async def _acquire_remote(self, buckets: dict[str, Bucket], now: float) -> float:
+        """takes tokens of the buckets from redis, returns the seconds to wait if there are none"""
+        keys = list(buckets)
+        args = []
+        for bucket in buckets.values():
+            args.extend([bucket.rate, bucket.burst, self.lease])
+        result = await get_async_redis().register_script(_ACQUIRE_SCRIPT)(
+            keys=keys + [f"{i}:cooldown" for i in keys], args=args
+        )
+        if result[0]:
+            return result[0] / 1000
+        if len(self._local) > MAX_LOCAL_BUCKETS:
+            self._local = {k: v for k, v in self._local.items() if v[1] >= now}
+        for key, taken in zip(keys, result[1:]):
+            # added to the ones left, a caller may have spent some of them while redis answered
+            tokens = self._local[key][0] if self._has_local(key, now) else 0
+            self._local[key] = (tokens + taken, now + LEASE_TTL)
+        return 0
+
+    async def cool_down(self, bot_id: int, chat_id: int | str | None, seconds: float):
+        """pauses the bucket of the chat (or of the bot) in all of the processes, after a flood wait"""
+        key = self.get_key(bot_id, chat_id)
+        self._cooldowns[key] = time.monotonic() + seconds
+        self._local.pop(key, None)
+        if len(self._cooldowns) > MAX_LOCAL_BUCKETS:
+            now = time.monotonic()
+            self._cooldowns = {k: v for k, v in self._cooldowns.items() if v > now}
+        try:
+            await get_async_redis().set(f"{key}:cooldown", 1, px=int(seconds * 1000))
+        except Exception:
+            logger.exception(f"sharing the cooldown of {key} failed")
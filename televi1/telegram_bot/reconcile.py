@@ -0,0 +1,79 @@
+"""
+compares the webhook of every bot on telegram's side with ours and syncs the ones that differ
+"""
+import asyncio
+import logging
+import random
+
+import aiogram
+import aiogram.exceptions
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1.0
+
+
+def is_in_sync(bot_obj: models.TelegramBot, info: aiogram.types.WebhookInfo) -> bool:
+    return info.url == bot_obj.webhook_url and sorted(info.allowed_updates or []) == bot_obj.get_allowed_updates()
+
+
+async def _with_backoff(func):
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return await func()
+        except aiogram.exceptions.TelegramRetryAfter as e:
+            delay = e.retry_after
+        except aiogram.exceptions.TelegramNetworkError:
+            delay = BACKOFF_BASE * 2**attempt
+        if attempt == MAX_ATTEMPTS - 1:
+            raise
+        await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+
+async def reconcile_bot(bot_obj: models.TelegramBot) -> models.WebhookStatus:
+    error = None
+    try:
+        aiobot = bot_obj.get_aiobot()
+        info = await _with_backoff(aiobot.get_webhook_info)
+        error = info.last_error_message
+        if is_in_sync(bot_obj, info):
+            status = models.WebhookStatus.OK
+        else:
+            await _with_backoff(bot_obj.sync_webhook)
+            status = models.WebhookStatus.RESYNCED
+    except (aiogram.exceptions.TelegramAPIError, AssertionError) as e:
+        logger.warning(f"reconciling webhook of {bot_obj.id} failed, {str(e)}")
+        status = models.WebhookStatus.FAILED
+        error = str(e)
+    except Exception as e:
+        # the other bots are still reconciled
+        logger.exception(f"reconciling webhook of {bot_obj.id} failed")
+        status = models.WebhookStatus.FAILED
+        error = repr(e)
+
+    await models.TelegramBot.objects.filter(id=bot_obj.id).aupdate(
+        webhook_checked_at=timezone.now(), webhook_status=status, webhook_error=error
+    )
+    return status
+
+
+async def reconcile_all(bots_qs: QuerySet[models.TelegramBot], concurrency: int) -> dict[str, int]:
+    """runs reconcile_bot over the bots with at most `concurrency` of them in flight"""
+    queue: asyncio.Queue[models.TelegramBot] = asyncio.Queue()
+    async for i in bots_qs:
+        queue.put_nowait(i)
+    counts = {i.value: 0 for i in models.WebhookStatus}
+
+    async def worker():
+        while not queue.empty():
+            bot_obj = queue.get_nowait()
+            status = await reconcile_bot(bot_obj)
+            counts[status.value] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return counts
@@ -0,0 +1,203 @@
+"""
+redelivery of the messages of an uploader link that could not be sent
+
+the missing messages of a failed delivery are kept as a job in redis, the job in a hash and its id in a
+sorted set scored by when it's due. tasks.redeliver_messages claims the due jobs and sends their messages
+in order, a message that fails again puts the job back with an exponential backoff and jitter. a job is
+dropped once all of its messages are sent, an error that retrying does not fix is received or it runs
+out of attempts. every save gives the job a new version, the end of a redelivery saves or drops the job
+only if it's still the version it claimed, so a cancel() or a schedule() of a newer delivery in the meantime
+wins.
+"""
+import asyncio
+import json
+import logging
+import random
+import secrets
+import time
+from typing import TypedDict
+
+import aiogram.exceptions
+from django.conf import settings
+
+from televi1.utils.redis import get_async_redis, get_redis_batch
+
+from . import models
+from .identity import identity_cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "televi1:redelivery"
+DUE_KEY = f"{KEY_PREFIX}:due"
+JOBS_KEY = f"{KEY_PREFIX}:jobs"
+BASE_DELAY = 2
+MAX_DELAY = 300
+# a claimed job is due again after this many seconds, in case its worker died
+CLAIM_LEASE = 2 * 60
+CLAIM_BATCH_SIZE = 100
+
+# pushes the due jobs CLAIM_LEASE ahead and returns them, so a job is claimed by one worker
+_CLAIM_SCRIPT = """
+local due = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1], "limit", 0, ARGV[3])
+for _, id in ipairs(due) do
+    redis.call("zadd", KEYS[1], ARGV[2], id)
+end
+return due
+"""
+
+# saves the job (ARGV[3], due at ARGV[4]) or drops it when there's none, only if its hash is still ARGV[2]
+_FINISH_SCRIPT = """
+if (redis.call("hget", KEYS[2], ARGV[1]) or "") ~= ARGV[2] then
+    return 0
+end
+if ARGV[3] == "" then
+    redis.call("zrem", KEYS[1], ARGV[1])
+    redis.call("hdel", KEYS[2], ARGV[1])
+else
+    redis.call("hset", KEYS[2], ARGV[1], ARGV[3])
+    redis.call("zadd", KEYS[1], ARGV[4], ARGV[1])
+end
+return 1
+"""
+
+
+class RedeliveryJob(TypedDict):
+    bot_id: int
+    chat_id: int
+    # ids of the TelegramMessages left to send, in order
+    message_ids: list[int]
+    attempt: int
+
+
+def is_retryable(error: BaseException) -> bool:
+    """network errors, flood limits and errors of telegram's servers may go away, the rest won't"""
+    return isinstance(
+        error,
+        (
+            aiogram.exceptions.TelegramNetworkError,
+            aiogram.exceptions.TelegramRetryAfter,
+            aiogram.exceptions.TelegramServerError,
+        ),
+    )
+
+
+def get_delay(attempt: int, error: BaseException | None = None) -> float:
+    """exponential backoff with jitter, never sooner than telegram asked for"""
+    delay = min(MAX_DELAY, BASE_DELAY * 2**attempt)
+    delay = random.uniform(delay / 2, delay)
+    if isinstance(error, aiogram.exceptions.TelegramRetryAfter):
+        delay = max(delay, error.retry_after)
+    return delay
+
+
+def get_job_id(bot_id: int, chat_id: int, link_id: int) -> str:
+    return f"{bot_id}:{chat_id}:{link_id}"
+
+
+async def _finish(job_id: str, claimed: bytes, raw: str = "", due_at: float = 0):
+    finished = await get_async_redis().register_script(_FINISH_SCRIPT)(
+        keys=[DUE_KEY, JOBS_KEY], args=[job_id, claimed, raw, due_at]
+    )
+    if not finished:
+        logger.info(f"{job_id} was changed while it was redelivered, leaving it as it is")
+
+
+async def _save(job_id: str, job: RedeliveryJob, due_at: float, claimed: bytes | None = None):
+    raw = json.dumps({**job, "version": secrets.token_hex(8)})
+    if claimed is not None:
+        await _finish(job_id, claimed, raw, due_at)
+        return
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.hset(JOBS_KEY, job_id, raw)
+    pipe.zadd(DUE_KEY, {job_id: due_at})
+    await pipe.execute()
+
+
+async def _drop(job_id: str, claimed: bytes | None = None):
+    if claimed is not None:
+        await _finish(job_id, claimed)
+        return
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.zrem(DUE_KEY, job_id)
+    pipe.hdel(JOBS_KEY, job_id)
+    await pipe.execute()
+
+
+async def schedule(job_id: str, job: RedeliveryJob, error: BaseException | None = None, claimed: bytes | None = None):
+    """saves the job with a backoff, `claimed` is the hash of the job when it's rescheduled by its redelivery"""
+    if job["attempt"] >= settings.TELEGRAM_REDELIVERY_MAX_ATTEMPTS:
+        logger.warning(f"giving up redelivering {job_id}, {len(job['message_ids'])} messages were not sent")
+        await _drop(job_id, claimed)
+        return
+    await _save(job_id, job, time.time() + get_delay(job["attempt"], error), claimed)
+
+
+async def cancel(job_id: str):
+    """drops the job, in the writes of the update's batch if there is one"""
+    batch = get_redis_batch()
+    if batch is not None:
+        batch.buffer("zrem", DUE_KEY, job_id)
+        batch.buffer("hdel", JOBS_KEY, job_id)
+        return
+    await _drop(job_id)
+
+
+async def redeliver(job_id: str, job: RedeliveryJob, claimed: bytes):
+    """
+    sends the messages of the job in order, stops at the first one that fails and schedules the rest.
+    `claimed` is the hash of the job that was claimed
+    """
+    bot_obj = await models.TelegramBot.objects.filter(id=job["bot_id"], is_revoked=False).afirst()
+    if bot_obj is None:
+        await _drop(job_id, claimed)
+        return
+    aiobot = bot_obj.get_aiobot()
+    messages = {
+        i.id: i
+        async for i in models.TelegramMessage.objects.filter(id__in=job["message_ids"]).select_related_all_entities()
+    }
+    message_ids = job["message_ids"]
+    while message_ids:
+        message = messages.get(message_ids[0])
+        if message is not None:
+            send_method, aio_params = await message.to_aio_params()
+            try:
+                await getattr(aiobot, send_method)(chat_id=job["chat_id"], **aio_params)
+            except aiogram.exceptions.TelegramForbiddenError:
+                await models.TelegramIdentity.objects.filter(tbot_id=job["bot_id"], user_tid=job["chat_id"]).aupdate(
+                    has_blocked_bot=True
+                )
+                await identity_cache.forget([(job["bot_id"], job["chat_id"])])
+                break
+            except Exception as e:
+                if not is_retryable(e):
+                    logger.info(f"redelivering {message.id} of {job_id} failed, {e}")
+                else:
+                    job = {**job, "message_ids": message_ids, "attempt": job["attempt"] + 1}
+                    await schedule(job_id, job, e, claimed)
+                    return
+        message_ids = message_ids[1:]
+    await _drop(job_id, claimed)
+
+
+async def redeliver_due(limit: int = CLAIM_BATCH_SIZE) -> int:
+    """redelivers the due jobs side by side, returns the number of them"""
+    redis = get_async_redis()
+    now = time.time()
+    job_ids = await redis.register_script(_CLAIM_SCRIPT)(keys=[DUE_KEY], args=[now, now + CLAIM_LEASE, limit])
+    if not job_ids:
+        return 0
+
+    async def run(job_id: str, raw: bytes | None):
+        if raw is None:
+            await _drop(job_id, claimed=b"")
+            return
+        try:
+            await redeliver(job_id, json.loads(raw), raw)
+        except Exception:
+            # it's due again once the claim expires
+            logger.exception(f"redelivering {job_id} failed")
+
+    raws = await redis.hmget(JOBS_KEY, job_ids)
+    await asyncio.gather(*(run(job_id.decode(), raw) for job_id, raw in zip(job_ids, raws)))
+    return len(job_ids)
@@ -0,0 +1,145 @@
+"""
+outbound messages that are not a reply to an update
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from enum import Enum
+from typing import NotRequired, TypedDict
+
+import aiogram
+import aiogram.exceptions
+from django.conf import settings
+from django.db.models import Q
+
+from . import models
+from .identity import identity_cache
+
+logger = logging.getLogger(__name__)
+
+
+class Pacer:
+    """spaces the calls to not go over `rate` calls per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class SendResult(str, Enum):
+    SENT = "sent"
+    FAILED = "failed"
+    BLOCKED = "blocked"
+
+
+async def send_with_retry(
+    aiobot: aiogram.Bot, pacer: Pacer, method_name: str, chat_id: int, params: dict
+) -> SendResult:
+    """
+    TelegramUnauthorizedError is raised, the token of the bot is revoked and none of its calls will go through
+    """
+    method = getattr(aiobot, method_name)
+    for attempt in range(settings.TELEGRAM_SEND_MAX_RETRIES + 1):
+        await pacer.wait()
+        try:
+            await method(chat_id=chat_id, **params)
+            return SendResult.SENT
+        except aiogram.exceptions.TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except aiogram.exceptions.TelegramForbiddenError:
+            return SendResult.BLOCKED
+        except aiogram.exceptions.TelegramBadRequest as e:
+            logger.info(f"sending to {chat_id} failed, {e.message}")
+            return SendResult.FAILED
+        except (aiogram.exceptions.TelegramNetworkError, aiogram.exceptions.TelegramServerError):
+            # a timeout, telegram failing or the circuit of the bot open (session.CircuitOpenError)
+            await asyncio.sleep(min(2**attempt, 30))
+    return SendResult.FAILED
+
+
+class OutgoingMessage(TypedDict):
+    """
+    either tuser_id (a TelegramIdentity), user_id (the django user of an identity)
+    or both of bot_id and chat_id are required
+    """
+
+    tuser_id: NotRequired[int]
+    user_id: NotRequired[int]
+    bot_id: NotRequired[int]
+    chat_id: NotRequired[int]
+    method: NotRequired[str]
+    params: dict
+
+
+async def send_batch(items: list[OutgoingMessage]) -> list[SendResult]:
+    """
+    sends the items grouped by their bot, users and bots are resolved with one query each,
+    returns the result of each item in the same order
+    """
+    tuser_ids = {i["tuser_id"] for i in items if "tuser_id" in i}
+    user_ids = {i["user_id"] for i in items if "user_id" in i}
+    tusers_by_id, tusers_by_user_id = {}, {}
+    if tuser_ids or user_ids:
+        async for i in models.TelegramIdentity.objects.filter(Q(id__in=tuser_ids) | Q(user_id__in=user_ids)).values(
+            "id", "user_id", "user_tid", "tbot_id"
+        ):
+            tusers_by_id[i["id"]] = i
+            if i["user_id"] is not None:
+                tusers_by_user_id[i["user_id"]] = i
+
+    results: list[SendResult | None] = [None] * len(items)
+    recipients: list[dict | None] = [None] * len(items)
+    by_bot: dict[int, list[tuple[int, int, OutgoingMessage]]] = defaultdict(list)
+    for index, item in enumerate(items):
+        if "tuser_id" in item or "user_id" in item:
+            if "tuser_id" in item:
+                tuser = tusers_by_id.get(item["tuser_id"])
+            else:
+                tuser = tusers_by_user_id.get(item["user_id"])
+            if tuser is None:
+                results[index] = SendResult.FAILED
+                continue
+            recipients[index] = tuser
+            by_bot[tuser["tbot_id"]].append((index, tuser["user_tid"], item))
+        else:
+            by_bot[item["bot_id"]].append((index, item["chat_id"], item))
+    bots = {i.id: i async for i in models.TelegramBot.objects.filter(id__in=by_bot.keys())}
+
+    async def send_for_bot(bot_id: int, entries: list[tuple[int, int, OutgoingMessage]]):
+        bot_obj = bots.get(bot_id)
+        if bot_obj is None or bot_obj.is_revoked:
+            for index, _, _ in entries:
+                results[index] = SendResult.FAILED
+            return
+        aiobot = bot_obj.get_aiobot()
+        pacer = Pacer(settings.TELEGRAM_BROADCAST_RATE)
+        bot_results = await asyncio.gather(
+            *(
+                send_with_retry(
+                    aiobot, pacer, item.get("method", aiogram.Bot.send_message.__name__), chat_id, item["params"]
+                )
+                for _, chat_id, item in entries
+            )
+        )
+        for (index, _, _), result in zip(entries, bot_results):
+            results[index] = result
+
+    await asyncio.gather(*(send_for_bot(bot_id, entries) for bot_id, entries in by_bot.items()))
+
+    blocked = [
+        tuser for tuser, result in zip(recipients, results) if result == SendResult.BLOCKED and tuser is not None
+    ]
+    if blocked:
+        await models.TelegramIdentity.objects.filter(id__in=[i["id"] for i in blocked]).aupdate(has_blocked_bot=True)
+        await identity_cache.forget([(i["tbot_id"], i["user_tid"]) for i in blocked])
+    return results
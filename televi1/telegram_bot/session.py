@@ -0,0 +1,260 @@
+"""
+aiohttp session of the bots that fails fast instead of waiting on a degraded telegram or proxy
+
+every update gets a deadline (UpdateDeadlineMiddleware) and the api calls it makes wait at most until then.
+every bot gets a circuit breaker, once its calls keep failing they fail at once for a while instead of
+holding the webhook workers, then a single call is let through to check if it's back.
+the calls also wait for the rate limits of the bot and the chat, see ratelimit.
+one pool of warm connections per event loop is shared by all of the bots, it's started and closed with the
+loop, by the asgi lifespan and the worker loop of celery.
+the session of the process is made from the settings the first time it's needed, see get_session.
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+from aiohttp import ClientSession
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+
+import aiogram
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import TelegramMethod
+from django.conf import settings
+
+from televi1.utils import tracing
+
+from . import metrics
+
+if TYPE_CHECKING:
+    from .ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceededError(TelegramNetworkError):
+    pass
+
+
+class CircuitOpenError(TelegramNetworkError):
+    pass
+
+
+_deadline: ContextVar[float | None] = ContextVar("telegram_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """the telegram api calls of the block end by then, a nested deadline can only shorten it"""
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(at if outer is None else min(at, outer))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def get_remaining() -> float | None:
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    closed until `failures` calls fail in `window` seconds, then open for `cooldown` seconds,
+    then half open: one call goes through, it closes the circuit if it succeeds or opens it again
+    """
+
+    def __init__(self, failures: int, window: float, cooldown: float):
+        self.failures = failures
+        self.window = window
+        self.cooldown = cooldown
+        self._failed_at: deque[float] = deque()
+        self.opened_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            return False
+        # this call is the probe, the others wait for another cooldown
+        self.opened_at = now
+        return True
+
+    def record_success(self):
+        self.opened_at = None
+        self._failed_at.clear()
+
+    def record_failure(self):
+        now = time.monotonic()
+        if self.opened_at is not None:
+            self.opened_at = now
+            return
+        self._failed_at.append(now)
+        while self._failed_at and now - self._failed_at[0] > self.window:
+            self._failed_at.popleft()
+        if len(self._failed_at) >= self.failures:
+            self.opened_at = now
+            self._failed_at.clear()
+
+
+class GuardedAiohttpSession(AiohttpSession):
+    def __init__(
+        self,
+        breaker_failures: int,
+        breaker_window: float,
+        breaker_cooldown: float,
+        rate_limiter: "RateLimiter | None" = None,
+        pool_size: int = 100,
+        pool_size_per_host: int = 0,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.breaker_failures = breaker_failures
+        self.breaker_window = breaker_window
+        self.breaker_cooldown = breaker_cooldown
+        self.breakers: dict[int, CircuitBreaker] = {}
+        self.rate_limiter = rate_limiter
+        self._connector_init.update(
+            limit=pool_size,
+            limit_per_host=pool_size_per_host,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl,
+        )
+        # aiohttp sessions are bound to the loop they're made in, the bots of a loop share its connections.
+        # the loops run in different threads (the worker loop, async_to_sync), hence the lock
+        self._sessions: dict[asyncio.AbstractEventLoop, ClientSession] = {}
+        self._sessions_lock = threading.Lock()
+
+    async def create_session(self) -> ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            with self._sessions_lock:
+                # the loops of async_to_sync are gone by now, so are their connections
+                for i in [i for i in self._sessions if i.is_closed()]:
+                    del self._sessions[i]
+                session = ClientSession(
+                    connector=self._connector_type(**self._connector_init),
+                    headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram.__version__}"},
+                )
+                self._sessions[loop] = session
+        return session
+
+    async def start(self):
+        """makes the session of the running loop, call it once the loop starts"""
+        await self.create_session()
+
+    async def close(self):
+        """closes the session of the running loop, call it before the loop stops"""
+        with self._sessions_lock:
+            session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+            # the ssl connections need a moment to close
+            await asyncio.sleep(0.25)
+
+    def stats(self) -> dict:
+        """
+        the connections of all of the loops of the process, saturated once `in_use` reaches `limit`.
+        aiohttp has no api for them, its private attributes are read (aiogram pins aiohttp to its minor version,
+        tests/test_session.py checks them) and taken as empty if they are gone
+        """
+        with self._sessions_lock:
+            connectors = [i.connector for i in self._sessions.values() if not i.closed]
+        return {
+            "limit": sum(i.limit for i in connectors),
+            "in_use": sum(len(getattr(i, "_acquired", ())) for i in connectors),
+            "idle": sum(len(conns) for i in connectors for conns in getattr(i, "_conns", {}).values()),
+            "waiting": sum(len(waiters) for i in connectors for waiters in getattr(i, "_waiters", {}).values()),
+        }
+
+    def get_breaker(self, bot_id: int) -> CircuitBreaker:
+        breaker = self.breakers.get(bot_id)
+        if breaker is None:
+            breaker = CircuitBreaker(self.breaker_failures, self.breaker_window, self.breaker_cooldown)
+            self.breakers[bot_id] = breaker
+        return breaker
+
+    async def make_request(self, bot: aiogram.Bot, method: TelegramMethod, timeout: int | None = None):
+        breaker = self.get_breaker(bot.id)
+        if not breaker.allow():
+            raise CircuitOpenError(method=method, message=f"the calls of bot {bot.id} are failing, not trying")
+        remaining = get_remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceededError(method=method, message="the deadline of the update has passed")
+            timeout = min(self.timeout if timeout is None else timeout, remaining)
+        chat_id = getattr(method, "chat_id", None)
+        if self.rate_limiter is not None:
+            with tracing.span("telegram.rate_limit", chat_id=chat_id):
+                await self.rate_limiter.acquire(bot.id, chat_id)
+            remaining = get_remaining()
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+
+        was_open = breaker.is_open
+        metrics.observe_http_pool(self.stats())
+        try:
+            with metrics.API_SECONDS.labels(method.__api_method__).time():
+                with tracing.span(f"telegram.{method.__api_method__}", chat_id=chat_id):
+                    result = await super().make_request(bot, method, timeout=timeout)
+        except TelegramRetryAfter as e:
+            # telegram answered, it's the flood limit
+            breaker.record_success()
+            if self.rate_limiter is not None:
+                await self.rate_limiter.cool_down(bot.id, chat_id, e.retry_after)
+            raise
+        except (TelegramNetworkError, TelegramServerError):
+            breaker.record_failure()
+            if breaker.is_open and not was_open:
+                logger.warning(f"circuit of bot {bot.id} opened, its calls fail for {breaker.cooldown} seconds")
+            raise
+        except TelegramAPIError:
+            # any other error is an answer of telegram, so it's reachable
+            breaker.record_success()
+            raise
+        breaker.record_success()
+        return result
+
+
+@functools.cache
+def get_session() -> GuardedAiohttpSession:
+    """the session of all of the bots of the process"""
+    from .ratelimit import Bucket, RateLimiter
+
+    rate_limiter = None
+    if settings.TELEGRAM_RATE_LIMIT:
+        rate_limiter = RateLimiter(
+            bot=Bucket(rate=settings.TELEGRAM_BOT_RATE, burst=settings.TELEGRAM_BOT_BURST),
+            chat=Bucket(rate=settings.TELEGRAM_CHAT_RATE, burst=settings.TELEGRAM_CHAT_BURST),
+            group=Bucket(rate=settings.TELEGRAM_GROUP_RATE, burst=settings.TELEGRAM_GROUP_BURST),
+        )
+    return GuardedAiohttpSession(
+        api=settings.TELEGRAM_API_SERVER,
+        proxy=settings.TELEGRAM_PROXY,
+        breaker_failures=settings.TELEGRAM_BREAKER_FAILURES,
+        breaker_window=settings.TELEGRAM_BREAKER_WINDOW,
+        breaker_cooldown=settings.TELEGRAM_BREAKER_COOLDOWN,
+        rate_limiter=rate_limiter,
+        pool_size=settings.TELEGRAM_HTTP_POOL_SIZE,
+        pool_size_per_host=settings.TELEGRAM_HTTP_POOL_SIZE_PER_HOST,
+        keepalive_timeout=settings.TELEGRAM_HTTP_KEEPALIVE,
+        dns_cache_ttl=settings.TELEGRAM_HTTP_DNS_CACHE_TTL,
+    )
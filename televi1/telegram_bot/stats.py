@@ -0,0 +1,123 @@
+"""
+write-behind counters of the uploader links
+
+the hot path (uploader_link_handler) only touches redis, counters are flushed into
+the *Stats tables periodically by tasks.flush_link_stats
+"""
+import logging
+from collections import defaultdict
+
+from django_redis import get_redis_connection
+
+from django.db import transaction
+
+from televi1.utils.redis import get_async_redis, get_redis_batch
+
+from . import models
+
+KEY_PREFIX = "televi1:stats"
+DIRTY_KEY = f"{KEY_PREFIX}:dirty"
+FLUSHING_KEY = f"{KEY_PREFIX}:flushing"
+FLUSH_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def _link_key(link_id: int, field: str) -> str:
+    return f"{KEY_PREFIX}:link:{link_id}:{field}"
+
+
+def _uploader_key(uploader_id: int, field: str) -> str:
+    return f"{KEY_PREFIX}:uploader:{uploader_id}:{field}"
+
+
+async def record_link_visit(ulink: models.UploaderLink, user_tid: int, delivered: bool):
+    """
+    counts an open of the link (and a successful delivery if so) in one redis round trip, or in the
+    writes of the update's batch, never raises so that the stats can not break the delivery
+    """
+    commands = [("incr", _link_key(ulink.id, "opens"))]
+    if delivered:
+        commands.append(("incr", _link_key(ulink.id, "deliveries")))
+    commands.append(("pfadd", _link_key(ulink.id, "users"), user_tid))
+    commands.append(("pfadd", _uploader_key(ulink.uploader_id, "users"), user_tid))
+    commands.append(("sadd", DIRTY_KEY, f"{ulink.id}:{ulink.uploader_id}"))
+
+    batch = get_redis_batch()
+    if batch is not None:
+        for command, *args in commands:
+            batch.buffer(command, *args)
+        return
+    pipe = get_async_redis().pipeline(transaction=False)
+    for command, *args in commands:
+        getattr(pipe, command)(*args)
+    try:
+        await pipe.execute()
+    except Exception:
+        logger.exception(f"recording stats of {ulink.id} failed")
+
+
+def flush_pending() -> int:
+    """
+    moves the pending counters from redis to the database,
+    returns the number of flushed links
+    """
+    r = get_redis_connection("default")
+    # anything left from a crashed flush is merged with the new ones
+    pipe = r.pipeline(transaction=True)
+    pipe.sunionstore(FLUSHING_KEY, [FLUSHING_KEY, DIRTY_KEY])
+    pipe.delete(DIRTY_KEY)
+    pipe.execute()
+
+    flushed = 0
+    while members := r.srandmember(FLUSHING_KEY, FLUSH_BATCH_SIZE):
+        _flush_batch(r, [i.decode() for i in members])
+        r.srem(FLUSHING_KEY, *members)
+        flushed += len(members)
+    return flushed
+
+
+def _flush_batch(r, members: list[str]):
+    link_uploader_ids = [tuple(int(j) for j in i.split(":")) for i in members]
+    uploader_ids = sorted({uploader_id for _, uploader_id in link_uploader_ids})
+
+    pipe = r.pipeline(transaction=True)
+    for link_id, _ in link_uploader_ids:
+        pipe.getset(_link_key(link_id, "opens"), 0)
+        pipe.getset(_link_key(link_id, "deliveries"), 0)
+        pipe.pfcount(_link_key(link_id, "users"))
+    for uploader_id in uploader_ids:
+        pipe.pfcount(_uploader_key(uploader_id, "users"))
+    results = iter(pipe.execute())
+
+    link_rows = []
+    uploader_deltas = defaultdict(lambda: [0, 0])
+    for link_id, uploader_id in link_uploader_ids:
+        opens, deliveries, unique_users = int(next(results) or 0), int(next(results) or 0), next(results)
+        link_rows.append((link_id, opens, deliveries, unique_users))
+        uploader_deltas[uploader_id][0] += opens
+        uploader_deltas[uploader_id][1] += deliveries
+    uploader_rows = [(i, *uploader_deltas[i], next(results)) for i in uploader_ids]
+
+    try:
+        with transaction.atomic():
+            # links or uploaders may have been deleted since
+            existing_link_ids = set(
+                models.UploaderLink.objects.filter(id__in=[i[0] for i in link_rows]).values_list("id", flat=True)
+            )
+            existing_uploader_ids = set(
+                models.TelegramUploader.objects.filter(id__in=uploader_ids).values_list("id", flat=True)
+            )
+            models.UploaderLinkStats.objects.add_counters(i for i in link_rows if i[0] in existing_link_ids)
+            models.TelegramUploaderStats.objects.add_counters(
+                i for i in uploader_rows if i[0] in existing_uploader_ids
+            )
+    except Exception:
+        # give the taken deltas back so that the next flush picks them up
+        pipe = r.pipeline(transaction=False)
+        for link_id, opens, deliveries, _ in link_rows:
+            pipe.incrby(_link_key(link_id, "opens"), opens)
+            pipe.incrby(_link_key(link_id, "deliveries"), deliveries)
+        pipe.sadd(DIRTY_KEY, *members)
+        pipe.execute()
+        raise
@@ -1,15 +1,247 @@
+import logging
+import random
+import sys
+import time
 from collections.abc import Awaitable, Callable
 from typing import Any
 
 import aiogram
 from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.fsm.middleware import FSMContextMiddleware
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.utils.translation import gettext as _
 
-from televi1.users.models import User
+from televi1.utils import profiling, replicas, tracing
+from televi1.utils.metrics import count_queries
+from televi1.utils.redis import redis_batch
 
-from . import models
-from .models import TelegramUser
+from . import metrics, models, session
+from .fsm import BatchedRedisStorage
+from .identity import UNKNOWN, identity_cache
+
+logger = logging.getLogger(__name__)
+
+
+class RedisBatchMiddleware(BaseMiddleware):
+    """
+    outer middleware of the updates, before the fsm one. the redis keys the update is going to read
+    (fsm state and data, identity, primary pin) are fetched in one MGET and its redis writes are sent
+    in one pipeline once it's handled
+    """
+
+    def __init__(self, fsm: FSMContextMiddleware):
+        self.fsm = fsm
+
+    def get_keys(self, data: dict[str, Any]) -> list[str]:
+        keys = []
+        context = self.fsm.resolve_event_context(data["bot"], data)
+        if context is not None and isinstance(self.fsm.storage, BatchedRedisStorage):
+            keys.extend(self.fsm.storage.get_keys(context.key))
+        event_from_user: aiogram.types.User | None = data.get("event_from_user")
+        bot_obj: models.TelegramBot | None = data.get("bot_obj")
+        if event_from_user is not None:
+            if bot_obj is not None:
+                keys.append(identity_cache.redis_key(bot_obj.id, event_from_user.id))
+            if settings.DATABASE_REPLICAS:
+                keys.append(replicas.pin_key(event_from_user.id))
+        return keys
+
+    async def __call__(
+        self,
+        handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: aiogram.types.TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        async with redis_batch() as batch:
+            try:
+                with metrics.FSM_REDIS_SECONDS.labels("prefetch").time(), tracing.span("redis.prefetch"):
+                    await batch.prefetch(self.get_keys(data))
+            except Exception:
+                # the keys are read one by one then
+                logger.exception("prefetching the redis keys of the update failed")
+            try:
+                return await handler(event, data)
+            finally:
+                try:
+                    with metrics.FSM_REDIS_SECONDS.labels("flush").time(), tracing.span("redis.flush"):
+                        await batch.flush()
+                except Exception:
+                    logger.exception("flushing the redis writes of the update failed")
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    opens the "update" span with the id, type and bot of the update, the spans of the queries, the redis
+    round trips and the api calls of the update nest under it. under the webhook view it joins the trace
+    the view started
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: aiogram.types.Update,
+        data: dict[str, Any],
+    ) -> Any:
+        bot_obj: models.TelegramBot | None = data.get("bot_obj")
+        with tracing.trace(
+            "update",
+            update_id=event.update_id,
+            update_type=event.event_type,
+            bot_id=bot_obj.id if bot_obj is not None else None,
+        ):
+            return await handler(event, data)
+
+
+class TracingHandlerMiddleware(BaseMiddleware):
+    """
+    handler middleware, tags the trace with the handler the update reached (its queries carry it in their
+    sql comment from then on) and wraps the handler in a span of its own
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: aiogram.types.TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_name = data["handler"].callback.__name__
+        tracing.set_attributes(handler=handler_name)
+        with tracing.span(f"handler {handler_name}"):
+            return await handler(event, data)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    times the updates and counts their database queries by the kind of their bot and their type, and keeps
+    the gauge of the updates in flight. it goes around the middlewares after it in TELEGRAM_MIDDLEWARE so their
+    time counts too, the redis batch and the fsm are outer middlewares and run before it (see FSM_REDIS_SECONDS)
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: aiogram.types.Update,
+        data: dict[str, Any],
+    ) -> Any:
+        bot_kind = metrics.get_bot_kind(data.get("bot_obj"))
+        update_type = event.event_type
+        in_flight = metrics.UPDATES_IN_FLIGHT.labels(bot_kind)
+        in_flight.inc()
+        started_at = time.perf_counter()
+        try:
+            with count_queries() as queries:
+                return await handler(event, data)
+        finally:
+            in_flight.dec()
+            metrics.UPDATE_SECONDS.labels(bot_kind, update_type).observe(time.perf_counter() - started_at)
+            metrics.UPDATE_QUERIES.labels(bot_kind, update_type).observe(queries[0])
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """handler middleware, times the handler that the update reached and counts its errors"""
+
+    async def __call__(
+        self,
+        handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: aiogram.types.TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_name = data["handler"].callback.__name__
+        bot_kind = metrics.get_bot_kind(data.get("bot_obj"))
+        update_type = data["event_update"].event_type
+        started_at = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            metrics.HANDLER_ERRORS.labels(handler_name, bot_kind, update_type, type(e).__name__).inc()
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.labels(handler_name, bot_kind, update_type).observe(
+                time.perf_counter() - started_at
+            )
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """
+    opt-in, profiles TELEGRAM_PROFILE_SAMPLE_RATE of the updates and the ones slower than
+    TELEGRAM_PROFILE_SLOW_SECONDS into UpdateProfile. the allocations are traced for the sampled ones only,
+    tracemalloc slows down every allocation of the process while it's on
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: aiogram.types.Update,
+        data: dict[str, Any],
+    ) -> Any:
+        sampled = random.random() < settings.TELEGRAM_PROFILE_SAMPLE_RATE
+        slow_seconds = settings.TELEGRAM_PROFILE_SLOW_SECONDS
+        if not sampled and slow_seconds is None:
+            return await handler(event, data)
+
+        started_at = time.perf_counter()
+        # stays None if the profiling fails to start, there's nothing to save then
+        profile = None
+        try:
+            with profiling.profile(sys._getframe(), trace_allocations=sampled) as profile:
+                return await handler(event, data)
+        finally:
+            duration = time.perf_counter() - started_at
+            if profile is not None and (sampled or duration >= slow_seconds):
+                await self.save(event, data, profile, duration, sampled)
+
+    async def save(
+        self,
+        event: aiogram.types.Update,
+        data: dict[str, Any],
+        profile: profiling.Profile,
+        duration: float,
+        sampled: bool,
+    ):
+        try:
+            await models.UpdateProfile.objects.acreate(
+                tbot=data.get("bot_obj"),
+                update_id=event.update_id,
+                update_type=event.event_type,
+                handler=profile.name or "",
+                reason=models.UpdateProfile.Reason.SAMPLED if sampled else models.UpdateProfile.Reason.SLOW,
+                duration=duration,
+                samples=profile.samples,
+                cpu_profile=profile.folded(),
+                allocations="\n".join(profile.allocations),
+            )
+        except Exception:
+            logger.exception("saving the profile of the update failed")
+
+
+class ProfilingHandlerMiddleware(BaseMiddleware):
+    """handler middleware, names the profile of the update after its handler"""
+
+    async def __call__(
+        self,
+        handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: aiogram.types.TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        profile = profiling.get_profile()
+        if profile is not None:
+            profile.name = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+class UpdateDeadlineMiddleware(BaseMiddleware):
+    """the telegram api calls of the update fail once TELEGRAM_UPDATE_DEADLINE seconds have passed"""
+
+    async def __call__(
+        self,
+        handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: aiogram.types.TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        with session.deadline(settings.TELEGRAM_UPDATE_DEADLINE):
+            return await handler(event, data)
 
 
 class CommonMiddleware(BaseMiddleware):
@@ -24,9 +256,7 @@ class CommonMiddleware(BaseMiddleware):
         bot_obj: models.TelegramBot = data["bot_obj"]
         aiobot: aiogram.Bot = data["aiobot"]
         if bot_obj.is_powered_off:
-            owner_tuser_r = await bot_obj.added_by
-            assert isinstance(owner_tuser_r, TelegramUser)
-            if owner_tuser_r == event_from_user.id:
+            if await bot_obj.get_owner_tid() == event_from_user.id:
                 base_bot = await models.TelegramBot.objects.aget(id=bot_obj.added_from_id)
                 text = _("ربات شما خاموش است، از طریق {0} فعال نمایید").format(f"@{base_bot.tusername}")
                 await aiobot.send_message(chat_id=event_chat.id, text=text)
@@ -44,18 +274,51 @@ class AuthenticationMiddleware(BaseMiddleware):
         event_chat: aiogram.types.Chat = data["event_chat"]
         event_from_user: aiogram.types.User = data["event_from_user"]
         bot_obj: models.TelegramBot = data["bot_obj"]
-        tuser = None
-        try:
+        tuser = await identity_cache.get(bot_obj, event_from_user.id)
+        if tuser is None or (tuser is UNKNOWN and event_chat.type == "private"):
             tuser = (
-                await TelegramUser.objects.filter(user_tid=event_from_user.id, tbot_id=bot_obj.id)
+                await models.TelegramIdentity.objects.filter(user_tid=event_from_user.id, tbot_id=bot_obj.id)
                 .select_related("tbot")
-                .aget()
+                .afirst()
             )
-        except User.DoesNotExist:
-            if event_chat.type == "private":
-                tuser = await models.TelegramUser.objects.auto_new_from_user_tevent(
+            if tuser is None and event_chat.type == "private":
+                tuser = await models.TelegramIdentity.objects.auto_new_from_user_tevent(
                     tbot=bot_obj, tuser=event_from_user
                 )
+            await identity_cache.set(bot_obj, event_from_user.id, tuser)
+        elif tuser is UNKNOWN:
+            tuser = None
+
+        if tuser is not None and tuser.has_blocked_bot and event_chat.type == "private":
+            # the user is talking to the bot again, so it's unblocked
+            tuser.has_blocked_bot = False
+            await models.TelegramIdentity.objects.filter(pk=tuser.pk).aupdate(has_blocked_bot=False)
+            await identity_cache.set(bot_obj, event_from_user.id, tuser)
 
         data.update(user=tuser or AnonymousUser())
         return await handler(event, data)
+
+
+class ReplicaReadsMiddleware(BaseMiddleware):
+    """
+    handler middleware, the handlers flagged with `replica_reads` read from the replicas unless their user
+    wrote in the last DATABASE_REPLICA_PIN_SECONDS, the users of any handler that writes are pinned
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[aiogram.types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: aiogram.types.TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        event_from_user: aiogram.types.User | None = data.get("event_from_user")
+        if not settings.DATABASE_REPLICAS or event_from_user is None:
+            return await handler(event, data)
+        use_replicas = bool(get_flag(data, "replica_reads"))
+        pinned = use_replicas and await replicas.is_pinned(event_from_user.id)
+        with replicas.database_scope(replicas=use_replicas, pinned=pinned) as scope:
+            try:
+                return await handler(event, data)
+            finally:
+                if scope.wrote:
+                    await replicas.pin(event_from_user.id)
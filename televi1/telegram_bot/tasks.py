@@ -1,13 +1,92 @@
-import aiogram
+from datetime import timedelta
+
 from config.celery_app import app
+from django.conf import settings
 
 from televi1.utils.celery import async_task
 
+# stay well below CELERY_TASK_SOFT_TIME_LIMIT
+BROADCAST_TIME_BUDGET = 40
+WEBHOOK_RECONCILE_CONCURRENCY = 10
+
+
+@async_task(app)
+async def send_messages(items: list[dict]) -> list[str]:
+    """
+    Sends many messages in one task, see sender.OutgoingMessage for the items.
+    Returns the result of each item.
+    """
+    from televi1.telegram_bot import sender
+
+    results = await sender.send_batch(items)
+    return [i.value for i in results]
+
 
 @async_task(app)
 async def send_message(tuser_id: int, message: str):
-    from televi1.telegram_bot.models import TelegramUser
+    """Kept for the messages already in the queue, use send_messages."""
+    from televi1.telegram_bot import sender
+
+    await sender.send_batch([{"tuser_id": tuser_id, "params": {"text": message}}])
+
+
+@app.task
+def deliver_outbox_message(message_id: int):
+    """Runs the task of an outbox message, the relay may send one twice but it runs once."""
+    from televi1.telegram_bot.models import OutboxMessage
+
+    return OutboxMessage.objects.deliver(message_id)
+
+
+@app.task
+def flush_link_stats():
+    """Moves the write-behind link counters from redis to the database."""
+    from televi1.telegram_bot import stats
+
+    return stats.flush_pending()
+
+
+@async_task(app)
+async def redeliver_messages():
+    """Sends again the due messages of the uploader links that failed to send."""
+    from televi1.telegram_bot import redelivery
+
+    return await redelivery.redeliver_due()
+
+
+@async_task(app, acks_late=True)
+async def run_broadcast(broadcast_id: int):
+    """Sends a chunk of the broadcast and re-enqueues itself until it's done."""
+    from televi1.telegram_bot import broadcast
+
+    has_more = await broadcast.run(broadcast_id, time_budget=BROADCAST_TIME_BUDGET)
+    if has_more:
+        run_broadcast.delay(broadcast_id=broadcast_id)
+
+
+@app.task
+def resume_stale_broadcasts():
+    """Re-enqueues the broadcasts whose worker died in the middle."""
+    from televi1.telegram_bot.models import Broadcast
+
+    broadcast_ids = list(Broadcast.objects.stale().values_list("id", flat=True))
+    for broadcast_id in broadcast_ids:
+        run_broadcast.delay(broadcast_id=broadcast_id)
+    return len(broadcast_ids)
+
+
+@async_task(app, soft_time_limit=30 * 60, time_limit=31 * 60)
+async def reconcile_webhooks():
+    """Syncs the webhook of the bots whose webhook on telegram differs from ours."""
+    from televi1.telegram_bot import models, reconcile
+
+    bots_qs = models.TelegramBot.objects.filter(is_revoked=False)
+    return await reconcile.reconcile_all(bots_qs, concurrency=WEBHOOK_RECONCILE_CONCURRENCY)
+
+
+@app.task
+def purge_update_profiles():
+    """Deletes the update profiles older than TELEGRAM_PROFILE_RETENTION_DAYS."""
+    from televi1.telegram_bot.models import UpdateProfile
 
-    user = await TelegramUser.objects.aget(id=tuser_id)
-    aiobot: aiogram.Bot = user.telegramuserprofile.tbot.get_aiobot()
-    await aiobot.send_message(chat_id=user.user_tid, text=message)
+    return UpdateProfile.objects.purge(older_than=timedelta(days=settings.TELEGRAM_PROFILE_RETENTION_DAYS))
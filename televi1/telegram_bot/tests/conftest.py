@@ -0,0 +1,25 @@
+import pytest
+
+from televi1.utils import redis as redis_utils
+
+from .. import models, polling, ratelimit, redelivery, stats
+from ..models import base as models_base
+from .fakes import FakeAiobot, FakeRedis
+
+
+@pytest.fixture
+def fake_redis(monkeypatch) -> FakeRedis:
+    """one in memory redis for every module, sync for django_redis"""
+    fake_redis = FakeRedis()
+    for module in (redis_utils, redelivery, stats, ratelimit, polling, models_base):
+        monkeypatch.setattr(module, "get_async_redis", lambda: fake_redis)
+    monkeypatch.setattr(stats, "get_redis_connection", lambda alias="default": fake_redis.sync())
+    return fake_redis
+
+
+@pytest.fixture
+def fake_aiobot(monkeypatch) -> FakeAiobot:
+    """the bot of every TelegramBot"""
+    fake_aiobot = FakeAiobot()
+    monkeypatch.setattr(models.TelegramBot, "get_aiobot", lambda self: fake_aiobot)
+    return fake_aiobot
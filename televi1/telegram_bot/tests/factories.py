@@ -0,0 +1,47 @@
+from factory import Faker, LazyFunction, Sequence, SubFactory
+from factory.django import DjangoModelFactory
+
+from televi1.users.tests.factories import UserFactory
+
+from .. import models
+
+
+class TelegramBotFactory(DjangoModelFactory):
+    tid = Sequence(lambda n: 1000000 + n)
+    tusername = Sequence(lambda n: f"test_{n}_bot")
+    title = Faker("name")
+    api_token = Sequence(lambda n: f"{1000000 + n}:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw")
+    secret_token = LazyFunction(models.TelegramBot.generate_secret_token)
+    url_specifier = Sequence(lambda n: f"test-{n}")
+    domain_name = "example.com"
+    is_master = False
+    added_by = SubFactory(UserFactory)
+
+    class Meta:
+        model = models.TelegramBot
+
+
+class TelegramIdentityFactory(DjangoModelFactory):
+    user_tid = Sequence(lambda n: 5000000 + n)
+    tbot = SubFactory(TelegramBotFactory)
+
+    class Meta:
+        model = models.TelegramIdentity
+
+
+class TelegramUploaderFactory(DjangoModelFactory):
+    name = Faker("word")
+    tbot = SubFactory(TelegramBotFactory)
+    must_join_chat_ids = []
+    created_by = SubFactory(UserFactory)
+
+    class Meta:
+        model = models.TelegramUploader
+
+
+class UploaderLinkFactory(DjangoModelFactory):
+    uploader = SubFactory(TelegramUploaderFactory)
+    queryid = Sequence(lambda n: f"queryid-{n}")
+
+    class Meta:
+        model = models.UploaderLink
@@ -0,0 +1,260 @@
+"""
+fakes of redis and of the bots, shared by the tests
+"""
+import asyncio
+
+import aiogram.exceptions
+
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class FakeStore:
+    """
+    the data of a FakeRedis and the commands the code uses, on strings (bytes), hashes (dicts), sets,
+    sorted sets (dicts of scores) and hyperloglogs (exact sets). the expirations are recorded, never applied.
+    """
+
+    def __init__(self):
+        self.data: dict = {}
+        # key: milliseconds
+        self.expirations: dict[str, int] = {}
+        self.published: list[tuple[str, bytes]] = []
+
+    def _drop_empty(self, key):
+        if key in self.data and not self.data[key] and not isinstance(self.data[key], bytes):
+            del self.data[key]
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(i) for i in keys]
+
+    def set(self, key, value, ex=None, px=None):
+        self.data[key] = _encode(value)
+        if ex is not None or px is not None:
+            self.expirations[key] = px if px is not None else ex * 1000
+        return True
+
+    def getset(self, key, value):
+        old = self.data.get(key)
+        self.data[key] = _encode(value)
+        return old
+
+    def delete(self, *keys):
+        return sum(self.data.pop(i, None) is not None for i in keys)
+
+    def exists(self, *keys):
+        return sum(i in self.data for i in keys)
+
+    def incrby(self, key, amount):
+        self.data[key] = _encode(int(self.data.get(key, 0)) + amount)
+        return int(self.data[key])
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
+    def pfadd(self, key, *values):
+        hll = self.data.setdefault(key, set())
+        added = {_encode(i) for i in values} - hll
+        hll.update(added)
+        return int(bool(added))
+
+    def pfcount(self, *keys):
+        return len(set().union(*(self.data.get(i, set()) for i in keys)))
+
+    def sadd(self, key, *members):
+        members = {_encode(i) for i in members} - self.data.get(key, set())
+        self.data.setdefault(key, set()).update(members)
+        return len(members)
+
+    def srem(self, key, *members):
+        members = {_encode(i) for i in members} & self.data.get(key, set())
+        self.data.get(key, set()).difference_update(members)
+        self._drop_empty(key)
+        return len(members)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def srandmember(self, key, number):
+        return list(self.data.get(key, set()))[:number]
+
+    def sunionstore(self, destination, keys):
+        union = set().union(*(self.data.get(i, set()) for i in keys))
+        self.data[destination] = union
+        self._drop_empty(destination)
+        return len(union)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        mapping = {**(mapping or {}), **({field: value} if field is not None else {})}
+        values = self.data.setdefault(key, {})
+        added = len({_encode(i) for i in mapping} - values.keys())
+        values.update({_encode(k): _encode(v) for k, v in mapping.items()})
+        return added
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(_encode(field))
+
+    def hmget(self, key, fields):
+        return [self.hget(key, i) for i in fields]
+
+    def hdel(self, key, *fields):
+        values = self.data.get(key, {})
+        deleted = sum(values.pop(_encode(i), None) is not None for i in fields)
+        self._drop_empty(key)
+        return deleted
+
+    def zadd(self, key, mapping):
+        scores = self.data.setdefault(key, {})
+        added = len({_encode(i) for i in mapping} - scores.keys())
+        scores.update({_encode(k): float(v) for k, v in mapping.items()})
+        return added
+
+    def zrem(self, key, *members):
+        scores = self.data.get(key, {})
+        removed = sum(scores.pop(_encode(i), None) is not None for i in members)
+        self._drop_empty(key)
+        return removed
+
+    def zscore(self, key, member):
+        return self.data.get(key, {}).get(_encode(member))
+
+    def publish(self, channel, message):
+        self.published.append((channel, _encode(message)))
+        return 0
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self._queued = []
+
+    def __getattr__(self, command):
+        if command.startswith("_") or not hasattr(FakeStore, command):
+            raise AttributeError(command)
+
+        def queue(*args, **kwargs):
+            self._queued.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        queued, self._queued = self._queued, []
+        self.redis.round_trips.append("pipeline")
+        results = [self.redis._run(command, args, kwargs) for command, args, kwargs in queued]
+        return self.redis._result(results)
+
+
+class FakeRedis:
+    """
+    an in memory redis, async like get_async_redis() or sync like django_redis with `is_async=False`.
+    the round trips are recorded in `round_trips` (the command, "pipeline" or "script") and every command in
+    `commands`. the lua scripts are not run, `scripts` maps the source of a script to a python version of it,
+    called with the store, the keys and the args.
+    """
+
+    def __init__(self, store: FakeStore | None = None, scripts: dict | None = None, is_async: bool = True):
+        self.store = store or FakeStore()
+        self.scripts = {} if scripts is None else scripts
+        self.is_async = is_async
+        self.round_trips: list[str] = []
+        self.commands: list[tuple] = []
+
+    @property
+    def data(self) -> dict:
+        return self.store.data
+
+    @data.setter
+    def data(self, value: dict):
+        self.store.data = value
+
+    def sync(self) -> "FakeRedis":
+        """a sync client of the same data"""
+        redis = FakeRedis(store=self.store, scripts=self.scripts, is_async=False)
+        redis.round_trips, redis.commands = self.round_trips, self.commands
+        return redis
+
+    def get_encoder(self):
+        from redis.asyncio import Redis
+
+        return Redis().get_encoder()
+
+    def _run(self, command, args, kwargs):
+        self.commands.append((command, *args))
+        return getattr(self.store, command)(*args, **kwargs)
+
+    def _result(self, value):
+        if not self.is_async:
+            return value
+
+        async def result():
+            # a round trip lets the other tasks run, like a real one
+            await asyncio.sleep(0)
+            return value
+
+        return result()
+
+    def __getattr__(self, command):
+        if command.startswith("_") or not hasattr(FakeStore, command):
+            raise AttributeError(command)
+
+        def call(*args, **kwargs):
+            self.round_trips.append(command)
+            return self._result(self._run(command, args, kwargs))
+
+        return call
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def register_script(self, script: str):
+        def call(keys=(), args=()):
+            self.round_trips.append("script")
+            return self._result(self.scripts[script](self.store, list(keys), list(args)))
+
+        return call
+
+
+class FakeAiobot:
+    """
+    a bot of the tests, the calls that went through are recorded in `calls` as (method, args, kwargs). the calls
+    to the chats in `blocked` raise TelegramForbiddenError and the ones with a text in `failing` time out.
+    `errors[chat_id]` are raised by the next calls to the chat, one per call.
+    the methods return `results[method]`, True by default
+    """
+
+    def __init__(self, blocked=(), failing=(), errors: dict | None = None, results: dict | None = None):
+        self.blocked = set(blocked)
+        self.failing = set(failing)
+        self.errors = errors or {}
+        self.results = results or {}
+        self.calls: list[tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def call(*args, **kwargs):
+            if kwargs.get("chat_id") in self.blocked:
+                raise aiogram.exceptions.TelegramForbiddenError(method=None, message="bot was blocked by the user")
+            if self.errors.get(kwargs.get("chat_id")):
+                raise self.errors[kwargs.get("chat_id")].pop(0)
+            if kwargs.get("text") in self.failing:
+                raise aiogram.exceptions.TelegramNetworkError(method=None, message="Request timeout error")
+            self.calls.append((method, args, kwargs))
+            return self.results.get(method, True)
+
+        return call
+
+    def get_calls(self, method: str) -> list[tuple[tuple, dict]]:
+        return [(args, kwargs) for i, args, kwargs in self.calls if i == method]
+
+    def sent(self, field: str = "chat_id") -> list:
+        """a field of the messages sent, in order"""
+        return [kwargs.get(field) for method, _, kwargs in self.calls if method.startswith("send")]
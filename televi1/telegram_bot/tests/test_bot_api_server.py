@@ -0,0 +1,50 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+from aiogram.client.telegram import SimpleFilesPathWrapper, TelegramAPIServer
+
+from .. import models
+from ..fake_bot_api import FakeBotAPI
+from ..session import get_session
+from .factories import TelegramBotFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def bot_api(settings, tmp_path):
+    bot_api = FakeBotAPI(files_path=tmp_path)
+    url = bot_api.start()
+    wrap_local_file = SimpleFilesPathWrapper(server_path=bot_api.server_files_path, local_path=tmp_path)
+    api = TelegramAPIServer.from_base(url, is_local=True, wrap_local_file=wrap_local_file)
+    settings.TELEGRAM_API_SERVER = api
+    settings.TELEGRAM_RATE_LIMIT = False
+    # the session is made again from these settings, and once more from the real ones afterwards
+    get_session.cache_clear()
+    settings.TELEGRAM_API_WEBHOOK_BASE_URL = "http://django:5000"
+    yield bot_api
+    bot_api.stop()
+    get_session.cache_clear()
+
+
+def test_webhooks_are_registered_on_the_configured_server(bot_api):
+    tbot = TelegramBotFactory()
+
+    async_to_sync(tbot.sync_webhook)()
+
+    assert tbot.webhook_url.startswith("http://django:5000/")
+    assert bot_api.webhooks == {tbot.api_token: tbot.webhook_url}
+    info = async_to_sync(tbot.get_aiobot().get_webhook_info)()
+    assert info.url == tbot.webhook_url
+
+
+def test_files_are_read_from_the_disk_in_local_mode(bot_api, tmp_path):
+    tbot = TelegramBotFactory()
+    # the server wrote it into its own directory, it's mounted at tmp_path here
+    (tmp_path / "document-1").write_bytes(b"content")
+    tfile = models.TelegramDocument.objects.create(bot=tbot, file_id="document-1", file_unique_id="document-1")
+
+    downloaded = async_to_sync(tfile.download)()
+
+    assert downloaded.read() == b"content"
+    assert [i[1] for i in bot_api.calls] == ["getFile"]
@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram.exceptions
+from django.utils import timezone
+
+from .. import broadcast, models
+from .factories import TelegramBotFactory, TelegramIdentityFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def fast_broadcast(settings):
+    settings.TELEGRAM_BROADCAST_RATE = 10000
+    settings.TELEGRAM_BROADCAST_CHUNK_SIZE = 2
+
+
+def test_broadcast_sends_to_all_and_marks_blocked(fast_broadcast, fake_aiobot):
+    tbot = TelegramBotFactory()
+    tusers = TelegramIdentityFactory.create_batch(5, tbot=tbot)
+    TelegramIdentityFactory(tbot=TelegramBotFactory())
+    fake_aiobot.blocked = {tusers[1].user_tid}
+    broadcast_obj = async_to_sync(models.Broadcast.objects.new)(tbot=tbot, created_by=tbot.added_by, text="hi")
+
+    has_more = async_to_sync(broadcast.run)(broadcast_obj.id, time_budget=60)
+
+    assert has_more is False
+    assert fake_aiobot.sent() == [i.user_tid for i in tusers if i != tusers[1]]
+    broadcast_obj.refresh_from_db()
+    assert broadcast_obj.status == models.Broadcast.Status.DONE
+    assert (broadcast_obj.sent_count, broadcast_obj.blocked_count) == (4, 1)
+    assert broadcast_obj.last_tuser_id == tusers[-1].id
+    assert models.TelegramIdentity.objects.get(id=tusers[1].id).has_blocked_bot
+
+    fake_aiobot.calls = []
+    next_broadcast_obj = async_to_sync(models.Broadcast.objects.new)(tbot=tbot, created_by=tbot.added_by, text="hi")
+    async_to_sync(broadcast.run)(next_broadcast_obj.id, time_budget=60)
+    assert tusers[1].user_tid not in fake_aiobot.sent()
+
+
+def test_broadcast_resumes_from_checkpoint(fast_broadcast, fake_aiobot):
+    tbot = TelegramBotFactory()
+    tusers = TelegramIdentityFactory.create_batch(4, tbot=tbot)
+    broadcast_obj = async_to_sync(models.Broadcast.objects.new)(tbot=tbot, created_by=tbot.added_by, text="hi")
+    models.Broadcast.objects.filter(id=broadcast_obj.id).update(last_tuser_id=tusers[1].id)
+
+    async_to_sync(broadcast.run)(broadcast_obj.id, time_budget=60)
+
+    assert fake_aiobot.sent() == [tusers[2].user_tid, tusers[3].user_tid]
+
+
+def test_broadcast_stops_when_it_loses_its_lease(fast_broadcast, fake_aiobot):
+    tbot = TelegramBotFactory()
+    tusers = TelegramIdentityFactory.create_batch(4, tbot=tbot)
+    broadcast_obj = async_to_sync(models.Broadcast.objects.new)(tbot=tbot, created_by=tbot.added_by, text="hi")
+    send_message = fake_aiobot.send_message
+
+    async def cancel_while_sending(**kwargs):
+        await models.Broadcast.objects.filter(id=broadcast_obj.id).aupdate(status=models.Broadcast.Status.CANCELED)
+        return await send_message(**kwargs)
+
+    fake_aiobot.send_message = cancel_while_sending
+
+    assert async_to_sync(broadcast.run)(broadcast_obj.id, time_budget=60) is False
+
+    assert fake_aiobot.sent() == [i.user_tid for i in tusers[:2]]
+    broadcast_obj.refresh_from_db()
+    assert (broadcast_obj.status, broadcast_obj.sent_count) == (models.Broadcast.Status.CANCELED, 0)
+
+
+def test_broadcast_fails_when_the_token_is_revoked(fast_broadcast, fake_aiobot):
+    tbot = TelegramBotFactory()
+    tusers = TelegramIdentityFactory.create_batch(4, tbot=tbot)
+    broadcast_obj = async_to_sync(models.Broadcast.objects.new)(tbot=tbot, created_by=tbot.added_by, text="hi")
+    fake_aiobot.errors = {
+        tusers[2].user_tid: [aiogram.exceptions.TelegramUnauthorizedError(method=None, message="Unauthorized")]
+    }
+
+    assert async_to_sync(broadcast.run)(broadcast_obj.id, time_budget=60) is False
+
+    broadcast_obj.refresh_from_db()
+    assert broadcast_obj.status == models.Broadcast.Status.FAILED
+    assert (broadcast_obj.last_tuser_id, broadcast_obj.sent_count, broadcast_obj.failed_count) == (tusers[3].id, 3, 1)
+    assert not models.Broadcast.objects.stale().exists()
+
+
+def test_broadcast_saves_the_chunk_before_an_error_goes_up(fast_broadcast, fake_aiobot):
+    tbot = TelegramBotFactory()
+    tusers = TelegramIdentityFactory.create_batch(4, tbot=tbot)
+    broadcast_obj = async_to_sync(models.Broadcast.objects.new)(tbot=tbot, created_by=tbot.added_by, text="hi")
+    fake_aiobot.errors = {tusers[2].user_tid: [RuntimeError("unexpected")]}
+
+    with pytest.raises(RuntimeError):
+        async_to_sync(broadcast.run)(broadcast_obj.id, time_budget=60)
+
+    broadcast_obj.refresh_from_db()
+    assert broadcast_obj.status == models.Broadcast.Status.RUNNING
+    assert (broadcast_obj.last_tuser_id, broadcast_obj.sent_count, broadcast_obj.failed_count) == (tusers[3].id, 3, 1)
+    assert fake_aiobot.sent() == [i.user_tid for i in tusers if i != tusers[2]]
+
+    # the retry of the task goes on from there
+    fake_aiobot.calls = []
+    models.Broadcast.objects.filter(id=broadcast_obj.id).update(lease_until=None)
+    assert async_to_sync(broadcast.run)(broadcast_obj.id, time_budget=60) is False
+    assert fake_aiobot.sent() == []
+
+
+def test_released_or_expired_running_broadcasts_are_stale():
+    tbot = TelegramBotFactory()
+    now = timezone.now()
+    released, expired, live, _ = [
+        models.Broadcast.objects.create(tbot=tbot, created_by=tbot.added_by, text="hi", status=status, lease_until=i)
+        for status, i in [
+            (models.Broadcast.Status.RUNNING, None),
+            (models.Broadcast.Status.RUNNING, now - timedelta(seconds=1)),
+            (models.Broadcast.Status.RUNNING, now + timedelta(minutes=1)),
+            (models.Broadcast.Status.DONE, None),
+        ]
+    ]
+
+    assert set(models.Broadcast.objects.stale()) == {released, expired}
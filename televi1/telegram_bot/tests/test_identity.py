@@ -0,0 +1,84 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+
+from televi1.users.tests.factories import UserFactory
+
+from .. import models
+from ..identity import UNKNOWN, IdentityCache
+from .factories import TelegramBotFactory, TelegramIdentityFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def make_tuser(tid=777, username="someone"):
+    return aiogram.types.User(id=tid, is_bot=False, first_name="x", username=username)
+
+
+class TestAutoNewFromUserTevent:
+    def test_creates_once(self, django_assert_num_queries):
+        tbot = TelegramBotFactory()
+
+        with django_assert_num_queries(1):
+            identity_obj = async_to_sync(models.TelegramIdentity.objects.auto_new_from_user_tevent)(
+                tbot=tbot, tuser=make_tuser()
+            )
+        again_identity_obj = async_to_sync(models.TelegramIdentity.objects.auto_new_from_user_tevent)(
+            tbot=tbot, tuser=make_tuser()
+        )
+
+        assert identity_obj.pk == again_identity_obj.pk
+        saved = models.TelegramIdentity.objects.get(pk=identity_obj.pk)
+        assert (saved.user_tid, saved.tbot_id, saved.user_id) == (777, tbot.id, None)
+
+
+class TestAgetUser:
+    def test_creates_the_user_once(self):
+        identity_obj = TelegramIdentityFactory(user_tid=777)
+
+        user = async_to_sync(identity_obj.aget_user)()
+        again_user = async_to_sync(models.TelegramIdentity.objects.get(pk=identity_obj.pk).aget_user)()
+
+        assert user.pk == again_user.pk == models.TelegramIdentity.objects.get(pk=identity_obj.pk).user_id
+        assert user.username == f"tg-{identity_obj.tbot_id}-777"
+        assert not user.has_usable_password()
+
+    def test_username_taken_by_another_user(self):
+        identity_obj = TelegramIdentityFactory(user_tid=777)
+        other_user = UserFactory(username=f"tg-{identity_obj.tbot_id}-777")
+
+        user = async_to_sync(identity_obj.aget_user)()
+
+        assert user.pk != other_user.pk
+        assert user.username.startswith(f"tg-{identity_obj.tbot_id}-777-")
+
+
+def test_get_owner_tid():
+    owner_identity = TelegramIdentityFactory(user=UserFactory())
+    tbot = TelegramBotFactory(added_by=owner_identity.user)
+
+    assert async_to_sync(tbot.get_owner_tid)() == owner_identity.user_tid
+    assert async_to_sync(TelegramBotFactory().get_owner_tid)() is None
+
+
+class TestIdentityCache:
+    def test_local_hit_without_redis(self, django_assert_num_queries):
+        tbot = TelegramBotFactory()
+        identity_obj = TelegramIdentityFactory(tbot=tbot, user_tid=777, user=UserFactory())
+        cache = IdentityCache()
+        async_to_sync(cache.set)(tbot, 777, identity_obj)
+        async_to_sync(cache.set)(tbot, 778, None)
+
+        with django_assert_num_queries(0):
+            cached = async_to_sync(cache.get)(tbot, 777)
+            assert async_to_sync(cache.get)(tbot, 778) is UNKNOWN
+
+        assert (cached.pk, cached.user_tid, cached.tbot_id, cached.tbot, cached.user_id) == (
+            identity_obj.pk,
+            777,
+            tbot.id,
+            tbot,
+            identity_obj.user_id,
+        )
+        assert models.TelegramUploader.objects.filter(created_by_id=cached.user_id).count() == 0
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+
+from televi1.users.models import User
+
+from .. import loadtest, models
+
+pytestmark = pytest.mark.django_db
+
+
+def test_scenarios_make_valid_updates_for_the_data():
+    data = loadtest.create_data(sub_bots=2, bundle_size=3)
+    updates = loadtest.Updates(first_message_id=data.next_message_tid)
+
+    for name, scenario in loadtest.SCENARIOS.items():
+        sessions = scenario(data, updates, 12)
+        assert sessions, name
+        for tbot, update in (i for session in sessions for i in session):
+            assert aiogram.types.Update.model_validate(update).event_type in ("message", "callback_query")
+    assert data.uploaders[data.subs[0].id].messages.count() == 3
+
+    loadtest.delete_data(data)
+    assert not models.TelegramBot.objects.filter(url_specifier__startswith=data.prefix).exists()
+    assert not User.objects.filter(username__startswith=data.prefix).exists()
+
+
+def test_asgi_client_starts_the_app_and_posts():
+    events = []
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                events.append(message["type"])
+                await send({"type": f"{message['type']}.complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        body = (await receive())["body"]
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": json.dumps({"echo": json.loads(body)}).encode()})
+
+    async def work():
+        client = loadtest.AsgiClient(app, "localhost")
+        await client.startup()
+        response = await client.post("/", b'{"a": 1}', {})
+        await client.shutdown()
+        return response
+
+    assert async_to_sync(work)() == (200, b'{"echo": {"a": 1}}')
+    assert events == ["lifespan.startup", "lifespan.shutdown"]
+
+
+def test_regressions_are_measured_against_the_baseline():
+    baseline = {"link_open": {"updates_per_second": 100, "p50_ms": 10, "p99_ms": 50, "queries_per_update": 4}}
+    result = loadtest.Result(updates=10, seconds=0.125, latencies=[0.01] * 9 + [0.2], queries=60, calls=10)
+
+    summary = result.summary()
+
+    assert (summary["updates_per_second"], summary["p99_ms"], summary["queries_per_update"]) == (80, 200, 6)
+    regressions = loadtest.compare({"link_open": summary}, baseline, tolerance=0.1)
+    assert [i.split(":")[0] for i in regressions] == [
+        "link_open updates_per_second",
+        "link_open p99_ms",
+        "link_open queries_per_update",
+    ]
@@ -0,0 +1,64 @@
+import pytest
+from asgiref.sync import async_to_sync
+from prometheus_client import REGISTRY
+
+import aiogram
+from aiogram.dispatcher.event.handler import HandlerObject
+
+from televi1.utils.orm import ORMExecutor
+
+from .. import models
+from ..t_middleware import HandlerMetricsMiddleware, MetricsMiddleware
+
+pytestmark = pytest.mark.django_db
+
+USER = {"id": 1, "is_bot": False, "first_name": "x"}
+
+
+def get_sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_updates_are_timed_and_their_queries_counted():
+    update = aiogram.types.Update(
+        update_id=1, message={"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "hi"}
+    )
+    labels = {"bot_kind": "unknown", "update_type": "message"}
+    count_before = get_sample("telegram_update_seconds_count", **labels)
+    queries_before = get_sample("telegram_update_db_queries_sum", **labels)
+
+    async def handler(event, data):
+        await models.TelegramBot.objects.filter(id=-1).aexists()
+
+    async_to_sync(MetricsMiddleware())(handler, update, {})
+
+    assert get_sample("telegram_update_seconds_count", **labels) == count_before + 1
+    assert get_sample("telegram_update_db_queries_sum", **labels) == queries_before + 1
+    assert get_sample("telegram_updates_in_flight", bot_kind="unknown") == 0
+
+
+def test_handler_errors_are_counted_by_handler():
+    async def broken_handler():
+        raise ValueError
+
+    update = aiogram.types.Update(update_id=1, callback_query={"id": "1", "from": USER, "chat_instance": "1"})
+    labels = {"handler": "broken_handler", "bot_kind": "unknown", "update_type": "callback_query"}
+    data = {"handler": HandlerObject(callback=broken_handler), "event_update": update}
+
+    with pytest.raises(ValueError):
+        async_to_sync(HandlerMetricsMiddleware())(lambda event, data: broken_handler(), update.callback_query, data)
+
+    assert get_sample("telegram_handler_seconds_count", **labels) == 1
+    assert get_sample("telegram_handler_errors_total", error="ValueError", **labels) == 1
+
+
+def test_the_queue_wait_of_the_orm_executor_is_exported():
+    executor = ORMExecutor(max_workers=1, conn_max_age=60)
+    before = get_sample("telegram_orm_queue_wait_seconds_count")
+
+    try:
+        executor.submit(lambda: None).result()
+    finally:
+        executor.shutdown()
+
+    assert get_sample("telegram_orm_queue_wait_seconds_count") == before + 1
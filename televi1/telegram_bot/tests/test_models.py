@@ -0,0 +1,73 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+from televi1.users.tests.factories import UserFactory
+
+from .. import models, tasks
+from .factories import TelegramBotFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def published(monkeypatch):
+    published = []
+
+    async def publish_changes(bot_ids):
+        published.append(bot_ids)
+
+    monkeypatch.setattr(models.TelegramBot, "publish_changes", staticmethod(publish_changes))
+    return published
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    def _broker_is_not_touched(**kwargs):
+        raise AssertionError("the notifications must go through the outbox")
+
+    monkeypatch.setattr(tasks.send_messages, "delay", _broker_is_not_touched)
+    return lambda: list(
+        models.OutboxMessage.objects.filter(task=tasks.send_messages.name).values_list("kwargs", flat=True)
+    )
+
+
+class TestHandlePervSameBots:
+    def test_revokes_all_in_bulk(self, user, published, enqueued, django_assert_num_queries):
+        same_bots = TelegramBotFactory.create_batch(60, tid=42, added_by=UserFactory())
+        own_bot = TelegramBotFactory(tid=42, added_by=user)
+        other_bot = TelegramBotFactory(tid=43)
+
+        # the same token check, the update and the outbox message, in a transaction
+        with django_assert_num_queries(5):
+            is_revoke_token_required, revoked_count = async_to_sync(models.TelegramBot.handle_perv_same_bots)(
+                added_by_user_obj=user, tid=42, api_token="new-token"
+            )
+
+        assert (is_revoke_token_required, revoked_count) == (False, 60)
+        assert set(models.TelegramBot.objects.filter(is_revoked=True).values_list("id", flat=True)) == {
+            i.id for i in same_bots
+        }
+        assert not models.TelegramBot.objects.filter(id__in=[own_bot.id, other_bot.id], is_revoked=True).exists()
+        assert len(published) == 1 and sorted(published[0]) == sorted(i.id for i in same_bots)
+        assert len(enqueued()) == 1 and len(enqueued()[0]["items"]) == 60
+
+    def test_same_token_requires_revoke(self, user, published, enqueued):
+        same_bot = TelegramBotFactory(tid=42)
+
+        result = async_to_sync(models.TelegramBot.handle_perv_same_bots)(
+            added_by_user_obj=user, tid=42, api_token=same_bot.api_token
+        )
+
+        assert result == (True, 0)
+        assert not models.TelegramBot.objects.filter(is_revoked=True).exists()
+        assert published == [] and enqueued() == []
+
+
+def test_revoke_writes_the_notification_in_the_transaction(published, enqueued):
+    tbot = TelegramBotFactory()
+
+    async_to_sync(tbot.revoke)(notify_the_owner=True)
+
+    assert models.TelegramBot.objects.get(pk=tbot.pk).is_revoked
+    assert enqueued() == [{"items": [models.TelegramBot.get_revoke_notification(tbot.added_by_id)]}]
+    assert published == [[tbot.id]]
@@ -0,0 +1,121 @@
+from contextlib import nullcontext
+from datetime import timedelta
+
+import pytest
+
+from django.db import connection
+from django.utils import timezone
+
+from .. import models, tasks
+
+pytestmark = pytest.mark.django_db
+
+REDELIVER_AFTER = timedelta(minutes=15)
+MAX_ATTEMPTS = 3
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    sent = []
+    monkeypatch.setattr(tasks.app, "producer_or_acquire", lambda: nullcontext())
+    monkeypatch.setattr(
+        tasks.deliver_outbox_message, "apply_async", lambda kwargs, producer: sent.append(kwargs["message_id"])
+    )
+    return sent
+
+
+@pytest.fixture
+def ran(monkeypatch):
+    ran = []
+    monkeypatch.setattr(tasks.send_messages, "run", lambda items: ran.append(items))
+    return ran
+
+
+def test_relay_sends_each_message_once_in_batches(sent):
+    messages = [models.OutboxMessage.objects.enqueue(tasks.send_messages, items=[i]) for i in range(5)]
+
+    assert (
+        models.OutboxMessage.objects.relay(batch_size=3, redeliver_after=REDELIVER_AFTER, max_attempts=MAX_ATTEMPTS)
+        == 3
+    )
+    assert (
+        models.OutboxMessage.objects.relay(batch_size=3, redeliver_after=REDELIVER_AFTER, max_attempts=MAX_ATTEMPTS)
+        == 2
+    )
+    assert (
+        models.OutboxMessage.objects.relay(batch_size=3, redeliver_after=REDELIVER_AFTER, max_attempts=MAX_ATTEMPTS)
+        == 0
+    )
+
+    assert sent == [i.id for i in messages]
+    assert not models.OutboxMessage.objects.filter(relayed_at__isnull=True).exists()
+
+
+def test_relay_sends_again_the_lost_ones(sent):
+    lost = models.OutboxMessage.objects.enqueue(tasks.send_messages, items=[])
+    delivered = models.OutboxMessage.objects.enqueue(tasks.send_messages, items=[])
+    long_ago = timezone.now() - REDELIVER_AFTER * 2
+    models.OutboxMessage.objects.filter(id=lost.id).update(relayed_at=long_ago)
+    models.OutboxMessage.objects.filter(id=delivered.id).update(relayed_at=long_ago, delivered_at=long_ago)
+
+    models.OutboxMessage.objects.relay(batch_size=10, redeliver_after=REDELIVER_AFTER, max_attempts=MAX_ATTEMPTS)
+
+    assert sent == [lost.id]
+
+
+def test_deliver_runs_the_task_once(ran):
+    message = models.OutboxMessage.objects.enqueue(tasks.send_messages, items=[{"user_id": 1}])
+
+    tasks.deliver_outbox_message(message_id=message.id)
+    tasks.deliver_outbox_message(message_id=message.id)
+
+    assert ran == [[{"user_id": 1}]]
+    assert models.OutboxMessage.objects.get(id=message.id).delivered_at is not None
+
+
+def test_failed_delivery_is_left_for_the_next_relay(monkeypatch):
+    def fail(items):
+        raise ConnectionError
+
+    monkeypatch.setattr(tasks.send_messages, "run", fail)
+    message = models.OutboxMessage.objects.enqueue(tasks.send_messages, items=[])
+
+    with pytest.raises(ConnectionError):
+        tasks.deliver_outbox_message(message_id=message.id)
+
+    message.refresh_from_db()
+    assert (message.delivered_at, message.claimed_at) == (None, None)
+
+
+def test_messages_that_run_out_of_attempts_are_marked_as_failed(sent):
+    message = models.OutboxMessage.objects.enqueue(tasks.send_messages, items=[])
+    long_ago = timezone.now() - REDELIVER_AFTER * 2
+
+    for _ in range(MAX_ATTEMPTS + 1):
+        models.OutboxMessage.objects.relay(batch_size=10, redeliver_after=REDELIVER_AFTER, max_attempts=MAX_ATTEMPTS)
+        models.OutboxMessage.objects.filter(id=message.id).update(relayed_at=long_ago)
+
+    assert sent == [message.id] * MAX_ATTEMPTS
+    message.refresh_from_db()
+    assert (message.attempts, message.delivered_at) == (MAX_ATTEMPTS, None)
+    assert list(models.OutboxMessage.objects.failed()) == [message]
+    assert not models.OutboxMessage.objects.pending(REDELIVER_AFTER).exists()
+
+
+def test_deliver_runs_the_task_outside_of_a_transaction_and_skips_a_running_duplicate(monkeypatch):
+    message = models.OutboxMessage.objects.enqueue(tasks.send_messages, items=[])
+    duplicates = []
+    # the test runs in a transaction of its own
+    atomic_blocks = len(connection.atomic_blocks)
+
+    def run(items):
+        assert len(connection.atomic_blocks) == atomic_blocks
+        assert models.OutboxMessage.objects.get(id=message.id).claimed_at is not None
+        duplicates.append(tasks.deliver_outbox_message(message_id=message.id))
+
+    monkeypatch.setattr(tasks.send_messages, "run", run)
+
+    tasks.deliver_outbox_message(message_id=message.id)
+
+    assert duplicates == [None]
+    assert models.OutboxMessage.objects.get(id=message.id).delivered_at is not None
@@ -0,0 +1,135 @@
+import asyncio
+import inspect
+import json
+from types import SimpleNamespace
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from aiogram import Dispatcher
+
+from .. import models, polling
+from ..polling import HashRing, PollingShard
+
+
+def test_hash_ring_assigns_every_bot_to_one_shard():
+    shards = ["a", "b", "c"]
+    ring = HashRing(shards)
+
+    assignments = {str(i): ring.get_node(str(i)) for i in range(1000)}
+
+    assert set(assignments.values()) == set(shards)
+    assert all(HashRing(list(reversed(shards))).get_node(k) == v for k, v in assignments.items())
+
+
+def test_hash_ring_moves_only_the_bots_of_the_changed_shard():
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+
+    moved = [str(i) for i in range(1000) if before.get_node(str(i)) != after.get_node(str(i))]
+
+    assert all(after.get_node(i) == "d" for i in moved)
+    assert len(moved) < 400
+
+
+def test_hash_ring_without_nodes():
+    assert HashRing([]).get_node("1") is None
+
+
+def test_the_private_polling_of_aiogram_takes_what_start_bot_passes():
+    """PollingShard.start_bot polls each bot with Dispatcher._polling, see the pin of aiogram in the Pipfile"""
+    parameters = inspect.signature(Dispatcher._polling).parameters
+
+    assert {"bot", "polling_timeout", "allowed_updates"} <= set(parameters)
+    assert inspect.Parameter.VAR_KEYWORD in {i.kind for i in parameters.values()}
+
+
+class FakePubSub:
+    """gives the messages, then raises `error` as if the connection broke"""
+
+    def __init__(self, messages=(), error: Exception | None = None):
+        self.messages = list(messages)
+        self.error = error
+        self.closed = False
+
+    async def subscribe(self, *channels):
+        if self.error is not None and not self.messages:
+            raise self.error
+
+    async def listen(self):
+        for message in self.messages:
+            yield message
+        if self.error is not None:
+            raise self.error
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+def message(channel: str, data) -> dict:
+    return {"type": "message", "channel": channel.encode(), "data": data.encode()}
+
+
+@pytest.fixture
+def shard(monkeypatch):
+    shard = PollingShard(Dispatcher(), name="a")
+    shard.rebalances = []
+
+    async def rebalance(changed_bot_ids=None):
+        shard.rebalances.append(changed_bot_ids)
+
+    monkeypatch.setattr(shard, "rebalance", rebalance)
+    return shard
+
+
+def test_the_changes_are_listened_to_again_after_the_connection_breaks(shard, monkeypatch):
+    pubsubs = [
+        FakePubSub(error=ConnectionError()),
+        FakePubSub(
+            [message(models.TelegramBot.CHANGES_CHANNEL, json.dumps({"bot_ids": [7]}))], error=ConnectionError()
+        ),
+        FakePubSub([message(polling.SHARDS_CHANNEL, "a"), message(polling.SHARDS_CHANNEL, "b")]),
+    ]
+    listened = list(pubsubs)
+    monkeypatch.setattr(polling, "get_async_redis", lambda: SimpleNamespace(pubsub=lambda: pubsubs.pop(0)))
+    monkeypatch.setattr(polling, "RECONNECT_BACKOFF", 0)
+
+    async def listen():
+        task = asyncio.create_task(shard._changes_loop())
+        while len(shard.rebalances) < 4:
+            await asyncio.sleep(0)
+        task.cancel()
+
+    async_to_sync(listen)()
+
+    # everything after every reconnect, then the changed bot, then the shard that joined but not its own announcement
+    assert shard.rebalances == [None, [7], None, None]
+    assert all(i.closed for i in listened)
+
+
+def test_every_bot_is_loaded_only_when_the_shards_change(shard, monkeypatch, fake_redis):
+    shards = ["a"]
+
+    async def live_shards():
+        return list(shards)
+
+    monkeypatch.setattr(shard, "live_shards", live_shards)
+    shard._shards, shard._resynced_at = ["a"], polling.time.monotonic()
+
+    async_to_sync(shard.heartbeat)()
+    assert shard.rebalances == []
+
+    shard._waiting = {7}
+    async_to_sync(shard.heartbeat)()
+    assert shard.rebalances == [[7]]
+
+    shards.append("b")
+    async_to_sync(shard.heartbeat)()
+    assert shard.rebalances == [[7], None]
+
+    shard._shards, shard._waiting = ["a", "b"], set()
+    shard._resynced_at -= polling.FULL_RESYNC_INTERVAL
+    async_to_sync(shard.heartbeat)()
+    assert shard.rebalances == [[7], None, None]
+    assert fake_redis.data == {shard._shard_key("a"): b"1"}
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+from aiogram.dispatcher.event.handler import HandlerObject
+
+from televi1.utils import profiling
+
+from .. import models
+from ..t_middleware import ProfilingHandlerMiddleware, ProfilingMiddleware
+from .factories import TelegramBotFactory
+
+pytestmark = pytest.mark.django_db
+
+
+async def slow_handler():
+    until = time.perf_counter() + 0.05
+    while time.perf_counter() < until:
+        pass
+
+
+def run_update(settings, sample_rate: float, slow_seconds: float | None):
+    settings.TELEGRAM_PROFILE_SAMPLE_RATE = sample_rate
+    settings.TELEGRAM_PROFILE_SLOW_SECONDS = slow_seconds
+    update = aiogram.types.Update(
+        update_id=7, message={"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "hi"}
+    )
+    tbot = TelegramBotFactory()
+
+    async def handler(event, data):
+        data = {**data, "handler": HandlerObject(callback=slow_handler)}
+        return await ProfilingHandlerMiddleware()(lambda event, data: slow_handler(), event.message, data)
+
+    async_to_sync(ProfilingMiddleware())(handler, update, {"bot_obj": tbot})
+    return tbot
+
+
+def test_sampled_updates_are_profiled_with_their_allocations(settings):
+    tbot = run_update(settings, sample_rate=1, slow_seconds=None)
+
+    profile = models.UpdateProfile.objects.get()
+    assert (profile.tbot, profile.update_id, profile.update_type) == (tbot, 7, "message")
+    assert (profile.handler, profile.reason) == ("slow_handler", models.UpdateProfile.Reason.SAMPLED)
+    assert profile.samples > 0
+    assert "slow_handler" in profile.cpu_profile
+    assert profile.allocations
+
+
+def test_only_the_slow_updates_are_kept(settings):
+    run_update(settings, sample_rate=0, slow_seconds=10)
+    assert not models.UpdateProfile.objects.exists()
+
+    run_update(settings, sample_rate=0, slow_seconds=0.01)
+    profile = models.UpdateProfile.objects.get()
+    assert profile.reason == models.UpdateProfile.Reason.SLOW
+    assert "slow_handler" in profile.cpu_profile
+    assert profile.allocations == ""
+
+
+def test_a_profiler_failing_to_start_saves_nothing(settings, monkeypatch):
+    def profile(frame, trace_allocations=False):
+        raise RuntimeError("the sampler is gone")
+
+    monkeypatch.setattr(profiling, "profile", profile)
+
+    with pytest.raises(RuntimeError, match="the sampler is gone"):
+        run_update(settings, sample_rate=1, slow_seconds=None)
+    assert not models.UpdateProfile.objects.exists()
+
+
+def test_profiles_are_downloadable_from_the_admin(settings, admin_client):
+    run_update(settings, sample_rate=1, slow_seconds=None)
+    profile = models.UpdateProfile.objects.get()
+
+    response = admin_client.get(f"/admin/telegram_bot/updateprofile/{profile.id}/download/cpu/")
+
+    assert response["Content-Disposition"] == f'attachment; filename="update-profile-{profile.id}-cpu.folded"'
+    assert response.content.decode() == profile.cpu_profile
+    assert admin_client.get(f"/admin/telegram_bot/updateprofile/{profile.id}/change/").status_code == 200
@@ -0,0 +1,369 @@
+"""
+the handlers declare the most queries they may run with @aiogram.flags.query_budget, next to them in
+dispatchers/base.py. each one is driven here with its data at several sizes (the contents of a user, the
+messages of a bundle, ...), it fails if it runs more than its budget or more queries as the data grows, an N+1,
+and prints the queries then.
+"""
+import itertools
+from collections.abc import Callable
+
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.dispatcher.flags import extract_flags_from_object
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from django.db import connection
+from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from televi1.users.tests.factories import UserFactory
+
+from .. import models, redelivery, stats
+from ..dispatchers import base
+from ..fake_bot_api import FakeBotAPI
+from ..session import get_session
+from .factories import TelegramBotFactory, TelegramIdentityFactory, TelegramUploaderFactory, UploaderLinkFactory
+from .fakes import FakeAiobot
+
+pytestmark = pytest.mark.django_db
+
+SIZES = (1, 5, 20)
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture(autouse=True)
+def no_redis(monkeypatch):
+    """redis is not what's measured here"""
+
+    async def noop(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(models.TelegramBot, "publish_changes", noop)
+    monkeypatch.setattr(redelivery, "cancel", noop)
+    monkeypatch.setattr(stats, "record_link_visit", noop)
+
+
+@pytest.fixture
+def bot_api(settings, tmp_path):
+    bot_api = FakeBotAPI(files_path=tmp_path)
+    api = TelegramAPIServer.from_base(bot_api.start())
+    settings.TELEGRAM_API_SERVER = api
+    settings.TELEGRAM_RATE_LIMIT = False
+    # the session is made again from these settings, and once more from the real ones afterwards
+    get_session.cache_clear()
+    # the bots created get a webhook on one of them
+    settings.TELEGRAM_WEBHOOK_FLYING_DOMAINS = ["example.com"]
+    yield bot_api
+    bot_api.stop()
+    get_session.cache_clear()
+
+
+def new_owner(is_master: bool = False) -> models.TelegramIdentity:
+    user = UserFactory()
+    return TelegramIdentityFactory(tbot=TelegramBotFactory(is_master=is_master, added_by=user), user=user)
+
+
+def new_message(identity: models.TelegramIdentity, **kwargs) -> aiogram.types.Message:
+    return aiogram.types.Message(
+        message_id=next(_ids),
+        date=timezone.now(),
+        chat=aiogram.types.Chat(id=identity.user_tid, type="private"),
+        from_user=aiogram.types.User(id=identity.user_tid, is_bot=False, first_name="x"),
+        **kwargs,
+    )
+
+
+def new_query(identity: models.TelegramIdentity) -> aiogram.types.CallbackQuery:
+    return aiogram.types.CallbackQuery(
+        id=str(next(_ids)),
+        from_user=aiogram.types.User(id=identity.user_tid, is_bot=False, first_name="x"),
+        chat_instance="1",
+        message=new_message(identity),
+    )
+
+
+def new_state(identity: models.TelegramIdentity, data: dict | None = None) -> FSMContext:
+    state = FSMContext(
+        storage=MemoryStorage(),
+        key=StorageKey(bot_id=identity.tbot.tid, chat_id=identity.user_tid, user_id=identity.user_tid),
+    )
+    if data:
+        async_to_sync(state.set_data)(data)
+    return state
+
+
+def new_photo_sizes(bot: models.TelegramBot) -> list[models.TelegramPhotoSize]:
+    return [
+        models.TelegramPhotoSize.objects.create(
+            bot=bot, file_id=f"photo-{i}", file_unique_id=f"photo-{i}", file_size=size, width=size, height=size
+        )
+        for i, size in ((next(_ids), size) for size in (90, 320, 800))
+    ]
+
+
+def new_messages(identity: models.TelegramIdentity, size: int) -> list[models.TelegramMessage]:
+    """a bundle of photos, videos and documents, with the caption entities and the photo sizes telegram sends"""
+    messages = []
+    for content_type in itertools.islice(itertools.cycle(("photo", "video", "document")), size):
+        i = next(_ids)
+        message = models.TelegramMessage(
+            tid=i, bot=identity.tbot, sent_by=identity.user, content_type=content_type, caption=f"caption {i}"
+        )
+        if content_type == "video":
+            message.video = models.TelegramVideo.objects.create(
+                bot=identity.tbot, file_id=f"video-{i}", file_unique_id=f"video-{i}", width=1, height=1, duration=1
+            )
+        elif content_type == "document":
+            message.document = models.TelegramDocument.objects.create(
+                bot=identity.tbot, file_id=f"document-{i}", file_unique_id=f"document-{i}"
+            )
+        message.save()
+        if content_type == "photo":
+            message.photo.add(*new_photo_sizes(identity.tbot))
+        models.TelegramMessageEntity.objects.bulk_create(
+            models.TelegramMessageEntity(telegram_message_caption=message, type="bold", offset=0, length=1)
+            for _ in range(2)
+        )
+        messages.append(message)
+    return messages
+
+
+# the setups of the handlers, they make the data of the given size and return the arguments of the handler
+CASES: dict[Callable, tuple[Callable[[int], dict], tuple[str, ...]]] = {}
+
+
+def case(handler, *fixtures: str):
+    def decorator(setup):
+        CASES[handler] = (setup, fixtures)
+        return setup
+
+    return decorator
+
+
+@case(base.master_command_start_handler)
+def master_start(size: int) -> dict:
+    identity = new_owner(is_master=True)
+    TelegramBotFactory.create_batch(size, added_by=identity.user)
+    return {
+        "message": new_message(identity, text="/start"),
+        "user": identity,
+        "state": new_state(identity),
+        "bot_obj": identity.tbot,
+    }
+
+
+@case(base.sub_command_start_handler)
+def sub_start(size: int) -> dict:
+    identity = new_owner()
+    return {"message": new_message(identity, text="/start"), "state": new_state(identity), "bot_obj": identity.tbot}
+
+
+@case(base.content_list_handler)
+def content_list(size: int) -> dict:
+    identity = new_owner()
+    TelegramUploaderFactory.create_batch(size, tbot=identity.tbot, created_by=identity.user)
+    return {"query": new_query(identity), "user": identity, "bot_obj": identity.tbot}
+
+
+@case(base.content_detail_handler)
+def content_detail(size: int) -> dict:
+    identity = new_owner()
+    uploader = TelegramUploaderFactory(tbot=identity.tbot, created_by=identity.user)
+    models.TelegramUploaderStats.objects.create(uploader=uploader, opens=size)
+    for link in UploaderLinkFactory.create_batch(size, uploader=uploader):
+        models.UploaderLinkStats.objects.create(link=link, opens=1)
+    return {
+        "query": new_query(identity),
+        "callback_data": base.ContentCallbackData(pk=uploader.pk, action=base.ContentAction.GET),
+        "user": identity,
+        "bot_obj": identity.tbot,
+    }
+
+
+@case(base.content_get_link_handler)
+def content_get_link(size: int) -> dict:
+    identity = new_owner()
+    uploader = TelegramUploaderFactory(tbot=identity.tbot, created_by=identity.user)
+    UploaderLinkFactory.create_batch(size, uploader=uploader)
+    return {
+        "query": new_query(identity),
+        "callback_data": base.ContentCallbackData(pk=uploader.pk, action=base.ContentAction.GET_LINK),
+        "user": identity,
+        "bot_obj": identity.tbot,
+    }
+
+
+@case(base.uploader_link_handler)
+def uploader_link(size: int) -> dict:
+    owner = new_owner()
+    link = UploaderLinkFactory(uploader=TelegramUploaderFactory(tbot=owner.tbot, created_by=owner.user))
+    for order, message in enumerate(new_messages(owner, size)):
+        link.uploader.messages.add(message, through_defaults={"order": order})
+    visitor = TelegramIdentityFactory(tbot=owner.tbot)
+    return {
+        "message": new_message(visitor),
+        "state": new_state(visitor),
+        "aiobot": FakeAiobot(),
+        "bot_obj": owner.tbot,
+        "command": None,
+        "command_query": QueryDict(f"a=ull&k={link.queryid}"),
+    }
+
+
+@case(base.new_bot_handler)
+def new_bot(size: int) -> dict:
+    identity = new_owner(is_master=True)
+    return {"user": identity, "query": new_query(identity), "state": new_state(identity), "bot_obj": identity.tbot}
+
+
+@case(base.new_bot_token_handler, "bot_api")
+def new_bot_token(size: int) -> dict:
+    """the same bot registered size times by someone else, they all get revoked"""
+    identity = new_owner(is_master=True)
+    tid = 9000000 + next(_ids)
+    TelegramBotFactory.create_batch(size, tid=tid, added_by=UserFactory())
+    token = f"{tid}:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+    return {
+        "message": new_message(identity, text=token),
+        "user": identity,
+        "state": new_state(identity),
+        "bot_obj": identity.tbot,
+    }
+
+
+@case(base.bot_list_handler)
+def bot_list(size: int) -> dict:
+    identity = new_owner(is_master=True)
+    TelegramBotFactory.create_batch(size, added_by=identity.user)
+    return {"query": new_query(identity), "user": identity, "state": new_state(identity), "bot_obj": identity.tbot}
+
+
+@case(base.bot_detail_handler)
+def bot_detail(size: int) -> dict:
+    identity = new_owner(is_master=True)
+    bots = TelegramBotFactory.create_batch(size, added_by=identity.user)
+    return {
+        "query": new_query(identity),
+        "callback_data": base.BotCallbackData(pk=bots[-1].pk, action=base.BotAction.POWER_OFF),
+        "user": identity,
+        "bot_obj": identity.tbot,
+    }
+
+
+@case(base.new_content_handler)
+def new_content(size: int) -> dict:
+    identity = new_owner()
+    return {"query": new_query(identity), "state": new_state(identity), "bot_obj": identity.tbot}
+
+
+@case(base.reset_content_message_handler)
+def reset_content_message(size: int) -> dict:
+    identity = new_owner()
+    return {
+        "message": new_message(identity),
+        "state": new_state(identity, {"messages": list(range(size))}),
+        "bot_obj": identity.tbot,
+    }
+
+
+@case(base.end_message_content_handler)
+def end_message_content(size: int) -> dict:
+    identity = new_owner()
+    return {
+        "message": new_message(identity),
+        "state": new_state(identity, {"messages": list(range(size))}),
+        "bot_obj": identity.tbot,
+    }
+
+
+@case(base.new_content_message_handler)
+def new_content_message(size: int) -> dict:
+    """a photo whose caption has size entities"""
+    identity = new_owner()
+    photo = [
+        aiogram.types.PhotoSize(file_id=f"photo-{i}", file_unique_id=f"photo-{i}", width=size, height=size)
+        for i, size in ((next(_ids), size) for size in (90, 320, 800))
+    ]
+    entities = [aiogram.types.MessageEntity(type="bold", offset=i, length=1) for i in range(size)]
+    return {
+        "message": new_message(identity, photo=photo, caption="x" * size, caption_entities=entities),
+        "user": identity,
+        "state": new_state(identity, {"messages": [1]}),
+        "bot_obj": identity.tbot,
+    }
+
+
+@case(base.reset_content_must_join_handler)
+def reset_content_must_join(size: int) -> dict:
+    identity = new_owner()
+    return {"message": new_message(identity), "state": new_state(identity), "bot_obj": identity.tbot}
+
+
+@case(base.end_content_must_join_handler)
+def end_content_must_join(size: int) -> dict:
+    identity = new_owner()
+    return {"user": identity, "message": new_message(identity), "state": new_state(identity), "bot_obj": identity.tbot}
+
+
+@case(base.new_content_must_joins_handler)
+def new_content_must_joins(size: int) -> dict:
+    identity = new_owner()
+    must_joins = [{"chat_id": -i, "is_channel": True} for i in range(size)]
+    chat_shared = aiogram.types.ChatShared(request_id=58008, chat_id=-1000)
+    return {
+        "message": new_message(identity, chat_shared=chat_shared),
+        "state": new_state(identity, {"must_joins": must_joins}),
+        "bot_obj": identity.tbot,
+    }
+
+
+@case(base.new_content_name_handler)
+def new_content_name(size: int) -> dict:
+    """the end of the wizard, with size messages"""
+    identity = new_owner()
+    messages = [i.id for i in new_messages(identity, size)]
+    return {
+        "message": new_message(identity, text="name"),
+        "user": identity,
+        "state": new_state(identity, {"messages": messages, "must_joins": [{"chat_id": -1, "is_channel": True}]}),
+        "bot_obj": identity.tbot,
+    }
+
+
+def get_budget(handler) -> int | None:
+    return extract_flags_from_object(handler).get("query_budget")
+
+
+def test_every_handler_declares_its_budget_and_is_checked():
+    handlers = {i.callback for observer in base.router.observers.values() for i in observer.handlers}
+
+    assert [i.__name__ for i in handlers if get_budget(i) is None] == []
+    assert [i.__name__ for i in handlers if i not in CASES] == []
+
+
+@pytest.mark.parametrize("handler", CASES, ids=lambda i: i.__name__)
+def test_handler_stays_within_its_query_budget(request, handler):
+    setup, fixtures = CASES[handler]
+    for i in fixtures:
+        request.getfixturevalue(i)
+    budget = get_budget(handler)
+
+    queries = {}
+    for size in SIZES:
+        kwargs = {"aiobot": None, **setup(size)}
+        with CaptureQueriesContext(connection) as captured:
+            async_to_sync(handler)(**kwargs)
+        queries[size] = [i["sql"] for i in captured.captured_queries]
+
+    counts = {size: len(i) for size, i in queries.items()}
+    biggest = SIZES[-1]
+    assert max(counts.values()) <= budget and counts[biggest] <= counts[SIZES[0]], (
+        f"{handler.__name__} ran {counts} queries for the data sizes {SIZES}, its budget is {budget}. "
+        f"the queries at size {biggest}:\n" + "\n".join(f"{n}. {sql}" for n, sql in enumerate(queries[biggest], 1))
+    )
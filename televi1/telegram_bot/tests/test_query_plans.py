@@ -0,0 +1,86 @@
+"""
+the queries on the hot paths must be served by indexes, checked with EXPLAIN on a seeded dataset.
+the planner is told to avoid sequential scans, so one in the plan means there is no usable index.
+"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from django.db import connection
+
+from televi1.users.tests.factories import UserFactory
+
+from .. import models
+from .factories import TelegramBotFactory, TelegramUploaderFactory, UploaderLinkFactory
+
+pytestmark = pytest.mark.django_db
+
+SEED_BOTS = 20
+SEED_IDENTITIES_PER_BOT = 100
+
+
+@pytest.fixture
+def seeded():
+    owner = UserFactory()
+    bots = TelegramBotFactory.create_batch(SEED_BOTS, added_by=owner)
+    models.TelegramIdentity.objects.bulk_create(
+        models.TelegramIdentity(tbot=tbot, user_tid=i) for tbot in bots for i in range(SEED_IDENTITIES_PER_BOT)
+    )
+    owner_identity = models.TelegramIdentity.objects.filter(tbot=bots[0]).first()
+    owner_identity.user = owner
+    owner_identity.save()
+    links = [UploaderLinkFactory(uploader=TelegramUploaderFactory(tbot=i, created_by=owner)) for i in bots]
+    audio = models.TelegramAudio.objects.create(
+        bot=bots[0], file_id="file-id", file_unique_id="file-unique-id", duration=1
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return SimpleNamespace(owner=owner, bot=bots[0], owner_identity=owner_identity, link=links[0], audio=audio)
+
+
+HOT_PATHS = {
+    "webhook bot": lambda s: models.TelegramBot.objects.filter(url_specifier=s.bot.url_specifier).select_related(
+        "added_by"
+    ),
+    "identity": lambda s: models.TelegramIdentity.objects.filter(user_tid=1, tbot_id=s.bot.id),
+    "owner tid": lambda s: models.TelegramIdentity.objects.filter(user_id=s.owner.id).values_list("user_tid"),
+    "contents of owner": lambda s: models.TelegramUploader.objects.filter(created_by_id=s.owner.id, tbot_id=s.bot.id),
+    "bots of owner": lambda s: models.TelegramBot.objects.filter(added_by_id=s.owner.id),
+    "same bot of owner": lambda s: models.TelegramBot.objects.filter(added_by_id=s.owner.id, tid=s.bot.tid),
+    "same active bots": lambda s: models.TelegramBot.objects.filter(tid=s.bot.tid, is_revoked=False)
+    .exclude(added_by_id=s.owner.id)
+    .filter(api_token=s.bot.api_token),
+    "uploader link": lambda s: models.UploaderLink.objects.filter(queryid=s.link.queryid).select_related("uploader"),
+    "file of message": lambda s: models.TelegramAudio.objects.filter(file_id=s.audio.file_id),
+    "broadcast recipients": lambda s: models.TelegramIdentity.objects.filter(
+        tbot_id=s.bot.id, has_blocked_bot=False, id__gt=0
+    )
+    .order_by("id")
+    .values_list("id", "user_tid")[:100],
+}
+
+
+def iter_plan_nodes(plan: dict):
+    yield plan
+    for i in plan.get("Plans", []):
+        yield from iter_plan_nodes(i)
+
+
+def explain(queryset) -> dict:
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        result = cursor.fetchone()[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]["Plan"]
+
+
+@pytest.mark.parametrize("name", HOT_PATHS)
+def test_hot_path_uses_indexes(seeded, name):
+    plan = explain(HOT_PATHS[name](seeded))
+
+    seq_scans = [i["Relation Name"] for i in iter_plan_nodes(plan) if i["Node Type"] == "Seq Scan"]
+    assert not seq_scans, f"{name} scans {', '.join(seq_scans)} sequentially:\n{json.dumps(plan, indent=2)}"
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from .. import ratelimit
+from ..ratelimit import Bucket, RateLimiter
+from ..session import DeadlineExceededError, GuardedAiohttpSession, deadline
+
+TOKEN = "42:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+
+
+def acquire(store, keys, args):
+    """the buckets never refill, a bucket without tokens has to wait a second"""
+    n = len(keys) // 2
+    waits = [store.expirations[i] for i in keys[n:] if i in store.data]
+    if waits:
+        return [max(waits)]
+    buckets = [(key, args[3 * i + 1], args[3 * i + 2]) for i, key in enumerate(keys[:n])]
+    if any(store.data.setdefault(key, burst) < 1 for key, burst, _ in buckets):
+        return [1000]
+    taken = [min(wanted, store.data[key]) for key, _, wanted in buckets]
+    for (key, _, _), i in zip(buckets, taken):
+        store.data[key] -= i
+    return [0, *taken]
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(fake_redis):
+    fake_redis.scripts[ratelimit._ACQUIRE_SCRIPT] = acquire
+    return fake_redis
+
+
+def make_limiter(lease=5):
+    return RateLimiter(
+        bot=Bucket(rate=30, burst=30), chat=Bucket(rate=1, burst=5), group=Bucket(rate=1, burst=2), lease=lease
+    )
+
+
+def test_tokens_are_taken_from_redis_a_few_at_a_time(fake_redis):
+    limiter = make_limiter()
+
+    for _ in range(5):
+        async_to_sync(limiter.acquire)(1, 777)
+    assert fake_redis.round_trips.count("script") == 1
+    async_to_sync(limiter.acquire)(1, 888)
+    async_to_sync(limiter.acquire)(1)
+    assert fake_redis.round_trips.count("script") == 2
+    assert fake_redis.data == {limiter.get_key(1): 20, limiter.get_key(1, 777): 0, limiter.get_key(1, 888): 0}
+
+
+def test_concurrent_calls_of_a_chat_share_one_refill_at_a_time(fake_redis):
+    limiter = RateLimiter(bot=Bucket(rate=30, burst=30), chat=Bucket(rate=1, burst=20), group=Bucket(rate=1, burst=2))
+
+    async def send_bundle():
+        await asyncio.gather(*(limiter.acquire(1, 777) for _ in range(20)))
+
+    # none of the tokens taken is lost, so none of the calls has to wait for the bucket to refill
+    with deadline(0.5):
+        async_to_sync(send_bundle)()
+
+    assert fake_redis.round_trips.count("script") == 4
+    assert fake_redis.data == {limiter.get_key(1): 10, limiter.get_key(1, 777): 0}
+
+
+def test_groups_have_their_own_limit(fake_redis):
+    limiter = make_limiter()
+
+    for _ in range(2):
+        async_to_sync(limiter.acquire)(1, -100)
+
+    with deadline(0.5), pytest.raises(DeadlineExceededError):
+        async_to_sync(limiter.acquire)(1, -100)
+
+
+def test_flood_waits_are_shared_by_the_processes(fake_redis):
+    limiter, other_limiter = make_limiter(), make_limiter()
+    async_to_sync(limiter.acquire)(1, 777)
+
+    async_to_sync(limiter.cool_down)(1, 777, 30)
+
+    assert fake_redis.store.expirations == {f"{limiter.get_key(1, 777)}:cooldown": 30000}
+    for i in (limiter, other_limiter):
+        with deadline(5), pytest.raises(DeadlineExceededError):
+            async_to_sync(i.acquire)(1, 777)
+    # the other chats are not paused
+    async_to_sync(other_limiter.acquire)(1, 888)
+
+
+def test_calls_are_not_limited_when_redis_is_down(monkeypatch):
+    def broken_redis():
+        raise ConnectionError
+
+    monkeypatch.setattr(ratelimit, "get_async_redis", broken_redis)
+
+    async_to_sync(make_limiter().acquire)(1, 777)
+
+
+def test_session_waits_for_the_limits_and_shares_the_flood_waits(fake_redis, monkeypatch):
+    async def make_request(self, bot, method, timeout=None):
+        raise TelegramRetryAfter(method=method, message="Flood control exceeded", retry_after=7)
+
+    monkeypatch.setattr(AiohttpSession, "make_request", make_request)
+    limiter = make_limiter()
+    session = GuardedAiohttpSession(breaker_failures=1, breaker_window=30, breaker_cooldown=30, rate_limiter=limiter)
+    bot = aiogram.Bot(TOKEN, session=session)
+
+    with pytest.raises(TelegramRetryAfter):
+        async_to_sync(session.make_request)(bot, SendMessage(chat_id=777, text="hi"))
+
+    assert fake_redis.round_trips.count("script") == 1
+    assert fake_redis.store.expirations == {f"{limiter.get_key(42, 777)}:cooldown": 7000}
+    assert not session.get_breaker(42).is_open
@@ -0,0 +1,67 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+
+from .. import models, reconcile
+from .factories import TelegramBotFactory
+from .fakes import FakeAiobot
+
+pytestmark = pytest.mark.django_db
+
+
+def new_fake_aiobot(url: str, allowed_updates: list[str]) -> FakeAiobot:
+    info = aiogram.types.WebhookInfo(
+        url=url, has_custom_certificate=False, pending_update_count=0, allowed_updates=allowed_updates
+    )
+    return FakeAiobot(results={"get_webhook_info": info})
+
+
+def test_reconcile_all_syncs_only_the_differing_bots(monkeypatch):
+    synced_bot, stale_bot = TelegramBotFactory(), TelegramBotFactory()
+    allowed_updates = models.TelegramBot.get_allowed_updates()
+    fake_aiobots = {
+        synced_bot.id: new_fake_aiobot(synced_bot.webhook_url, allowed_updates),
+        stale_bot.id: new_fake_aiobot(stale_bot.webhook_url, allowed_updates + ["poll"]),
+    }
+    monkeypatch.setattr(models.TelegramBot, "get_aiobot", lambda self: fake_aiobots[self.id])
+
+    counts = async_to_sync(reconcile.reconcile_all)(models.TelegramBot.objects.all(), concurrency=2)
+
+    assert counts == {"ok": 1, "resynced": 1, "failed": 0}
+    assert fake_aiobots[synced_bot.id].get_calls("set_webhook") == []
+    assert fake_aiobots[stale_bot.id].get_calls("set_webhook")[0][1]["allowed_updates"] == allowed_updates
+    stale_bot.refresh_from_db()
+    assert stale_bot.webhook_status == models.WebhookStatus.RESYNCED
+    assert stale_bot.webhook_checked_at is not None
+
+
+def test_an_unexpected_error_fails_only_its_bot(monkeypatch):
+    broken_bot, synced_bot = TelegramBotFactory(), TelegramBotFactory()
+    fake_aiobot = new_fake_aiobot(synced_bot.webhook_url, models.TelegramBot.get_allowed_updates())
+
+    def get_aiobot(self):
+        if self.id == broken_bot.id:
+            raise RuntimeError("broken")
+        return fake_aiobot
+
+    monkeypatch.setattr(models.TelegramBot, "get_aiobot", get_aiobot)
+
+    counts = async_to_sync(reconcile.reconcile_all)(models.TelegramBot.objects.all(), concurrency=1)
+
+    assert counts == {"ok": 1, "resynced": 0, "failed": 1}
+    broken_bot.refresh_from_db()
+    assert (broken_bot.webhook_status, broken_bot.webhook_error) == (
+        models.WebhookStatus.FAILED,
+        "RuntimeError('broken')",
+    )
+
+
+def test_syncing_a_stale_instance_does_not_undo_a_revoke(fake_aiobot):
+    bot_obj = TelegramBotFactory()
+    models.TelegramBot.objects.filter(id=bot_obj.id).update(is_revoked=True)
+
+    async_to_sync(bot_obj.sync_webhook)()
+
+    bot_obj.refresh_from_db()
+    assert bot_obj.is_revoked and bot_obj.webhook_synced_at is not None
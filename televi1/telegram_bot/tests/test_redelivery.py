@@ -0,0 +1,197 @@
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+import aiogram.exceptions
+from django.http import QueryDict
+from django.utils import timezone
+
+from televi1.users.tests.factories import UserFactory
+
+from .. import models, redelivery
+from ..dispatchers.base import uploader_link_handler
+from .factories import TelegramBotFactory, TelegramIdentityFactory, UploaderLinkFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def claim(store, keys, args):
+    now, until, limit = args
+    scores = store.data.get(keys[0], {})
+    due = sorted((i for i, at in scores.items() if at <= now), key=scores.get)[:limit]
+    scores.update(dict.fromkeys(due, until))
+    return due
+
+
+def finish(store, keys, args):
+    job_id, claimed, raw, due_at = args
+    if (store.hget(keys[1], job_id) or b"") != claimed:
+        return 0
+    if not raw:
+        store.zrem(keys[0], job_id)
+        store.hdel(keys[1], job_id)
+    else:
+        store.hset(keys[1], job_id, raw)
+        store.zadd(keys[0], {job_id: due_at})
+    return 1
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(fake_redis):
+    fake_redis.scripts[redelivery._CLAIM_SCRIPT] = claim
+    fake_redis.scripts[redelivery._FINISH_SCRIPT] = finish
+    return fake_redis
+
+
+@pytest.fixture(autouse=True)
+def fake_aiobot(fake_aiobot, monkeypatch):
+    async def to_aio_params(self):
+        return aiogram.Bot.send_message.__name__, {"text": self.text}
+
+    monkeypatch.setattr(models.TelegramMessage, "to_aio_params", to_aio_params)
+    return fake_aiobot
+
+
+def get_jobs(fake_redis) -> dict[str, str]:
+    return {k.decode(): v.decode() for k, v in fake_redis.data.get(redelivery.JOBS_KEY, {}).items()}
+
+
+def get_due(fake_redis) -> dict[str, float]:
+    return {k.decode(): v for k, v in fake_redis.data.get(redelivery.DUE_KEY, {}).items()}
+
+
+def make_due(fake_redis):
+    scores = fake_redis.data.get(redelivery.DUE_KEY, {})
+    scores.update(dict.fromkeys(scores, 0))
+
+
+@pytest.fixture
+def ulink():
+    ulink = UploaderLinkFactory()
+    sent_by = UserFactory()
+    for i, text in enumerate(["a", "b", "c", "d"]):
+        ulink.uploader.messages.add(
+            models.TelegramMessage.objects.create(
+                tid=ulink.id * 10 + i, bot=ulink.uploader.tbot, sent_by=sent_by, content_type="text", text=text
+            ),
+            through_defaults={"order": i},
+        )
+    return ulink
+
+
+def open_link(ulink, aiobot):
+    chat = aiogram.types.Chat(id=777, type="private")
+    message = aiogram.types.Message(
+        message_id=1,
+        date=timezone.now(),
+        chat=chat,
+        from_user=aiogram.types.User(id=777, is_bot=False, first_name="x"),
+    )
+    return async_to_sync(uploader_link_handler)(
+        message=message,
+        state=None,
+        aiobot=aiobot,
+        bot_obj=ulink.uploader.tbot,
+        command=None,
+        command_query=QueryDict(f"k={ulink.queryid}"),
+    )
+
+
+def test_only_the_failed_messages_are_sent_again_in_order(fake_redis, fake_aiobot, ulink):
+    fake_aiobot.failing = {"b", "d"}
+
+    open_link(ulink, fake_aiobot)
+
+    assert sorted(fake_aiobot.sent("text")) == ["a", "c"]
+    job_id = redelivery.get_job_id(ulink.uploader.tbot_id, 777, ulink.id)
+    job = json.loads(get_jobs(fake_redis)[job_id])
+    assert [models.TelegramMessage.objects.get(id=i).text for i in job["message_ids"]] == ["b", "d"]
+    assert job["attempt"] == 0
+    assert async_to_sync(redelivery.redeliver_due)() == 0
+
+    # b goes through, d fails again
+    fake_aiobot.failing = {"d"}
+    make_due(fake_redis)
+    assert async_to_sync(redelivery.redeliver_due)() == 1
+    assert fake_aiobot.sent("text")[2:] == ["b"]
+    job = json.loads(get_jobs(fake_redis)[job_id])
+    assert (len(job["message_ids"]), job["attempt"]) == (1, 1)
+    assert get_due(fake_redis)[job_id] > 0
+
+    fake_aiobot.failing = set()
+    make_due(fake_redis)
+    async_to_sync(redelivery.redeliver_due)()
+    assert fake_aiobot.sent("text")[2:] == ["b", "d"]
+    assert get_due(fake_redis) == get_jobs(fake_redis) == {}
+
+
+def test_a_successful_delivery_cancels_the_pending_one(fake_redis, fake_aiobot, ulink):
+    fake_aiobot.failing = {"b"}
+    open_link(ulink, fake_aiobot)
+    assert get_jobs(fake_redis)
+
+    fake_aiobot.failing = set()
+    open_link(ulink, fake_aiobot)
+
+    assert get_due(fake_redis) == get_jobs(fake_redis) == {}
+
+
+def test_redelivery_gives_up_on_blocked_users_and_after_the_attempts(settings, fake_redis, fake_aiobot, ulink):
+    settings.TELEGRAM_REDELIVERY_MAX_ATTEMPTS = 2
+    tbot = ulink.uploader.tbot
+    tuser = TelegramIdentityFactory(tbot=tbot, user_tid=777)
+    fake_aiobot.failing = {"a"}
+
+    open_link(ulink, fake_aiobot)
+    for _ in range(2):
+        make_due(fake_redis)
+        async_to_sync(redelivery.redeliver_due)()
+    assert get_jobs(fake_redis) == {}
+    assert fake_aiobot.sent("text").count("a") == 0
+
+    open_link(ulink, fake_aiobot)
+    fake_aiobot.blocked = {777}
+    make_due(fake_redis)
+    async_to_sync(redelivery.redeliver_due)()
+    assert get_jobs(fake_redis) == {}
+    assert models.TelegramIdentity.objects.get(id=tuser.id).has_blocked_bot
+
+
+def test_a_redelivery_leaves_the_job_if_it_was_changed_meanwhile(fake_redis, fake_aiobot, ulink):
+    fake_aiobot.failing = {"b"}
+    open_link(ulink, fake_aiobot)
+    job_id = redelivery.get_job_id(ulink.uploader.tbot_id, 777, ulink.id)
+    claimed = get_jobs(fake_redis)[job_id].encode()
+
+    # a later open of the link went through
+    async_to_sync(redelivery.cancel)(job_id)
+    async_to_sync(redelivery.redeliver)(job_id, json.loads(claimed), claimed)
+    assert get_due(fake_redis) == get_jobs(fake_redis) == {}
+
+    # a later open of the link failed too
+    open_link(ulink, fake_aiobot)
+    newer = get_jobs(fake_redis)[job_id]
+    fake_aiobot.failing = set()
+    async_to_sync(redelivery.redeliver)(job_id, json.loads(claimed), claimed)
+    assert get_jobs(fake_redis) == {job_id: newer}
+
+
+def test_delay_backs_off_exponentially_with_jitter():
+    for attempt in range(10):
+        delay = min(redelivery.MAX_DELAY, redelivery.BASE_DELAY * 2**attempt)
+        assert delay / 2 <= redelivery.get_delay(attempt) <= delay
+    retry_after = aiogram.exceptions.TelegramRetryAfter(method=None, message="Flood control", retry_after=600)
+    assert redelivery.get_delay(0, retry_after) == 600
+
+
+def test_jobs_of_revoked_bots_are_dropped(fake_redis):
+    tbot = TelegramBotFactory(is_revoked=True)
+    job = redelivery.RedeliveryJob(bot_id=tbot.id, chat_id=777, message_ids=[1], attempt=0)
+    async_to_sync(redelivery.schedule)("x", job)
+    make_due(fake_redis)
+
+    async_to_sync(redelivery.redeliver_due)()
+
+    assert get_jobs(fake_redis) == {}
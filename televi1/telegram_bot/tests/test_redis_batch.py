@@ -0,0 +1,72 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+
+from televi1.utils.redis import RedisBatch, redis_batch
+
+from .. import stats
+from ..dispatchers import dp
+from ..identity import identity_cache
+from ..t_middleware import RedisBatchMiddleware
+from .factories import TelegramBotFactory, UploaderLinkFactory
+from .fakes import FakeRedis
+
+pytestmark = pytest.mark.django_db
+
+
+def test_batch_reads_its_own_writes_and_flushes_once():
+    fake_redis = FakeRedis()
+    fake_redis.data = {"a": b"1", "b": b"2"}
+    batch = RedisBatch(fake_redis)
+
+    async def work():
+        await batch.prefetch(["a", "b", "c"])
+        await batch.set("a", 10, ex=5)
+        await batch.delete("b")
+        assert [await batch.get(i) for i in ("a", "b", "c")] == [b"10", None, None]
+        assert await batch.exists("a", "b") == 1
+        await batch.flush()
+
+    async_to_sync(work)()
+
+    assert fake_redis.round_trips == ["mget", "pipeline"]
+    assert fake_redis.data == {"a": b"10"}
+
+
+def test_update_reads_and_writes_redis_in_two_round_trips(fake_redis):
+    bot_obj = TelegramBotFactory()
+    fake_redis.data[identity_cache.redis_key(bot_obj.id, 777)] = b"{}"
+    from_user = aiogram.types.User(id=777, is_bot=False, first_name="x")
+    data = {
+        "bot": aiogram.Bot(token=bot_obj.api_token),
+        "bot_obj": bot_obj,
+        "event_from_user": from_user,
+        "event_chat": aiogram.types.Chat(id=777, type="private"),
+    }
+
+    async def handler(event, data):
+        state = dp.fsm.resolve_event_context(data["bot"], data)
+        assert await state.get_state() is None
+        await state.set_state("some:state")
+        await state.update_data(messages=[1])
+        assert (await state.get_state(), await state.get_data()) == ("some:state", {"messages": [1]})
+        await identity_cache.get(bot_obj, 777)
+        await stats.record_link_visit(UploaderLinkFactory.build(id=1, uploader_id=2), user_tid=777, delivered=True)
+
+    async_to_sync(RedisBatchMiddleware(dp.fsm))(handler, None, data)
+
+    assert fake_redis.round_trips == ["mget", "pipeline"]
+    assert [i[0] for i in fake_redis.commands] == ["mget", "set", "set", "incr", "incr", "pfadd", "pfadd", "sadd"]
+
+
+def test_writes_are_flushed_when_the_update_fails(fake_redis):
+    async def work():
+        async with redis_batch() as batch:
+            await batch.set("a", 1)
+            raise ValueError
+
+    with pytest.raises(ValueError):
+        async_to_sync(work)()
+
+    assert fake_redis.data == {"a": b"1"}
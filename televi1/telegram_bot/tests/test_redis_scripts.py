@@ -0,0 +1,84 @@
+"""
+the lua scripts against a real redis, the other tests run python versions of them on fakes.redis.
+skipped when REDIS_URL can't be reached
+"""
+import json
+import time
+import uuid
+
+import pytest
+from asgiref.sync import async_to_sync
+from redis import Redis
+from redis.exceptions import ConnectionError
+
+from django.conf import settings
+
+from .. import ratelimit, redelivery
+from ..ratelimit import Bucket, RateLimiter
+
+
+@pytest.fixture
+def real_redis(monkeypatch):
+    redis = Redis.from_url(settings.REDIS_URL, socket_connect_timeout=0.5)
+    try:
+        redis.ping()
+    except ConnectionError:
+        pytest.skip(f"redis is not reachable at {settings.REDIS_URL}")
+    prefix = f"televi1:test:{uuid.uuid4().hex}"
+    monkeypatch.setattr(ratelimit, "KEY_PREFIX", f"{prefix}:ratelimit")
+    monkeypatch.setattr(redelivery, "DUE_KEY", f"{prefix}:due")
+    monkeypatch.setattr(redelivery, "JOBS_KEY", f"{prefix}:jobs")
+    yield redis
+    keys = list(redis.scan_iter(match=f"{prefix}:*"))
+    if keys:
+        redis.delete(*keys)
+    redis.close()
+
+
+def test_acquire_takes_the_tokens_of_all_the_buckets_or_none(real_redis):
+    limiter = RateLimiter(bot=Bucket(rate=30, burst=30), chat=Bucket(rate=1, burst=5), group=Bucket(rate=1, burst=2))
+
+    async def acquire(chat_id):
+        return await limiter._acquire_remote(limiter.get_buckets(1, chat_id), time.monotonic())
+
+    async def work():
+        taken = await acquire(777)
+        empty_chat = await acquire(777)
+        await limiter.cool_down(1, 888, 30)
+        return taken, empty_chat, await acquire(888)
+
+    taken, empty_chat, cooled_down = async_to_sync(work)()
+
+    assert taken == 0 and limiter._local[limiter.get_key(1, 777)][0] == 4
+    # the chat has no tokens left, the bot's are not taken then
+    assert 0 < empty_chat <= 1
+    assert float(real_redis.hget(limiter.get_key(1), "tokens")) == pytest.approx(25, abs=1)
+    assert 29 < cooled_down <= 30
+
+
+def test_a_due_job_is_claimed_once_and_finished_only_if_unchanged(real_redis):
+    job = redelivery.RedeliveryJob(bot_id=1, chat_id=777, message_ids=[1], attempt=0)
+
+    async def claim():
+        now = time.time()
+        return await redelivery.get_async_redis().register_script(redelivery._CLAIM_SCRIPT)(
+            keys=[redelivery.DUE_KEY], args=[now, now + redelivery.CLAIM_LEASE, 10]
+        )
+
+    async def work():
+        await redelivery.schedule("due", job)
+        await redelivery.schedule("later", job)
+        real_redis.zadd(redelivery.DUE_KEY, {"due": 0, "later": time.time() + 600})
+        claimed, claimed_again = await claim(), await claim()
+        raw = real_redis.hget(redelivery.JOBS_KEY, "due")
+        # a newer delivery rescheduled it meanwhile
+        await redelivery._finish("due", b"stale", json.dumps(job))
+        assert real_redis.hget(redelivery.JOBS_KEY, "due") == raw
+        await redelivery._finish("due", raw)
+        return claimed, claimed_again
+
+    claimed, claimed_again = async_to_sync(work)()
+
+    assert (claimed, claimed_again) == ([b"due"], [])
+    assert real_redis.hkeys(redelivery.JOBS_KEY) == [b"later"]
+    assert real_redis.zrange(redelivery.DUE_KEY, 0, -1) == [b"later"]
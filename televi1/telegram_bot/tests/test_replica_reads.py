@@ -0,0 +1,59 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+from aiogram.dispatcher.event.handler import HandlerObject
+from django.db import router
+
+from televi1.utils import replicas
+
+from .. import models
+from ..t_middleware import ReplicaReadsMiddleware
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def pins(settings, monkeypatch):
+    settings.DATABASE_REPLICAS = ["replica_0"]
+    pins = set()
+
+    async def is_pinned(user_tid):
+        return user_tid in pins
+
+    async def pin(user_tid):
+        pins.add(user_tid)
+
+    monkeypatch.setattr(replicas, "is_pinned", is_pinned)
+    monkeypatch.setattr(replicas, "pin", pin)
+    return pins
+
+
+def run_handler(callback, flags: dict):
+    data = {
+        "event_from_user": aiogram.types.User(id=777, is_bot=False, first_name="x"),
+        "handler": HandlerObject(callback=callback, flags=flags),
+    }
+    return async_to_sync(ReplicaReadsMiddleware())(lambda event, data: callback(), None, data)
+
+
+def test_flagged_handler_reads_from_the_replicas_until_its_user_writes(pins):
+    async def read():
+        return router.db_for_read(models.TelegramBot)
+
+    async def write():
+        await models.TelegramBot.objects.filter(id=-1).aupdate(is_revoked=True)
+
+    assert run_handler(read, {"replica_reads": True}) == "replica_0"
+    run_handler(write, {})
+
+    assert pins == {777}
+    assert run_handler(read, {"replica_reads": True}) == "default"
+
+
+def test_not_flagged_handler_reads_from_the_primary(pins):
+    async def read():
+        return router.db_for_read(models.TelegramBot)
+
+    assert run_handler(read, {}) == "default"
+    assert pins == set()
@@ -0,0 +1,104 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram.exceptions
+
+from televi1.users.tests.factories import UserFactory
+
+from .. import models, sender
+from ..session import CircuitOpenError
+from .factories import TelegramBotFactory, TelegramIdentityFactory
+from .fakes import FakeAiobot
+
+pytestmark = pytest.mark.django_db
+
+
+def test_send_batch(settings, monkeypatch, django_assert_num_queries):
+    settings.TELEGRAM_BROADCAST_RATE = 10000
+    tbot, other_tbot = TelegramBotFactory(), TelegramBotFactory()
+    tuser, blocked_tuser = TelegramIdentityFactory.create_batch(2, tbot=tbot)
+    other_tuser = TelegramIdentityFactory(tbot=other_tbot)
+    owner_tuser = TelegramIdentityFactory(tbot=other_tbot, user=UserFactory())
+    fake_aiobots = {tbot.id: FakeAiobot(blocked=[blocked_tuser.user_tid]), other_tbot.id: FakeAiobot()}
+    monkeypatch.setattr(models.TelegramBot, "get_aiobot", lambda self: fake_aiobots[self.id])
+    items = [
+        {"tuser_id": tuser.id, "params": {"text": "hi"}},
+        {"tuser_id": blocked_tuser.id, "params": {"text": "hi"}},
+        {"tuser_id": -1, "params": {"text": "hi"}},
+        {"tuser_id": other_tuser.id, "params": {"text": "hi"}},
+        {"bot_id": other_tbot.id, "chat_id": 42, "params": {"text": "hi"}},
+        {"user_id": owner_tuser.user_id, "params": {"text": "hi"}},
+    ]
+
+    # users, bots and the blocked users update
+    with django_assert_num_queries(3):
+        results = async_to_sync(sender.send_batch)(items)
+
+    assert results == [
+        sender.SendResult.SENT,
+        sender.SendResult.BLOCKED,
+        sender.SendResult.FAILED,
+        sender.SendResult.SENT,
+        sender.SendResult.SENT,
+        sender.SendResult.SENT,
+    ]
+    assert fake_aiobots[tbot.id].sent() == [tuser.user_tid]
+    assert fake_aiobots[other_tbot.id].sent() == [other_tuser.user_tid, 42, owner_tuser.user_tid]
+    assert models.TelegramIdentity.objects.get(id=blocked_tuser.id).has_blocked_bot
+
+
+@pytest.fixture
+def no_backoff(monkeypatch) -> list[float]:
+    waited = []
+
+    async def sleep(seconds):
+        waited.append(seconds)
+
+    monkeypatch.setattr(sender.asyncio, "sleep", sleep)
+    return waited
+
+
+class NoPacer:
+    async def wait(self):
+        pass
+
+
+def send_with_retry(aiobot: FakeAiobot, chat_id: int = 42) -> sender.SendResult:
+    return async_to_sync(sender.send_with_retry)(aiobot, NoPacer(), "send_message", chat_id, {"text": "hi"})
+
+
+def test_send_with_retry_backs_off_on_server_errors_and_an_open_circuit(settings, no_backoff):
+    settings.TELEGRAM_SEND_MAX_RETRIES = 3
+    aiobot = FakeAiobot(
+        errors={
+            42: [
+                aiogram.exceptions.TelegramServerError(method=None, message="Bad Gateway"),
+                CircuitOpenError(method=None, message="the calls of bot 1 are failing, not trying"),
+            ]
+        }
+    )
+
+    assert send_with_retry(aiobot) == sender.SendResult.SENT
+    assert aiobot.sent() == [42]
+    assert no_backoff == [1, 2]
+
+
+def test_send_with_retry_gives_up_after_the_max_retries(settings, no_backoff):
+    settings.TELEGRAM_SEND_MAX_RETRIES = 2
+    aiobot = FakeAiobot(
+        errors={42: [aiogram.exceptions.TelegramServerError(method=None, message="Bad Gateway") for _ in range(5)]}
+    )
+
+    assert send_with_retry(aiobot) == sender.SendResult.FAILED
+    assert aiobot.sent() == []
+    assert len(aiobot.errors[42]) == 2
+
+
+def test_send_with_retry_raises_when_the_token_is_revoked(no_backoff):
+    aiobot = FakeAiobot(
+        errors={42: [aiogram.exceptions.TelegramUnauthorizedError(method=None, message="Unauthorized")]}
+    )
+
+    with pytest.raises(aiogram.exceptions.TelegramUnauthorizedError):
+        send_with_retry(aiobot)
+    assert no_backoff == []
@@ -0,0 +1,156 @@
+from types import SimpleNamespace
+
+import pytest
+from asgiref.sync import async_to_sync
+from prometheus_client import REGISTRY
+
+import aiogram
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError
+from aiogram.methods import GetMe
+
+from ..session import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    GuardedAiohttpSession,
+    deadline,
+    get_session,
+)
+
+TOKEN = "42:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+OTHER_TOKEN = "43:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+
+
+@pytest.fixture
+def telegram(monkeypatch):
+    telegram = SimpleNamespace(calls=[], failing=set(), rejecting=set())
+
+    async def make_request(self, bot, method, timeout=None):
+        telegram.calls.append(timeout)
+        if bot.token in telegram.failing:
+            raise TelegramNetworkError(method=method, message="Request timeout error")
+        if bot.token in telegram.rejecting:
+            raise TelegramBadRequest(method=method, message="Bad Request: chat not found")
+        return "ok"
+
+    monkeypatch.setattr(AiohttpSession, "make_request", make_request)
+    return telegram
+
+
+def request(session, token):
+    return async_to_sync(session.make_request)(aiogram.Bot(token, session=session), GetMe())
+
+
+def test_breaker_opens_after_the_failures_of_the_window_and_probes_after_the_cooldown(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("televi1.telegram_bot.session.time.monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failures=3, window=10, cooldown=30)
+
+    breaker.record_failure()
+    now[0] += 11
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] += 31
+    assert breaker.allow()
+    # one probe at a time
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+
+def test_calls_of_a_failing_bot_fail_fast(telegram):
+    session = GuardedAiohttpSession(breaker_failures=3, breaker_window=30, breaker_cooldown=30)
+    telegram.failing.add(TOKEN)
+
+    for _ in range(3):
+        with pytest.raises(TelegramNetworkError):
+            request(session, TOKEN)
+    with pytest.raises(CircuitOpenError):
+        request(session, TOKEN)
+
+    assert len(telegram.calls) == 3
+    assert request(session, OTHER_TOKEN) == "ok"
+
+
+def test_errors_from_telegram_do_not_open_the_circuit(telegram):
+    session = GuardedAiohttpSession(breaker_failures=1, breaker_window=30, breaker_cooldown=30)
+    telegram.rejecting.add(TOKEN)
+
+    for _ in range(3):
+        with pytest.raises(TelegramBadRequest):
+            request(session, TOKEN)
+
+    assert len(telegram.calls) == 3
+
+
+def test_calls_wait_until_the_deadline_at_most(telegram):
+    session = GuardedAiohttpSession(breaker_failures=3, breaker_window=30, breaker_cooldown=30)
+
+    with deadline(5):
+        request(session, TOKEN)
+        with deadline(0), pytest.raises(DeadlineExceededError):
+            request(session, TOKEN)
+
+    assert len(telegram.calls) == 1 and 0 < telegram.calls[0] <= 5
+
+
+def test_the_bots_of_a_loop_share_its_pool_of_connections():
+    session = GuardedAiohttpSession(
+        breaker_failures=3, breaker_window=30, breaker_cooldown=30, pool_size=7, keepalive_timeout=5
+    )
+
+    async def use():
+        client = await session.create_session()
+        assert client is await session.create_session()
+        assert (client.connector.limit, client.connector._keepalive_timeout) == (7, 5)
+        assert session.stats() == {"limit": 7, "in_use": 0, "idle": 0, "waiting": 0}
+        # the private attributes that stats() reads
+        assert {"_acquired", "_conns", "_waiters"} <= vars(client.connector).keys()
+        await session.close()
+        return client
+
+    assert async_to_sync(use)().closed
+    assert session._sessions == {}
+
+    # the session of a loop that was not closed is dropped with its loop
+    async_to_sync(session.start)()
+    async_to_sync(session.start)()
+    assert len(session._sessions) == 1
+
+
+def test_the_pool_is_exported_as_the_api_calls_start(monkeypatch):
+    async def make_request(self, bot, method, timeout=None):
+        return True
+
+    monkeypatch.setattr(AiohttpSession, "make_request", make_request)
+    session = GuardedAiohttpSession(breaker_failures=3, breaker_window=30, breaker_cooldown=30, pool_size=7)
+
+    async def use():
+        await session.create_session()
+        await session.make_request(aiogram.Bot(TOKEN, session=session), GetMe())
+        await session.close()
+
+    async_to_sync(use)()
+
+    assert REGISTRY.get_sample_value("telegram_http_pool_connections", {"state": "limit"}) == 7
+
+
+def test_the_session_is_made_once_from_the_settings(settings):
+    settings.TELEGRAM_BREAKER_FAILURES = 2
+    settings.TELEGRAM_CHAT_BURST = 7
+    settings.TELEGRAM_HTTP_POOL_SIZE = 10
+    get_session.cache_clear()
+    try:
+        session = get_session()
+
+        assert get_session() is session
+        assert session.breaker_failures == 2
+        assert (session.rate_limiter.chat.burst, session.rate_limiter.chat.rate) == (7, settings.TELEGRAM_CHAT_RATE)
+        assert session._connector_init["limit"] == 10
+    finally:
+        get_session.cache_clear()
@@ -0,0 +1,100 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+from televi1.utils.redis import redis_batch
+
+from .. import models, stats
+from .factories import UploaderLinkFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_add_counters_upserts():
+    link = UploaderLinkFactory()
+    other_link = UploaderLinkFactory()
+
+    models.UploaderLinkStats.objects.add_counters([(link.id, 3, 2, 2)])
+    models.UploaderLinkStats.objects.add_counters([(link.id, 4, 1, 5), (other_link.id, 1, 0, 1)])
+
+    stats = models.UploaderLinkStats.objects.get(link=link)
+    assert (stats.opens, stats.deliveries, stats.unique_users) == (7, 3, 5)
+    other_stats = models.UploaderLinkStats.objects.get(link=other_link)
+    assert (other_stats.opens, other_stats.deliveries, other_stats.unique_users) == (1, 0, 1)
+
+
+def test_add_counters_keeps_bigger_unique_users():
+    link = UploaderLinkFactory()
+
+    models.UploaderLinkStats.objects.add_counters([(link.id, 1, 1, 10)])
+    models.UploaderLinkStats.objects.add_counters([(link.id, 1, 1, 9)])
+
+    assert models.UploaderLinkStats.objects.get(link=link).unique_users == 10
+
+
+def record_visits(*visits):
+    for ulink, user_tid, delivered in visits:
+        async_to_sync(stats.record_link_visit)(ulink, user_tid=user_tid, delivered=delivered)
+
+
+def get_counters(stats_obj) -> tuple[int, int, int]:
+    return stats_obj.opens, stats_obj.deliveries, stats_obj.unique_users
+
+
+def test_visits_are_counted_in_redis(fake_redis):
+    ulink = UploaderLinkFactory.build(id=1, uploader_id=2)
+
+    record_visits((ulink, 777, True), (ulink, 777, False))
+
+    async def in_batch():
+        async with redis_batch():
+            await stats.record_link_visit(ulink, user_tid=888, delivered=False)
+            assert fake_redis.round_trips == ["pipeline", "pipeline"]
+
+    async_to_sync(in_batch)()
+    assert fake_redis.round_trips == ["pipeline"] * 3
+    assert fake_redis.data[stats._link_key(1, "opens")] == b"3"
+    assert fake_redis.data[stats._link_key(1, "deliveries")] == b"1"
+    assert fake_redis.store.pfcount(stats._link_key(1, "users"), stats._uploader_key(2, "users")) == 2
+    assert fake_redis.data[stats.DIRTY_KEY] == {b"1:2"}
+
+
+def test_flush_moves_the_counters_to_the_database(fake_redis):
+    ulink = UploaderLinkFactory()
+    other_ulink = UploaderLinkFactory(uploader=ulink.uploader)
+    deleted_ulink = UploaderLinkFactory(uploader=ulink.uploader)
+    record_visits(
+        (ulink, 1, True), (ulink, 2, True), (ulink, 1, False), (other_ulink, 3, True), (deleted_ulink, 4, True)
+    )
+    deleted_ulink.delete()
+
+    assert stats.flush_pending() == 3
+
+    assert get_counters(models.UploaderLinkStats.objects.get(link=ulink)) == (3, 2, 2)
+    assert get_counters(models.UploaderLinkStats.objects.get(link=other_ulink)) == (1, 1, 1)
+    assert not models.UploaderLinkStats.objects.filter(link_id=deleted_ulink.id).exists()
+    assert get_counters(models.TelegramUploaderStats.objects.get(uploader=ulink.uploader)) == (5, 4, 4)
+    # the deltas are reset, the unique users stay since they are absolute
+    assert fake_redis.data[stats._link_key(ulink.id, "opens")] == b"0"
+    assert stats.DIRTY_KEY not in fake_redis.data and stats.FLUSHING_KEY not in fake_redis.data
+
+    record_visits((ulink, 5, False))
+    assert stats.flush_pending() == 1
+    assert get_counters(models.UploaderLinkStats.objects.get(link=ulink)) == (4, 2, 3)
+    assert stats.flush_pending() == 0
+
+
+def test_a_failed_flush_gives_the_counters_back(fake_redis, monkeypatch):
+    ulink = UploaderLinkFactory()
+    record_visits((ulink, 1, True), (ulink, 2, False))
+
+    def broken_add_counters(self, rows):
+        raise RuntimeError
+
+    with monkeypatch.context() as m:
+        m.setattr(models.StatsManager, "add_counters", broken_add_counters)
+        with pytest.raises(RuntimeError):
+            stats.flush_pending()
+    assert fake_redis.data[stats.DIRTY_KEY] == {f"{ulink.id}:{ulink.uploader_id}".encode()}
+
+    assert stats.flush_pending() == 1
+    assert get_counters(models.UploaderLinkStats.objects.get(link=ulink)) == (2, 1, 2)
@@ -0,0 +1,67 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+import aiogram
+from aiogram.dispatcher.event.handler import HandlerObject
+
+from televi1.utils import tracing
+
+from .. import models
+from ..t_middleware import TracingHandlerMiddleware, TracingMiddleware
+from .factories import TelegramBotFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def spans(settings, monkeypatch):
+    settings.TRACING_EXPORTER = "file"
+    spans = []
+    monkeypatch.setitem(tracing.EXPORTERS, "file", spans.extend)
+    yield spans
+
+
+async def start_handler():
+    await models.TelegramBot.objects.filter(id=-1).aexists()
+
+
+def run_update(tbot: models.TelegramBot, in_webhook: bool):
+    update = aiogram.types.Update(
+        update_id=7, message={"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "hi"}
+    )
+
+    async def handler(event, data):
+        data = {**data, "handler": HandlerObject(callback=start_handler)}
+        return await TracingHandlerMiddleware()(lambda event, data: start_handler(), event.message, data)
+
+    async def feed():
+        return await TracingMiddleware()(handler, update, {"bot_obj": tbot})
+
+    async def webhook():
+        with tracing.trace("webhook"):
+            await feed()
+
+    async_to_sync(webhook if in_webhook else feed)()
+    tracing.processor.flush()
+
+
+def test_polled_updates_are_traced(spans):
+    tbot = TelegramBotFactory()
+
+    run_update(tbot, in_webhook=False)
+
+    by_name = {i.name: i for i in spans}
+    root, handler, query = by_name["update"], by_name["handler start_handler"], by_name["db.query"]
+    assert (root.parent_id, handler.parent_id, query.parent_id) == (None, root.span_id, handler.span_id)
+    assert root.attributes == {"update_id": 7, "update_type": "message", "bot_id": tbot.id, "handler": "start_handler"}
+
+
+def test_webhook_updates_are_traced_under_the_webhook(spans):
+    tbot = TelegramBotFactory()
+
+    run_update(tbot, in_webhook=True)
+
+    by_name = {i.name: i for i in spans}
+    assert by_name["update"].parent_id == by_name["webhook"].span_id
+    assert by_name["webhook"].attributes["handler"] == "start_handler"
+    assert len({i.trace_id for i in spans}) == 1
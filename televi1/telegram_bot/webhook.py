@@ -1,5 +1,6 @@
 import json
 import secrets
+import time
 
 from asgiref.sync import sync_to_async
 
@@ -10,14 +11,15 @@ from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 
+from televi1.utils import tracing
 from televi1.utils.decorators import require_http_methods
+from televi1.utils.orm import get_orm_executor
 
-from . import models
+from . import metrics, models
 
 
 def get_webhook_view(dp: Dispatcher):
-    @require_http_methods(["POST"])
-    async def webhook_view(request, url_specifier: str):
+    async def _handle(request, url_specifier: str):
         telegram_bot_obj: models.TelegramBot = await sync_to_async(get_object_or_404)(
             models.TelegramBot.objects.filter(url_specifier=url_specifier).select_related("added_by")
         )
@@ -31,8 +33,11 @@ def get_webhook_view(dp: Dispatcher):
         bot = telegram_bot_obj.get_aiobot()
 
         update = Update.model_validate(json.loads(request.body), context={})
+        tracing.set_attributes(update_id=update.update_id, bot_id=telegram_bot_obj.id)
+        started_at = time.perf_counter()
         kw = {"aiobot": bot, "bot_obj": telegram_bot_obj}
-        method = await dp.feed_webhook_update(bot=bot, update=update, **kw)
+        # a slow update goes on in the background, aiogram calls the method it returns then
+        method = await dp.feed_webhook_update(bot=bot, update=update, _timeout=settings.TELEGRAM_WEBHOOK_TIMEOUT, **kw)
         data = {}
         if method is not None:
             if not settings.TELEGRAM_PREFER_REPLY_TO_WEBHOOK:
@@ -55,6 +60,15 @@ def get_webhook_view(dp: Dispatcher):
                     #     chunks.append(chunk)
                     # data[key] = b''.join(chunks)
 
+        metrics.WEBHOOK_SECONDS.labels(metrics.get_bot_kind(telegram_bot_obj), update.event_type).observe(
+            time.perf_counter() - started_at
+        )
         return HttpResponse(json.dumps(data), status=status.HTTP_200_OK, headers={"Content-Type": "application/json"})
 
+    @require_http_methods(["POST"])
+    async def webhook_view(request, url_specifier: str):
+        with tracing.trace("webhook"):
+            async with get_orm_executor().context():
+                return await _handle(request, url_specifier)
+
     return webhook_view
@@ -1,22 +1,88 @@
+import asyncio
+import os
+import threading
 from collections.abc import Coroutine
 from functools import wraps
 from typing import Any, Callable, ParamSpec, TypeVar
 
-from asgiref import sync
 from celery import Celery, Task
+from celery.signals import worker_process_shutdown, worker_shutdown
+
+from .orm import get_orm_executor
 
 _P = ParamSpec("_P")
 _R = TypeVar("_R")
 
 
+class WorkerLoop:
+    """
+    a long-lived event loop per worker process that runs in its own thread,
+    so the aiohttp sessions and redis pools bound to it are reused across tasks.
+    with a thread pool (--pool=threads) many async tasks run concurrently on the same loop.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+        self.on_startup: list[Callable[[], Coroutine]] = []
+        self.on_shutdown: list[Callable[[], Coroutine]] = []
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # the loop thread does not survive a fork of the prefork pool
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever, name="worker-loop", daemon=True).start()
+                # they start before the tasks submitted after this
+                for callback in self.on_startup:
+                    asyncio.run_coroutine_threadsafe(callback(), self._loop)
+            return self._loop
+
+    def run(self, coro: Coroutine[Any, Any, _R]) -> _R:
+        future = asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+        try:
+            return future.result()
+        except BaseException:
+            # a time limit (SoftTimeLimitExceeded) is raised in the waiting thread, the coroutine would go on
+            future.cancel()
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            loop = self._loop
+            if loop is None or self._pid != os.getpid():
+                return
+            self._loop = None
+        for callback in self.on_shutdown:
+            asyncio.run_coroutine_threadsafe(callback(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+worker_loop = WorkerLoop()
+
+
+# the pool processes of prefork get worker_process_shutdown, the threads pool and solo only worker_shutdown
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def _shutdown_worker_loop(**kwargs):
+    worker_loop.shutdown()
+
+
+async def _run_task(func: Callable[_P, Coroutine[Any, Any, _R]], *args: _P.args, **kwargs: _P.kwargs) -> _R:
+    # the orm of the concurrent tasks runs on the threads of the orm executor instead of asgiref's single
+    # thread, the executor checks the age of the connections of its threads before each call
+    async with get_orm_executor().context():
+        return await func(*args, **kwargs)
+
+
 def async_task(app: Celery, *args: Any, **kwargs: Any):
     def _decorator(func: Callable[_P, Coroutine[Any, Any, _R]]) -> Task:
-        sync_call = sync.AsyncToSync(func)
-
         @app.task(*args, **kwargs)
         @wraps(func)
         def _decorated(*args: _P.args, **kwargs: _P.kwargs) -> _R:
-            return sync_call(*args, **kwargs)
+            return worker_loop.run(_run_task(func, *args, **kwargs))
 
         return _decorated
 
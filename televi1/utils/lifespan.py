@@ -0,0 +1,40 @@
+import logging
+from collections.abc import Coroutine
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class Lifespan:
+    """
+    the asgi lifespan app, runs the callbacks on the loop of the server once it starts and before it stops,
+    for the clients bound to that loop
+    """
+
+    def __init__(self):
+        self.on_startup: list[Callable[[], Coroutine]] = []
+        self.on_shutdown: list[Callable[[], Coroutine]] = []
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    for callback in self.on_startup:
+                        await callback()
+                except Exception as e:
+                    logger.exception("starting up failed")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for callback in self.on_shutdown:
+                    try:
+                        await callback()
+                    except Exception:
+                        logger.exception("shutting down failed")
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+lifespan = Lifespan()
@@ -0,0 +1,77 @@
+"""
+prometheus metrics of the process, or of all of the processes of the container in multiprocess mode
+
+with PROMETHEUS_MULTIPROC_DIR set every process writes its metrics into that directory and whoever serves them
+(the /metrics view, or start_metrics_server in the processes without http) adds them up. the directory has to be
+emptied before the processes start, the start scripts do that.
+"""
+import os
+import secrets
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from prometheus_client import start_http_server as _start_http_server
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+
+def is_multiprocess() -> bool:
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+def get_registry() -> CollectorRegistry:
+    if not is_multiprocess():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    """closed unless METRICS_TOKEN is set, the scrapes send it as a bearer token"""
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    if not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+def start_metrics_server():
+    """serves the metrics on METRICS_PORT, for the processes that don't serve http (celery, polling)"""
+    if settings.METRICS_PORT:
+        _start_http_server(settings.METRICS_PORT, registry=get_registry())
+
+
+def mark_process_dead(pid: int):
+    """drops the live gauges of a process that exited"""
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
+
+
+_queries: ContextVar[list[int] | None] = ContextVar("query_counter", default=None)
+
+
+@contextmanager
+def count_queries():
+    """counts the queries run in the block, including the ones run by sync_to_async in other threads"""
+    counter = [0]
+    token = _queries.set(counter)
+    try:
+        yield counter
+    finally:
+        _queries.reset(token)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created receiver, the wrappers outlive the connections that are reused"""
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
@@ -0,0 +1,153 @@
+"""
+bounded thread pool for the orm calls of the telegram path
+
+django's async orm runs the queries with sync_to_async(thread_sensitive=True), that is one
+thread per process outside of a request (polling) and a new thread per request under asgi.
+inside `ORMExecutor.context()` they run on a shared pool instead, so concurrent updates run
+their queries in parallel while the number of threads, and so database connections, stays bounded.
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from asgiref.sync import SyncToAsync
+
+from django.conf import settings
+from django.db import connections
+
+from . import profiling
+
+# upper bounds of the queue wait buckets, in seconds
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, float("inf"))
+# called with every queue wait of the executors, the metrics are hooked here by the telegram_bot app
+wait_observers: list[Callable[[float], None]] = []
+
+
+class QueueWaitStats:
+    """how long the calls waited for a free thread"""
+
+    def __init__(self, window: int = 10_000):
+        self._lock = threading.Lock()
+        self._recent: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(WAIT_BUCKETS)
+
+    def observe(self, wait: float):
+        with self._lock:
+            self._recent.append(wait)
+            self.count += 1
+            self.total += wait
+            self.max = max(self.max, wait)
+            self.buckets[bisect.bisect_left(WAIT_BUCKETS, wait)] += 1
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            recent = sorted(self._recent)
+        if not recent:
+            return 0.0
+        return recent[min(int(len(recent) * q), len(recent) - 1)]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class _Context:
+    """keys the executor in asgiref's per context executors"""
+
+
+_thread_local = threading.local()
+
+
+def check_connections(max_age: float):
+    """
+    the pool threads keep their connections between the calls, the broken ones and
+    the ones older than max_age are closed here and reopened by the next query
+    """
+    opened_at = _thread_local.__dict__.setdefault("opened_at", {})
+    now = time.monotonic()
+    for conn in connections.all(initialized_only=True):
+        if conn.connection is None:
+            continue
+        raw_id, since = opened_at.get(conn.alias, (None, now))
+        if raw_id != id(conn.connection):
+            opened_at[conn.alias] = (id(conn.connection), now)
+            since = now
+        if (conn.errors_occurred and not conn.is_usable()) or now - since > max_age:
+            conn.close()
+
+
+def release_pooled_connections():
+    """with a pooled backend the threads share the connections of the pool instead of keeping their own"""
+    for conn in connections.all(initialized_only=True):
+        if hasattr(type(conn), "pool") and conn.connection is not None and not conn.in_atomic_block:
+            conn.close()
+
+
+class ORMExecutor(ThreadPoolExecutor):
+    def __init__(self, max_workers: int, conn_max_age: float):
+        super().__init__(max_workers=max_workers, thread_name_prefix="orm")
+        self.conn_max_age = conn_max_age
+        self.wait_stats = QueueWaitStats()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        # submitted from the context of the caller, the profile of the update if it's profiled
+        return super().submit(self._run, time.perf_counter(), profiling.get_profile(), fn, args, kwargs)
+
+    def _run(self, submitted_at: float, profile: profiling.Profile | None, fn, args, kwargs):
+        wait = time.perf_counter() - submitted_at
+        self.wait_stats.observe(wait)
+        for observer in wait_observers:
+            observer(wait)
+        check_connections(self.conn_max_age)
+        if profile is not None:
+            profile.attach(sys._getframe())
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.detach()
+            release_pooled_connections()
+
+    @asynccontextmanager
+    async def context(self):
+        """routes the thread sensitive sync_to_async calls of the block, and the tasks it starts, to the pool"""
+        # the way asgiref routes the calls of a request to its own thread, there is no public api for it.
+        # asgiref is pinned to its minor version in the Pipfile and tests/test_orm.py checks them
+        marker = _Context()
+        SyncToAsync.context_to_thread_executor[marker] = self
+        token = SyncToAsync.thread_sensitive_context.set(marker)
+        try:
+            yield self
+        finally:
+            # not unregistered, the map is weak and the tasks the block started may still run
+            # (the updates that go on in the background after the webhook answered)
+            SyncToAsync.thread_sensitive_context.reset(token)
+
+
+_executor: ORMExecutor | None = None
+_executor_pid: int | None = None
+_executor_lock = threading.Lock()
+
+
+def get_orm_executor() -> ORMExecutor:
+    global _executor, _executor_pid
+    with _executor_lock:
+        # the threads do not survive a fork
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ORMExecutor(settings.TELEGRAM_ORM_THREADS, settings.TELEGRAM_ORM_CONN_MAX_AGE)
+            _executor_pid = os.getpid()
+        return _executor
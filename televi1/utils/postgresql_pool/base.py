@@ -0,0 +1,182 @@
+"""
+postgresql backend with a per process connection pool
+
+django opens a connection per thread and closes it at the end of every request (CONN_MAX_AGE=0),
+with this backend the close returns it to a pool shared by all the threads of the process.
+configured with OPTIONS["pool"], the same place django 5.1's own pool is configured:
+
+    "OPTIONS": {"pool": {"max_size": 20, "timeout": 10}}
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from psycopg import IsolationLevel
+from psycopg.pq import TransactionStatus
+
+from django.db.backends.postgresql import base
+
+DEFAULT_MAX_SIZE = 20
+# seconds to wait for a connection when all of them are in use
+DEFAULT_TIMEOUT = 10
+# idle connections are checked with a query before they are handed out after this many seconds
+DEFAULT_CHECK_AFTER = 30
+# connections are reopened after this many seconds, so the server side memory does not grow forever
+DEFAULT_MAX_LIFETIME = 30 * 60
+
+
+class PoolTimeout(base.Database.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        check_after: float = DEFAULT_CHECK_AFTER,
+        max_lifetime: float = DEFAULT_MAX_LIFETIME,
+    ):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_lifetime = max_lifetime
+        self._cond = threading.Condition()
+        # (connection, returned_at), the most recently returned one is handed out first
+        self._idle: deque[tuple[base.Database.Connection, float]] = deque()
+        self._created_at: dict[int, float] = {}
+        self.size = 0
+        self.waiting = 0
+
+    def getconn(self, connect) -> base.Database.Connection:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while not self._idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"no connection became free in {self.timeout} seconds")
+                    self.waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self.waiting -= 1
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                else:
+                    conn = None
+                    self.size += 1
+
+            if conn is None:
+                try:
+                    conn = connect()
+                except BaseException:
+                    self.discard(None)
+                    raise
+                self._created_at[id(conn)] = time.monotonic()
+                return conn
+            if self._is_healthy(conn, returned_at):
+                return conn
+            self.discard(conn)
+
+    def putconn(self, conn: base.Database.Connection):
+        if not conn.closed and not conn.broken:
+            status = conn.info.transaction_status
+            if status in (TransactionStatus.INTRANS, TransactionStatus.INERROR):
+                try:
+                    conn.rollback()
+                    status = conn.info.transaction_status
+                except base.Database.Error:
+                    pass
+            if status == TransactionStatus.IDLE:
+                with self._cond:
+                    self._idle.append((conn, time.monotonic()))
+                    self._cond.notify()
+                return
+        self.discard(conn)
+
+    def _is_healthy(self, conn: base.Database.Connection, returned_at: float) -> bool:
+        now = time.monotonic()
+        if conn.closed or conn.broken or now - self._created_at.get(id(conn), now) > self.max_lifetime:
+            return False
+        if now - returned_at > self.check_after:
+            try:
+                conn.execute("SELECT 1")
+            except base.Database.Error:
+                return False
+        return True
+
+    def discard(self, conn: base.Database.Connection | None):
+        if conn is not None:
+            self._created_at.pop(id(conn), None)
+            try:
+                conn.close()
+            except base.Database.Error:
+                pass
+        with self._cond:
+            self.size -= 1
+            self._cond.notify()
+
+    def close_all(self):
+        """closes the idle connections, the ones in use are closed when they are returned"""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self.discard(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"size": self.size, "idle": len(self._idle), "waiting": self.waiting, "max_size": self.max_size}
+
+
+_pools: dict[tuple[int, str, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias: str, name: str, options: dict) -> ConnectionPool:
+    # the connections of the parent must not be used after a fork,
+    # and the name changes when the test database is set up
+    key = (os.getpid(), alias, name)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(**options)
+        return _pools[key]
+
+
+class DatabaseCreation(base.DatabaseCreation):
+    def destroy_test_db(self, *args, **kwargs):
+        # the idle connections would keep the test database from being dropped
+        self.connection.close()
+        self.connection.pool.close_all()
+        return super().destroy_test_db(*args, **kwargs)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    @property
+    def pool(self) -> ConnectionPool:
+        return get_pool(self.alias, self.settings_dict["NAME"], self.settings_dict["OPTIONS"].get("pool", {}))
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop("pool", None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        conn = self.pool.getconn(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        # set by the parent when it actually connects, the reused connections need it as well
+        self.isolation_level = IsolationLevel(
+            self.settings_dict["OPTIONS"].get("isolation_level", IsolationLevel.READ_COMMITTED)
+        )
+        return conn
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.in_atomic_block:
+            # django keeps referencing the connection of a broken atomic block, it can't be shared
+            self.pool.discard(self.connection)
+            return
+        self.pool.putconn(self.connection)
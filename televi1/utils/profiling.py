@@ -0,0 +1,168 @@
+"""
+statistical profiles of single units of work (the telegram updates), to tell where the slow ones spend their time
+
+while there are profiles running a thread takes the stacks of all of the threads every `interval`. a sample of
+the thread of the profile counts for it if the profiled frame is on the stack, that is the coroutine is running
+and not awaiting. the threads running sync code for it (the orm pool) attach themselves and are sampled meanwhile.
+the allocations are the diff of two tracemalloc snapshots, they include whatever else the process did meanwhile.
+"""
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import FrameType
+
+# the allocation diffs keep the top lines only
+ALLOCATIONS_LIMIT = 30
+
+
+def _get_stack(frame: FrameType | None, root: FrameType | None = None) -> str | None:
+    """the folded stack (the format of flamegraph.pl and speedscope) from root to frame, None if root isn't on it"""
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}")
+        if frame is root:
+            break
+        frame = frame.f_back
+    else:
+        if root is not None:
+            return None
+    return ";".join(reversed(names)) if names else None
+
+
+class Profile:
+    def __init__(self, frame: FrameType, trace_allocations: bool = False):
+        self.frame = frame
+        self.thread_id = threading.get_ident()
+        # the threads running sync code for the profile, and the frames they run it from
+        self.threads: dict[int, FrameType] = {}
+        self.trace_allocations = trace_allocations
+        # what got profiled, the name of the handler of the update
+        self.name: str | None = None
+        self.stacks: Counter[str] = Counter()
+        self.allocations: list[str] = []
+        self._snapshot: tracemalloc.Snapshot | None = None
+
+    @property
+    def samples(self) -> int:
+        return self.stacks.total()
+
+    def attach(self, frame: FrameType):
+        """samples the current thread from frame on, until it detaches"""
+        self.threads[threading.get_ident()] = frame
+
+    def detach(self):
+        self.threads.pop(threading.get_ident(), None)
+
+    def collect(self, frames: dict[int, FrameType]):
+        for thread_id, root in [(self.thread_id, self.frame), *self.threads.items()]:
+            stack = _get_stack(frames.get(thread_id), root)
+            if stack:
+                self.stacks[stack] += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def start(self):
+        if self.trace_allocations:
+            _start_tracing()
+            self._snapshot = _take_snapshot()
+
+    def stop(self):
+        if self._snapshot is None:
+            return
+        try:
+            stats = _take_snapshot().compare_to(self._snapshot, "lineno")
+            self.allocations = [str(i) for i in stats[:ALLOCATIONS_LIMIT]]
+        finally:
+            self._snapshot = None
+            _stop_tracing()
+
+
+_tracing_lock = threading.Lock()
+_tracing_profiles = 0
+_tracing_started = False
+
+
+def _start_tracing():
+    global _tracing_profiles, _tracing_started
+    with _tracing_lock:
+        if _tracing_profiles == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_profiles += 1
+
+
+def _stop_tracing():
+    """stops tracing with the last profile unless something else started it"""
+    global _tracing_profiles, _tracing_started
+    with _tracing_lock:
+        _tracing_profiles -= 1
+        if _tracing_profiles == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+
+class Sampler:
+    """the sampling thread, it runs while there are profiles"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        # held while collecting too, so a removed profile isn't written to anymore
+        self._lock = threading.Lock()
+        self._profiles: set[Profile] = set()
+        self._thread: threading.Thread | None = None
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: Profile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for i in self._profiles:
+                    i.collect(frames)
+            del frames
+            time.sleep(self.interval)
+
+
+sampler = Sampler(interval=0.005)
+
+_profile: ContextVar[Profile | None] = ContextVar("profile", default=None)
+
+
+def get_profile() -> Profile | None:
+    return _profile.get()
+
+
+@contextmanager
+def profile(frame: FrameType, trace_allocations: bool = False):
+    """profiles frame (the one of the coroutine calling it) in the block"""
+    profile = Profile(frame, trace_allocations=trace_allocations)
+    token = _profile.set(profile)
+    profile.start()
+    sampler.add(profile)
+    try:
+        yield profile
+    finally:
+        sampler.remove(profile)
+        profile.stop()
+        _profile.reset(token)
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from redis.asyncio import Redis
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Redis] = weakref.WeakKeyDictionary()
+
+
+def get_async_redis() -> Redis:
+    """
+    returns the asyncio redis client of the running event loop
+    connection pools of redis.asyncio are bound to the loop they are created in,
+    so one client is kept per loop instead of a module level one
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = Redis.from_url(settings.REDIS_URL)
+        _clients[loop] = client
+    return client
+
+
+class RedisBatch:
+    """
+    the redis reads and writes of a unit of work, an update for example. the keys it's going to read
+    are fetched with one MGET up front and the writes are buffered and sent in one pipeline at the end,
+    the reads see the buffered writes.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._values: dict[str, bytes | None] = {}
+        self._writes: list[tuple[str, tuple, dict]] = []
+
+    async def prefetch(self, keys: list[str]):
+        missing = [i for i in dict.fromkeys(keys) if i not in self._values]
+        if missing:
+            self._values.update(zip(missing, await self.redis.mget(missing)))
+
+    async def get(self, key: str) -> bytes | None:
+        if key not in self._values:
+            self._values[key] = await self.redis.get(key)
+        return self._values[key]
+
+    async def exists(self, *keys: str) -> int:
+        return sum([await self.get(i) is not None for i in keys])
+
+    async def set(self, key: str, value, **kwargs):
+        self._values[key] = self.redis.get_encoder().encode(value)
+        self.buffer("set", key, value, **kwargs)
+
+    async def delete(self, *keys: str):
+        for i in keys:
+            self._values[i] = None
+        self.buffer("delete", *keys)
+
+    def buffer(self, command: str, *args, **kwargs):
+        """queues any other write command, its effect is not seen by the reads of the batch"""
+        self._writes.append((command, args, kwargs))
+
+    async def flush(self):
+        writes, self._writes = self._writes, []
+        if not writes:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for command, args, kwargs in writes:
+            getattr(pipe, command)(*args, **kwargs)
+        await pipe.execute()
+
+
+_batch: ContextVar[RedisBatch | None] = ContextVar("redis_batch", default=None)
+
+
+@asynccontextmanager
+async def redis_batch():
+    """
+    the redis calls made through get_batched_redis in the block go through one batch. the writes are flushed
+    at the end even if the block raises, a failed flush is only logged since the work is done by then
+    """
+    batch = RedisBatch(get_async_redis())
+    token = _batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _batch.reset(token)
+        try:
+            await batch.flush()
+        except Exception:
+            logger.exception("flushing the redis writes of the batch failed")
+
+
+def get_redis_batch() -> RedisBatch | None:
+    return _batch.get()
+
+
+def get_batched_redis() -> RedisBatch | Redis:
+    """the batch of the running unit of work if there's one, otherwise the client, both get, exists, set and delete"""
+    return _batch.get() or get_async_redis()
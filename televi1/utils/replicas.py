@@ -0,0 +1,97 @@
+"""
+routes the reads of the read only code paths to the replicas of the default database
+
+everything goes to the primary unless it runs inside `database_scope(replicas=True)`, and even there
+the reads go back to the primary once the scope writes, or when it's pinned, that is its user wrote
+something a moment ago and the replicas may not have caught up yet. the pins are kept in redis so
+they hold across the processes (webhook, polling, workers).
+"""
+import logging
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .redis import get_batched_redis
+
+logger = logging.getLogger(__name__)
+
+PIN_KEY_PREFIX = "televi1:primary-pin"
+
+
+@dataclass
+class DatabaseScope:
+    replicas: bool = False
+    pinned: bool = False
+    # set by the router, the scope object is shared with the threads sync_to_async runs the queries on
+    wrote: bool = False
+
+
+_scope: ContextVar[DatabaseScope | None] = ContextVar("database_scope", default=None)
+
+
+@contextmanager
+def database_scope(replicas: bool = False, pinned: bool = False):
+    scope = DatabaseScope(replicas=replicas, pinned=pinned)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        scope = _scope.get()
+        if scope is None or not scope.replicas or scope.pinned or scope.wrote or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        # a transaction is opened on the primary, what it reads must come from there too
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        # the related objects of an object read from the primary may not be on the replicas yet either
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db == DEFAULT_DB_ALIAS:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        scope = _scope.get()
+        if scope is not None:
+            scope.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def pin_key(user_tid: int) -> str:
+    return f"{PIN_KEY_PREFIX}:{user_tid}"
+
+
+async def is_pinned(user_tid: int) -> bool:
+    try:
+        return bool(await get_batched_redis().exists(pin_key(user_tid)))
+    except Exception:
+        logger.exception("reading the primary pin failed")
+        # a stale read is worse than a busier primary
+        return True
+
+
+async def pin(user_tid: int):
+    """keeps the reads of the user on the primary for DATABASE_REPLICA_PIN_SECONDS"""
+    try:
+        await get_batched_redis().set(pin_key(user_tid), 1, px=int(settings.DATABASE_REPLICA_PIN_SECONDS * 1000))
+    except Exception:
+        logger.exception("writing the primary pin failed")
@@ -0,0 +1,69 @@
+import asyncio
+import signal
+import threading
+import time
+
+import pytest
+from asgiref.sync import sync_to_async
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_shutdown
+
+from .. import celery
+from ..celery import WorkerLoop
+
+
+def test_a_time_limit_cancels_the_coroutine():
+    worker_loop = WorkerLoop()
+    canceled = threading.Event()
+
+    async def task():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            canceled.set()
+            raise
+
+    def soft_time_limit(signum, frame):
+        raise SoftTimeLimitExceeded
+
+    # the way celery raises it in the thread of the task
+    previous = signal.signal(signal.SIGALRM, soft_time_limit)
+    signal.setitimer(signal.ITIMER_REAL, 0.2)
+    try:
+        with pytest.raises(SoftTimeLimitExceeded):
+            worker_loop.run(task())
+    finally:
+        signal.signal(signal.SIGALRM, previous)
+
+    assert canceled.wait(5)
+    worker_loop.shutdown()
+
+
+def test_the_loop_is_shut_down_by_the_worker_shutdown_of_the_threads_pool(monkeypatch):
+    worker_loop = WorkerLoop()
+    monkeypatch.setattr(celery, "worker_loop", worker_loop)
+    closed = []
+
+    async def close():
+        closed.append(True)
+
+    worker_loop.on_shutdown.append(close)
+    loop = worker_loop.get_loop()
+
+    worker_shutdown.send(sender=None)
+
+    assert closed == [True]
+    assert worker_loop._loop is None
+    time.sleep(0.1)
+    assert not loop.is_running()
+
+
+def test_the_orm_of_the_tasks_runs_on_the_orm_threads():
+    async def task():
+        return await sync_to_async(lambda: threading.current_thread().name)()
+
+    worker_loop = WorkerLoop()
+    try:
+        assert worker_loop.run(celery._run_task(task)).startswith("orm")
+    finally:
+        worker_loop.shutdown()
@@ -0,0 +1,47 @@
+from asgiref.sync import async_to_sync
+
+from ..lifespan import Lifespan
+
+
+def run(lifespan: Lifespan, messages: list[str]) -> list[str]:
+    received, sent = [{"type": i} for i in messages], []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    async_to_sync(lifespan)({"type": "lifespan"}, receive, send)
+    return sent
+
+
+def test_callbacks_run_on_startup_and_shutdown():
+    lifespan, calls = Lifespan(), []
+
+    async def start():
+        calls.append("start")
+
+    async def stop():
+        calls.append("stop")
+        raise ValueError
+
+    lifespan.on_startup.append(start)
+    lifespan.on_shutdown.append(stop)
+
+    assert run(lifespan, ["lifespan.startup", "lifespan.shutdown"]) == [
+        "lifespan.startup.complete",
+        "lifespan.shutdown.complete",
+    ]
+    assert calls == ["start", "stop"]
+
+
+def test_failed_startup_is_reported():
+    lifespan = Lifespan()
+
+    async def start():
+        raise ValueError("no connection")
+
+    lifespan.on_startup.append(start)
+
+    assert run(lifespan, ["lifespan.startup"]) == ["lifespan.startup.failed"]
@@ -0,0 +1,39 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+from django.http import Http404
+from django.test import RequestFactory
+
+from televi1.telegram_bot import models
+
+from ..metrics import count_queries, metrics_view
+
+
+@pytest.mark.parametrize(
+    "token,authorization,status",
+    [("secret", None, 403), ("secret", "Bearer other", 403), ("secret", "Bearer secret", 200)],
+)
+def test_metrics_view_checks_the_token(settings, token, authorization, status):
+    settings.METRICS_TOKEN = token
+    headers = {"authorization": authorization} if authorization else {}
+    response = metrics_view(RequestFactory().get("/metrics", headers=headers))
+
+    assert response.status_code == status
+
+
+def test_metrics_view_is_closed_without_a_token(settings):
+    settings.METRICS_TOKEN = None
+
+    with pytest.raises(Http404):
+        metrics_view(RequestFactory().get("/metrics"))
+
+
+@pytest.mark.django_db
+def test_queries_of_the_block_are_counted():
+    async def work():
+        await models.TelegramBot.objects.filter(id=-1).aexists()
+        await models.TelegramBot.objects.filter(id=-1).aexists()
+
+    with count_queries() as queries:
+        async_to_sync(work)()
+    assert queries[0] == 2
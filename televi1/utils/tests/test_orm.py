@@ -0,0 +1,42 @@
+import asyncio
+import contextvars
+import threading
+import weakref
+
+from asgiref.sync import SyncToAsync, sync_to_async
+
+from ..orm import ORMExecutor
+
+
+def current_thread_name():
+    return threading.current_thread().name
+
+
+def test_thread_sensitive_calls_run_in_parallel_on_the_pool():
+    executor = ORMExecutor(max_workers=4, conn_max_age=60)
+    # would time out if the calls were serialized on a single thread
+    barrier = threading.Barrier(4, timeout=5)
+
+    def blocking():
+        barrier.wait()
+        return current_thread_name()
+
+    async def main():
+        async with executor.context():
+            names = await asyncio.gather(*(sync_to_async(blocking)() for _ in range(4)))
+        return names, await sync_to_async(current_thread_name)()
+
+    try:
+        names, outside_name = asyncio.run(main())
+    finally:
+        executor.shutdown()
+
+    assert len(set(names)) == 4 and all(i.startswith("orm") for i in names)
+    assert not outside_name.startswith("orm")
+    assert executor.wait_stats.count == 4
+
+
+def test_the_private_routing_of_asgiref_is_still_there():
+    """ORMExecutor.context relies on them, see the pin of asgiref in the Pipfile"""
+    assert isinstance(SyncToAsync.context_to_thread_executor, weakref.WeakKeyDictionary)
+    assert isinstance(SyncToAsync.thread_sensitive_context, contextvars.ContextVar)
@@ -0,0 +1,92 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from django.db import connection
+
+from ..postgresql_pool.base import DatabaseWrapper, PoolTimeout
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def make_wrapper(request):
+    alias = f"pool-{request.node.name}"
+    pools = []
+
+    def make(**pool_options) -> DatabaseWrapper:
+        settings_dict = {
+            **connection.settings_dict,
+            "ENGINE": "televi1.utils.postgresql_pool",
+            "OPTIONS": {**connection.settings_dict["OPTIONS"], "pool": pool_options},
+        }
+        wrapper = DatabaseWrapper(settings_dict, alias=alias)
+        pools.append(wrapper.pool)
+        return wrapper
+
+    yield make
+    for i in pools:
+        i.close_all()
+
+
+def backend_pid(wrapper: DatabaseWrapper) -> int:
+    with wrapper.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        return cursor.fetchone()[0]
+
+
+def test_threads_share_at_most_max_size_connections(make_wrapper):
+    pids = set()
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(20):
+            # every thread has its own wrapper, just like django's per thread connections
+            wrapper = make_wrapper(max_size=3, timeout=5)
+            pid = backend_pid(wrapper)
+            wrapper.close()
+            with lock:
+                pids.add(pid)
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        for i in [executor.submit(worker) for _ in range(10)]:
+            i.result()
+
+    pool = make_wrapper().pool
+    assert 1 <= len(pids) <= 3
+    assert pool.stats()["size"] == pool.stats()["idle"] <= 3
+
+
+def test_broken_connection_is_replaced(make_wrapper):
+    wrapper = make_wrapper(max_size=1, timeout=1)
+    pid = backend_pid(wrapper)
+    raw_connection = wrapper.connection
+    wrapper.close()
+    raw_connection.close()
+
+    assert backend_pid(wrapper) != pid
+    wrapper.close()
+
+
+def test_open_transaction_is_rolled_back_on_return(make_wrapper):
+    wrapper = make_wrapper(max_size=1, timeout=1)
+    wrapper.ensure_connection()
+    wrapper.connection.execute("BEGIN")
+    wrapper.connection.execute("CREATE TEMPORARY TABLE pool_leftover (id int)")
+    wrapper.close()
+
+    with wrapper.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('pool_leftover')")
+        assert cursor.fetchone()[0] is None
+    wrapper.close()
+
+
+def test_times_out_when_exhausted(make_wrapper):
+    wrapper = make_wrapper(max_size=1, timeout=0.1)
+    wrapper.ensure_connection()
+    other_wrapper = make_wrapper(max_size=1, timeout=0.1)
+
+    with pytest.raises(PoolTimeout):
+        other_wrapper.pool.getconn(lambda: None)
+    wrapper.close()
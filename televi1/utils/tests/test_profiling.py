@@ -0,0 +1,62 @@
+import asyncio
+import sys
+import time
+
+from asgiref.sync import async_to_sync
+
+from .. import profiling
+
+
+def spin(seconds: float):
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        pass
+
+
+def test_only_the_running_profiled_coroutine_is_sampled():
+    async def profiled():
+        with profiling.profile(sys._getframe()) as profile:
+            for _ in range(10):
+                spin(0.01)
+                await asyncio.sleep(0)
+        return profile
+
+    async def other():
+        for _ in range(10):
+            spin(0.01)
+            await asyncio.sleep(0)
+
+    async def main():
+        profile, _ = await asyncio.gather(profiled(), other())
+        return profile
+
+    profile = async_to_sync(main)()
+
+    assert any(i.endswith(".spin") for i in profile.stacks)
+    assert all(
+        i.startswith(f"{__name__}.test_only_the_running_profiled_coroutine_is_sampled.<locals>.profiled")
+        for i in profile.stacks
+    )
+
+
+def test_attached_threads_are_sampled_and_allocations_traced():
+    async def profiled():
+        with profiling.profile(sys._getframe(), trace_allocations=True) as profile:
+            await asyncio.to_thread(work, profile)
+        return profile
+
+    def work(profile: profiling.Profile):
+        profile.attach(sys._getframe())
+        try:
+            spin(0.05)
+            return [bytearray(1000) for _ in range(100)]
+        finally:
+            profile.detach()
+
+    profile = async_to_sync(profiled)()
+
+    assert any(
+        i.startswith(f"{__name__}.test_attached_threads_are_sampled_and_allocations_traced.<locals>.work;")
+        for i in profile.stacks
+    )
+    assert any("test_profiling.py" in i for i in profile.allocations)
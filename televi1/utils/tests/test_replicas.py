@@ -0,0 +1,58 @@
+import pytest
+from asgiref.sync import async_to_sync
+
+from django.db import transaction
+
+from televi1.telegram_bot import models
+from televi1.telegram_bot.tests.factories import TelegramBotFactory
+
+from ..replicas import ReplicaRouter, database_scope
+
+# the tests of a plain django_db run in a transaction, so every read would be on the primary
+pytestmark = pytest.mark.django_db(transaction=True)
+
+router = ReplicaRouter()
+
+
+@pytest.fixture(autouse=True)
+def replicas(settings):
+    settings.DATABASE_REPLICAS = ["replica_0"]
+
+
+def test_reads_go_to_the_primary_outside_of_a_replica_scope():
+    assert router.db_for_read(models.TelegramBot) == "default"
+    with database_scope(replicas=False):
+        assert router.db_for_read(models.TelegramBot) == "default"
+
+
+def test_reads_go_to_the_replicas_until_the_scope_writes():
+    with database_scope(replicas=True) as scope:
+        assert router.db_for_read(models.TelegramBot) == "replica_0"
+
+        async_to_sync(models.TelegramBot.objects.filter(id=-1).aupdate)(is_revoked=True)
+
+        assert scope.wrote
+        assert router.db_for_read(models.TelegramBot) == "default"
+
+
+def test_pinned_scope_reads_from_the_primary():
+    with database_scope(replicas=True, pinned=True):
+        assert router.db_for_read(models.TelegramBot) == "default"
+
+
+def test_reads_in_a_transaction_go_to_the_primary():
+    with database_scope(replicas=True), transaction.atomic():
+        assert router.db_for_read(models.TelegramBot) == "default"
+
+
+def test_related_objects_of_primary_objects_are_read_from_the_primary():
+    tbot = TelegramBotFactory()
+    with database_scope(replicas=True):
+        assert router.db_for_read(models.TelegramIdentity, instance=tbot) == "default"
+        tbot._state.db = "replica_0"
+        assert router.db_for_read(models.TelegramIdentity, instance=tbot) == "replica_0"
+
+
+def test_replicas_are_not_migrated():
+    assert router.allow_migrate("replica_0", "telegram_bot") is False
+    assert router.allow_migrate("default", "telegram_bot") is None
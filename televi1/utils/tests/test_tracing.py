@@ -0,0 +1,107 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+from asgiref.sync import async_to_sync
+
+from django.db import connection
+
+from televi1.telegram_bot import models
+
+from .. import tracing
+
+
+@pytest.fixture
+def spans(settings, monkeypatch):
+    settings.TRACING_EXPORTER = "file"
+    settings.TRACING_SAMPLE_RATE = 1
+    spans = []
+    monkeypatch.setitem(tracing.EXPORTERS, "file", spans.extend)
+    yield spans
+
+
+@contextmanager
+def capture_queries():
+    """the sql as it's sent, the wrappers added later run after the ones of the app"""
+    queries = []
+
+    def capture(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(capture):
+        yield queries
+
+
+@pytest.mark.django_db
+def test_queries_are_commented_and_spanned_under_their_update(spans):
+    async def handle():
+        with tracing.trace("webhook"):
+            tracing.set_attributes(update_id=7, bot_id=3)
+            with tracing.span("handler"):
+                tracing.set_attributes(handler="start_handler")
+                await models.TelegramBot.objects.filter(id=-1).aexists()
+
+    with capture_queries() as queries:
+        async_to_sync(handle)()
+    tracing.processor.flush()
+
+    by_name = {i.name: i for i in spans}
+    root, handler, query = by_name["webhook"], by_name["handler"], by_name["db.query"]
+    assert {i.trace_id for i in spans} == {root.trace_id}
+    assert (root.parent_id, handler.parent_id, query.parent_id) == (None, root.span_id, handler.span_id)
+    assert root.attributes == {"update_id": 7, "bot_id": 3, "handler": "start_handler"}
+    assert query.attributes["db.statement"].startswith("SELECT")
+    assert queries[0].endswith(
+        f"/*bot_id='3',handler='start_handler',traceparent='00-{root.trace_id}-{query.span_id}-01',update_id='7'*/"
+    )
+
+
+@pytest.mark.django_db
+def test_nothing_is_traced_when_it_is_off(settings, spans):
+    settings.TRACING_EXPORTER = None
+
+    async def handle():
+        with tracing.trace("webhook", update_id=7):
+            await models.TelegramBot.objects.filter(id=-1).aexists()
+
+    with capture_queries() as queries:
+        async_to_sync(handle)()
+    tracing.processor.flush()
+
+    assert spans == []
+    assert "/*" not in queries[0]
+
+
+def test_spans_are_exported_as_otlp_json(settings, monkeypatch):
+    settings.TRACING_OTLP_ENDPOINT = "http://collector:4318/v1/traces"
+    requests = []
+
+    class Response:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    monkeypatch.setattr(
+        tracing.urllib.request, "urlopen", lambda request, timeout: requests.append(request) or Response()
+    )
+    span = tracing.Span(
+        trace_id="a" * 32,
+        span_id="b" * 16,
+        parent_id=None,
+        name="webhook",
+        start=1,
+        end=2,
+        attributes={"update_id": 7},
+    )
+    span.error = "ValueError"
+
+    tracing.export_to_otlp([span])
+
+    assert requests[0].full_url == "http://collector:4318/v1/traces"
+    [otlp_span] = json.loads(requests[0].data)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert otlp_span["traceId"] == "a" * 32
+    assert otlp_span["attributes"] == [{"key": "update_id", "value": {"intValue": "7"}}]
+    assert otlp_span["status"] == {"code": 2, "message": "ValueError"}
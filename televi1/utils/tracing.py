@@ -0,0 +1,246 @@
+"""
+traces of the telegram updates, their spans are the sql queries, the fsm redis calls and the bot api calls
+
+a trace is started by the webhook view, or by TracingMiddleware for the polled updates, and carries the update id,
+the bot id and the handler. the queries get them in an sqlcommenter comment, so a query in the database logs or in
+pg_stat_activity can be matched to its update. the spans are exported in the background as they finish, by
+TRACING_EXPORTER: "file" writes json lines into logs/traces.log (rotated by LOGGING), "otlp" posts otlp/http json
+to TRACING_OTLP_ENDPOINT (the otel collector, jaeger, tempo, ...).
+"""
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections.abc import Callable
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+traces_logger = logging.getLogger("televi1.traces")
+
+SERVICE_NAME = "televi1"
+# sql longer than that is cut in the spans
+STATEMENT_LIMIT = 1000
+BATCH_SIZE = 512
+# the spans over that are dropped while the exporter lags behind
+QUEUE_SIZE = 10_000
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    sampled: bool
+    attributes: dict[str, Any]
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    name: str
+    # unix time in nanoseconds
+    start: int
+    end: int = 0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+
+_trace: ContextVar[Trace | None] = ContextVar("trace", default=None)
+_span: ContextVar[Span | None] = ContextVar("span", default=None)
+
+
+def get_trace() -> Trace | None:
+    return _trace.get()
+
+
+def set_attributes(**attributes):
+    """attributes of the trace, its root span gets them once it's finished"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """starts a trace and its root span, or just a span if there's a trace already"""
+    if _trace.get() is not None:
+        set_attributes(**attributes)
+        with span(name) as root:
+            yield root
+        return
+
+    sampled = bool(settings.TRACING_EXPORTER) and random.random() < settings.TRACING_SAMPLE_RATE
+    token = _trace.set(Trace(trace_id=secrets.token_hex(16), sampled=sampled, attributes=attributes))
+    try:
+        with span(name) as root:
+            yield root
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    trace = _trace.get()
+    if trace is None or not trace.sampled:
+        yield None
+        return
+
+    parent = _span.get()
+    current = Span(
+        trace_id=trace.trace_id,
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent is not None else None,
+        name=name,
+        start=time.time_ns(),
+        attributes=attributes,
+    )
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        _span.reset(token)
+        current.end = time.time_ns()
+        if current.parent_id is None:
+            current.attributes = {**trace.attributes, **current.attributes}
+        processor.submit(current)
+
+
+def _get_sql_comment(trace: Trace, span: Span) -> str:
+    """the sqlcommenter comment, https://google.github.io/sqlcommenter/spec/"""
+    values = {"traceparent": f"00-{trace.trace_id}-{span.span_id}-01"}
+    for key in ("update_id", "bot_id", "handler"):
+        if trace.attributes.get(key) is not None:
+            values[key] = trace.attributes[key]
+    return ",".join(f"{key}='{urllib.parse.quote(str(value))}'" for key, value in sorted(values.items()))
+
+
+def _trace_query(execute, sql, params, many, context):
+    trace = _trace.get()
+    if trace is None or not trace.sampled:
+        return execute(sql, params, many, context)
+    with span("db.query", **{"db.statement": sql[:STATEMENT_LIMIT]}) as query_span:
+        comment = _get_sql_comment(trace, query_span)
+        if params is not None:
+            # the sql is %-formatted with the params then
+            comment = comment.replace("%", "%%")
+        return execute(f"{sql} /*{comment}*/", params, many, context)
+
+
+def install_query_tracer(sender, connection, **kwargs):
+    """
+    connection_created receiver, every query of a sampled trace gets a db.query span and a sqlcommenter
+    comment with the traceparent, so the slow query log of postgres leads back to the update
+    """
+    if _trace_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_trace_query)
+
+
+def export_to_file(spans: list[Span]):
+    for i in spans:
+        traces_logger.info(json.dumps(asdict(i), default=str))
+
+
+def _get_otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def export_to_otlp(spans: list[Span]):
+    otlp_spans = [
+        {
+            "traceId": i.trace_id,
+            "spanId": i.span_id,
+            "parentSpanId": i.parent_id or "",
+            "name": i.name,
+            "kind": 1,
+            "startTimeUnixNano": str(i.start),
+            "endTimeUnixNano": str(i.end),
+            "attributes": [{"key": k, "value": _get_otlp_value(v)} for k, v in i.attributes.items() if v is not None],
+            "status": {"code": 2, "message": i.error} if i.error else {},
+        }
+        for i in spans
+    ]
+    body = {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": otlp_spans}],
+            }
+        ]
+    }
+    request = urllib.request.Request(
+        settings.TRACING_OTLP_ENDPOINT,
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=10):
+        pass
+
+
+EXPORTERS: dict[str, Callable[[list[Span]], None]] = {"file": export_to_file, "otlp": export_to_otlp}
+
+
+class SpanProcessor:
+    """exports the finished spans in batches from a thread, off the event loop"""
+
+    def __init__(self):
+        self._queue: queue.Queue[Span] = queue.Queue(maxsize=QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._pid: int | None = None
+
+    def submit(self, span: Span):
+        # the thread does not survive a fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+                    threading.Thread(target=self._run, args=(self._queue,), name="span-exporter", daemon=True).start()
+                    self._pid = os.getpid()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    def flush(self):
+        """waits for the spans submitted so far to be exported"""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def _run(self, spans_queue: queue.Queue[Span]):
+        while True:
+            batch = [spans_queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(spans_queue.get(timeout=0.5))
+                except queue.Empty:
+                    break
+            try:
+                EXPORTERS[settings.TRACING_EXPORTER](batch)
+            except Exception:
+                logger.exception(f"exporting {len(batch)} spans failed")
+            finally:
+                for _ in batch:
+                    spans_queue.task_done()
+
+
+processor = SpanProcessor()